@@ -1,55 +1,91 @@
+import asyncio
 import os
 import google.generativeai as genai
-from google.generativeai.types import FunctionDeclaration, Tool
-from .tools import GEMINI_TOOLS, AVAILABLE_TOOLS
+from .tools import GEMINI_TOOLS, call_tool
 
 # Configure Gemini
 api_key = os.getenv("GEMINI_API_KEY")
 if api_key:
     genai.configure(api_key=api_key)
 
+ASSISTANT_MAX_TOOL_ROUNDS = int(os.getenv("ASSISTANT_MAX_TOOL_ROUNDS", "4"))
+SYSTEM_PROMPT = "You are a helpful IoT Assistant. Use the available tools to fetch real-time weather and IoT data. Always cite sources. If asked for weather in a city, geocode it first."
+
 model = None
 
 def get_model():
     global model
     if not api_key:
         return None
-    
+
     if not model:
-        # Create the model with tools
-        tools = genai.protos.Tool(function_declarations=[
-             # We rely on the SDK's auto-conversion or define manual if SDK fails auto-inspect
-             # For simplicity in this environment, let's trust the auto-tool detection if using genai.GenerativeModel(tools=...)
-             # But the safest way for "google-generativeai" is just passing the function list.
-             # SDK automatically inspects docstrings.
-        ])
-        
-        # Initialize Gemini Pro
+        # Function calls are executed by stream_chat (async, concurrent, cached),
+        # so the SDK only needs the declarations built from the tool signatures
         model = genai.GenerativeModel(
             model_name='gemini-2.0-flash', # Fast and smart
-            tools=GEMINI_TOOLS
+            tools=GEMINI_TOOLS,
+            system_instruction=SYSTEM_PROMPT,
         )
     return model
 
-async def process_chat(user_message: str):
+def _function_response(name: str, result) -> "genai.protos.Part":
+    return genai.protos.Part(function_response=genai.protos.FunctionResponse(name=name, response={"result": result}))
+
+async def stream_chat(user_message: str):
+    """
+    Async chat with manual function calling, yielding events as they happen:
+        {"type": "delta", "text": ...}            partial reply text
+        {"type": "tool_call", "name", "args"}     the model requested a tool
+        {"type": "tool_result", "name", "result"}
+        {"type": "done", "reply": ...}            full reply (always last)
+    All tool calls of one model turn run concurrently. Nothing here blocks the
+    event loop, so a slow chat never stalls ingestion on the same worker.
+    """
+    chat_model = get_model()
+    if not chat_model:
+        reply = "I cannot answer because the GEMINI_API_KEY is missing."
+        yield {"type": "done", "reply": reply}
+        return
+
+    contents = [genai.protos.Content(role="user", parts=[genai.protos.Part(text=user_message)])]
+    reply = []
     try:
-        chat_model = get_model()
-        if not chat_model:
-             return {
-                "reply": "I cannot answer because the GEMINI_API_KEY is missing.",
-                "data": None
-            }
-
-        # Start a chat session (stateless for this API, but we simulate one-turn)
-        chat = chat_model.start_chat(enable_automatic_function_calling=True)
-        
-        # System instruction is implicit in the prompt or added as context
-        system_prompt = "You are a helpful IoT Assistant. Use the available tools to fetch real-time weather and IoT data. Always cite sources. If asked for weather in a city, geocode it first."
-        
-        response = chat.send_message(f"{system_prompt}\n\nUser: {user_message}")
-        
-        return {"reply": response.text, "data": None}
+        for _ in range(ASSISTANT_MAX_TOOL_ROUNDS + 1):
+            response = await chat_model.generate_content_async(contents, stream=True)
+            parts, calls = [], []
+            async for chunk in response:
+                for candidate in chunk.candidates[:1]:
+                    for part in candidate.content.parts:
+                        if part.function_call.name:
+                            calls.append(part.function_call)
+                            parts.append(part)
+                        elif part.text:
+                            reply.append(part.text)
+                            parts.append(part)
+                            yield {"type": "delta", "text": part.text}
+            contents.append(genai.protos.Content(role="model", parts=parts))
+            if not calls:
+                break
+
+            pending = [(call.name, {k: v for k, v in call.args.items()}) for call in calls]
+            for name, args in pending:
+                yield {"type": "tool_call", "name": name, "args": args}
+            results = await asyncio.gather(*(call_tool(name, args) for name, args in pending))
+            for (name, _), result in zip(pending, results):
+                yield {"type": "tool_result", "name": name, "result": result}
+            contents.append(genai.protos.Content(
+                role="user", parts=[_function_response(name, result) for (name, _), result in zip(pending, results)]
+            ))
+        yield {"type": "done", "reply": "".join(reply)}
 
     except Exception as e:
         print(f"Gemini AI Error: {e}")
-        return {"reply": "Sorry, I encountered an error connecting to the Gemini AI service.", "data": None}
+        yield {"type": "done", "reply": "Sorry, I encountered an error connecting to the Gemini AI service."}
+
+async def process_chat(user_message: str):
+    """Whole reply at once (non-streaming clients)."""
+    reply = ""
+    async for event in stream_chat(user_message):
+        if event["type"] == "done":
+            reply = event["reply"]
+    return {"reply": reply, "data": None}
@@ -1,40 +1,54 @@
-import requests
+from ..services import gazetteer, http_client
+from ..services.api_cache import APICache
+import asyncio
 import json
+import os
 from datetime import datetime
 
+ASSISTANT_TOOL_TIMEOUT = float(os.getenv("ASSISTANT_TOOL_TIMEOUT", "10"))
+
+# Results are cached per (tool, args); lifetimes follow how fast the data changes
+TOOL_TTLS = {
+    "geocode_city": 7 * 24 * 3600,
+    "get_weather": 600,
+    "get_thingspeak_latest": 30,
+}
+tool_caches = {
+    name: APICache(ttl_seconds=ttl, max_entries=512, name=f"assistant:{name}") for name, ttl in TOOL_TTLS.items()
+}
+
 # --- Tool Implementations ---
 
-def geocode_city(city_name: str):
+async def geocode_city(city_name: str):
     """
     Finds the latitude and longitude for a given city name.
     """
     try:
-        url = f"https://geocoding-api.open-meteo.com/v1/search?name={city_name}&count=1&language=en&format=json"
-        res = requests.get(url).json()
-        if "results" in res and res["results"]:
-            data = res["results"][0]
+        place = await gazetteer.geocode(city_name)
+        if place:
             return {
-                "name": data["name"],
-                "lat": data["latitude"],
-                "lon": data["longitude"],
-                "country": data.get("country")
+                "name": place["name"],
+                "lat": place["lat"],
+                "lon": place["lon"],
+                "country": place.get("country"),
+                "timezone": place.get("timezone")
             }
         return {"error": "City not found"}
     except Exception as e:
         return {"error": str(e)}
 
-def get_weather(lat: float, lon: float):
+async def get_weather(lat: float, lon: float):
     """
     Fetches official current weather and hourly forecast summary.
     """
     try:
         url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,weather_code,wind_speed_10m&hourly=temperature_2m&timezone=auto&forecast_days=1"
-        res = requests.get(url).json()
-        
+        res = await http_client.get_json(url, timeout=ASSISTANT_TOOL_TIMEOUT)
+
         current = res.get("current", {})
         hourly_temps = res.get("hourly", {}).get("temperature_2m", [])
         avg_temp = sum(hourly_temps) / len(hourly_temps) if hourly_temps else 0
-        
+
         return {
             "current": {
                 "temperature": current.get("temperature_2m"),
@@ -50,13 +64,13 @@ def get_weather(lat: float, lon: float):
     except Exception as e:
         return {"error": str(e)}
 
-def get_thingspeak_latest(channel_id: str):
+async def get_thingspeak_latest(channel_id: str):
     """
     Fetches the latest feed from a public ThingSpeak channel.
     """
     try:
         url = f"https://api.thingspeak.com/channels/{channel_id}/feeds/last.json"
-        res = requests.get(url).json()
+        res = await http_client.get_json(url, timeout=ASSISTANT_TOOL_TIMEOUT)
         return {
             "channel_id": channel_id,
             "data": res,
@@ -67,13 +81,33 @@ def get_thingspeak_latest(channel_id: str):
 
 # --- Tool Definitions (Gemini Native) ---
 
-# Gemini SDK takes the functions directly
+# Gemini SDK builds the function declarations from these signatures/docstrings
 GEMINI_TOOLS = [geocode_city, get_weather, get_thingspeak_latest]
 
-# Map names to functions for execution (still needed for local lookup if manual, 
-# but Gemini SDK handles execution automatically in many cases, though we might interpret the response manually)
+# Map names to functions for execution (function calls are executed by the
+# assistant engine, not by the SDK)
 AVAILABLE_TOOLS = {
     "geocode_city": geocode_city,
     "get_weather": get_weather,
     "get_thingspeak_latest": get_thingspeak_latest
 }
+
+async def call_tool(name: str, args: dict):
+    """
+    Run a tool by name through the (tool, args) result cache.
+    Concurrent identical calls share one upstream request; errors are not cached.
+    """
+    func = AVAILABLE_TOOLS.get(name)
+    if func is None:
+        return {"error": f"Unknown tool: {name}"}
+
+    async def run():
+        try:
+            return await asyncio.wait_for(func(**args), ASSISTANT_TOOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {"error": f"{name} timed out"}
+        except TypeError as e:
+            return {"error": f"Invalid arguments for {name}: {e}"}
+
+    key = json.dumps(args, sort_keys=True, default=str)
+    return await tool_caches[name].get_or_load(key, run, cache_if=lambda r: isinstance(r, dict) and "error" not in r)
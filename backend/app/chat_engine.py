@@ -1,24 +1,125 @@
 import re
 import random
-import httpx
 import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from .services import gazetteer, http_client
+
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "100000"))
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", "1800"))  # Idle seconds before a session's context is forgotten
+CHAT_SESSION_FILE = os.getenv("CHAT_SESSION_FILE")  # Optional JSON file persisting contexts across restarts
+
+
+class SessionContext:
+    """Follow-up context of one chat session (last resolved city, its coordinates and UTC offset)."""
+    __slots__ = ("city", "lat", "lon", "utc_offset", "touched")
+
+    def __init__(self, city=None, lat=None, lon=None, utc_offset=None, touched=0.0):
+        self.city = city
+        self.lat = lat
+        self.lon = lon
+        self.utc_offset = utc_offset  # Seconds east of UTC, once known
+        self.touched = touched
+
+    def remember_city(self, name: str, lat: float, lon: float, utc_offset: Optional[int] = None):
+        if name != self.city:
+            self.utc_offset = None
+        self.city, self.lat, self.lon = name, lat, lon
+        if utc_offset is not None:
+            self.utc_offset = utc_offset
+
+
+class SessionStore:
+    """
+    Session id -> SessionContext with LRU + idle-TTL eviction (at most `max_sessions`).
+    Every method is synchronous and never awaits, so on the event loop each call
+    is atomic: concurrent chats need no lock.
+    """
+
+    def __init__(self, max_sessions: int = CHAT_SESSION_MAX, ttl_seconds: int = CHAT_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl_seconds
+        self._sessions: "OrderedDict[str, SessionContext]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expire(self, now: float):
+        # Least recently used first, so expired sessions are always at the front
+        while self._sessions:
+            key, ctx = next(iter(self._sessions.items()))
+            if now - ctx.touched < self.ttl:
+                break
+            del self._sessions[key]
+
+    def get(self, session_id: str) -> SessionContext:
+        """The session's context (created empty if unknown or expired), marked as used."""
+        now = time.monotonic()
+        self._expire(now)
+        ctx = self._sessions.get(session_id)
+        if ctx is None:
+            ctx = self._sessions[session_id] = SessionContext()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        ctx.touched = now
+        return ctx
+
+    def save(self, path: str):
+        """Write live contexts to `path` (ages, not clock values, so they survive restarts)."""
+        now = time.monotonic()
+        self._expire(now)
+        records = {
+            key: [ctx.city, ctx.lat, ctx.lon, ctx.utc_offset, now - ctx.touched]
+            for key, ctx in self._sessions.items() if ctx.city
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(records, f, separators=(",", ":"))
+        os.replace(tmp, path)
+        return len(records)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            records = json.load(f)
+        now = time.monotonic()
+        # Oldest first, so LRU order is preserved
+        for key, (city, lat, lon, utc_offset, age) in sorted(records.items(), key=lambda kv: -kv[1][4]):
+            if age < self.ttl:
+                self._sessions[key] = SessionContext(city, lat, lon, utc_offset, now - age)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return len(self._sessions)
+
 
 class ChatEngine:
     def __init__(self):
-        self.context = {}
+        self.sessions = SessionStore()
         
-    async def process_query(self, query: str):
+    async def process_query(self, query: str, session_id: str):
+        """Answer one query; follow-ups ("what time is it there?") resolve against `session_id`'s context."""
+        if not session_id:
+            raise ValueError("session_id is required")
         query = query.lower().strip()
+        ctx = self.sessions.get(session_id)
         
         # 0. Context / Follow-up Logic
         # "what time is it there?", "how about in london?"
         target_city = None
         
         if "there" in query or "it" in query:
-             target_city = self.context.get('last_city')
+             target_city = ctx.city
         
         # 1. Extraction
-        city_match = re.search(r'(in|at|for) ([a-z\s]+)', query)
+        city_match = re.search(r'\b(in|at|for) ([a-z\s]+)', query)
         if city_match:
             target_city = city_match.group(2).strip()
             # Clean up command words if caught "navigate to london" -> "london"
@@ -27,22 +128,21 @@ class ChatEngine:
         # 2. Routing
         if "time" in query:
             if target_city:
-                return await self.get_time(target_city)
+                return await self.get_time(target_city, ctx)
             else:
                 return "Which city are you referring to?"
 
         if "weather" in query or "temperature" in query or "hot" in query or "cold" in query:
             if target_city:
-                return await self.get_weather(target_city)
+                return await self.get_weather(target_city, ctx)
             if not target_city:
                 return "Please specify a city."
 
-        # 3. Status Report (REAL DB Data)
+        # 3. Status Report (latest ingested reading)
         if "status" in query or "readings" in query or "system" in query:
-            from . import database, models
-            db = database.SessionLocal()
+            from .services.latest_store import latest_store
             try:
-                latest = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+                latest = latest_store.newest()
                 if latest:
                     return (f"Current environmental telemetry: Temperature {latest.temperature:.1f}°C, "
                             f"Humidity {latest.humidity:.1f}%, "
@@ -52,9 +152,8 @@ class ChatEngine:
                 else:
                     return "System online. Waiting for initial sensor data stream."
             except Exception:
-                return "Internal database connection failed."
-            finally:
-                db.close()
+                # Incomplete reading (e.g. no pressure sensor)
+                return "Telemetry stream is incomplete. Some sensors are not reporting."
 
         # 4. Identity / Small Talk
         small_talk = {
@@ -77,83 +176,69 @@ class ChatEngine:
 
         return "I'm listening. You can ask about weather, time, system status, or general topics."
 
-    async def get_weather(self, city: str):
+    async def _geocode(self, city: str, ctx: SessionContext):
+        """(lat, lon, name) for a city, from the session context when it is the last city discussed."""
+        if ctx.city and city.lower() == ctx.city.lower() and ctx.lat is not None:
+            return ctx.lat, ctx.lon, ctx.city
+        # Offline gazetteer first (also gives the timezone), remote API on a miss
+        place = await gazetteer.geocode(city)
+        if not place:
+            return None
+        ctx.remember_city(place["name"], place["lat"], place["lon"], gazetteer.utc_offset_seconds(place.get("timezone")))
+        return place["lat"], place["lon"], place["name"]
+
+    async def get_weather(self, city: str, ctx: Optional[SessionContext] = None):
+        ctx = ctx or SessionContext()  # One-off lookup: no session to remember it in
         try:
-            # 1. Geocode
-            geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1&language=en&format=json"
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(geo_url)
-                data = resp.json()
-                
-                if not data.get("results"):
-                    return f"I could not locate {city}."
-                    
-                lat = data["results"][0]["latitude"]
-                lon = data["results"][0]["longitude"]
-                name = data["results"][0]["name"]
-                
-                # Update Context
-                self.context['last_city'] = name
-                self.context['lat'] = lat
-                self.context['lon'] = lon
-                
-                # 2. Weather
-                weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
-                w_resp = await client.get(weather_url)
-                w_data = w_resp.json()
-                
-                temp = w_data["current_weather"]["temperature"]
-                wind = w_data["current_weather"]["windspeed"]
-                
-                return f"In {name}, it is currently {temp} degrees Celsius. Wind speed is {wind} kilometers per hour."
+            # 1. Geocode (skipped for follow-ups about the same city)
+            located = await self._geocode(city, ctx)
+            if not located:
+                return f"I could not locate {city}."
+            lat, lon, name = located
+            
+            # 2. Weather (timezone=auto also gives the UTC offset for later "what time is it there?")
+            weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&timezone=auto"
+            w_resp = await http_client.get(weather_url)
+            w_data = w_resp.json()
+            if "utc_offset_seconds" in w_data:
+                ctx.remember_city(name, lat, lon, w_data["utc_offset_seconds"])
+            
+            temp = w_data["current_weather"]["temperature"]
+            wind = w_data["current_weather"]["windspeed"]
+            
+            return f"In {name}, it is currently {temp} degrees Celsius. Wind speed is {wind} kilometers per hour."
                 
         except Exception:
             return "Unable to fetch weather data at this time."
 
-    async def get_time(self, city: str):
+    async def get_time(self, city: str, ctx: Optional[SessionContext] = None):
+        ctx = ctx or SessionContext()  # One-off lookup: no session to remember it in
         try:
-             # Reuse Geocode logic or Context
-             lat, lon, name = None, None, city
+             located = await self._geocode(city, ctx)
+             if not located:
+                 return f"Unknown city {city}."
+             lat, lon, name = located
+
+             # Known UTC offset for this city: answer without any upstream call
+             if ctx.city == name and ctx.utc_offset is not None:
+                 local = datetime.utcnow() + timedelta(seconds=ctx.utc_offset)
+                 return f"The local time in {name} is {local.strftime('%H:%M')}."
+
+             # Open-Meteo forecast with timezone=auto returns local time and utc_offset_seconds
+             tz_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&timezone=auto"
+             tz_resp = await http_client.get(tz_url)
+             tz_data = tz_resp.json()
+             if "utc_offset_seconds" in tz_data:
+                 ctx.remember_city(name, lat, lon, tz_data["utc_offset_seconds"])
              
-             if city == self.context.get('last_city'):
-                 lat = self.context.get('lat')
-                 lon = self.context.get('lon')
-                 name = self.context.get('last_city')
+             local_time_iso = tz_data.get("current_weather", {}).get("time", "")
+             # Format: 2023-10-27T10:00
+             if local_time_iso:
+                 time_part = local_time_iso.split('T')[1]
+                 return f"The local time in {name} is {time_part}."
+             
+             return f"I have the coordinates for {name}, but cannot determine local time."
              
-             async with httpx.AsyncClient() as client:
-                 if not lat:
-                    geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1&language=en&format=json"
-                    resp = await client.get(geo_url)
-                    data = resp.json()
-                    if not data.get("results"): return f"Unknown city {city}."
-                    lat = data["results"][0]["latitude"]
-                    lon = data["results"][0]["longitude"]
-                    name = data["results"][0]["name"]
-                    
-                    self.context['last_city'] = name
-                    self.context['lat'] = lat
-                    self.context['lon'] = lon
-
-                 # Get Timezone via Open-Meteo (it returns timezone in geocode or we use lat/long to find it)
-                 # Better: Use TimeApi or just the timezone field from Open-Meteo forecast
-                 # Open-Meteo forecast headers have utc_offset
-                 
-                 tz_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true&timezone=auto"
-                 tz_resp = await client.get(tz_url)
-                 tz_data = tz_resp.json()
-                 
-                 # Parse local time from response or offset
-                 # Open-Meteo returns "current_weather": {"time": "2023-..."} in UTC? No, if timezone=auto it attempts local
-                 # actually 'current_weather.time' is ISO.
-                 
-                 local_time_iso = tz_data.get("current_weather", {}).get("time", "")
-                 # Format: 2023-10-27T10:00
-                 if local_time_iso:
-                     time_part = local_time_iso.split('T')[1]
-                     return f"The local time in {name} is {time_part}."
-                 
-                 return f"I have the coordinates for {name}, but cannot determine local time."
-                 
         except Exception:
             return "Time synchronization failed."
 
@@ -163,19 +248,37 @@ class ChatEngine:
             topic_clean = topic.replace(" ", "_")
             url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{topic_clean}"
             
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(url, follow_redirects=True)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    summary = data.get("extract", "")
-                    if summary:
-                        # Limit length for voice (first 2 sentences)
-                        sentences = summary.split('. ')
-                        short_summary = '. '.join(sentences[:2]) + '.'
-                        return short_summary
+            resp = await http_client.get(url, follow_redirects=True)
+            if resp.status_code == 200:
+                data = resp.json()
+                summary = data.get("extract", "")
+                if summary:
+                    # Limit length for voice (first 2 sentences)
+                    sentences = summary.split('. ')
+                    short_summary = '. '.join(sentences[:2]) + '.'
+                    return short_summary
                     
             return f"I searched my archives for {topic}, but found no clear definition."
         except Exception:
             return "I am unable to connect to the knowledge base right now."
 
 chat_engine = ChatEngine()
+
+
+def load_sessions():
+    """Restore persisted session contexts (CHAT_SESSION_FILE), if configured."""
+    if not CHAT_SESSION_FILE:
+        return
+    try:
+        print(f"[ChatEngine] Restored {chat_engine.sessions.load(CHAT_SESSION_FILE)} chat sessions")
+    except Exception as e:
+        print(f"[ChatEngine] Session restore failed: {e}")
+
+
+def save_sessions():
+    if not CHAT_SESSION_FILE:
+        return
+    try:
+        print(f"[ChatEngine] Persisted {chat_engine.sessions.save(CHAT_SESSION_FILE)} chat sessions")
+    except Exception as e:
+        print(f"[ChatEngine] Session persist failed: {e}")
@@ -1,6 +1,11 @@
+import asyncio
+import time
 from abc import ABC, abstractmethod
 
 class BaseConnector(ABC):
+    # geo_cache provider name for location-based sources (None = not cached)
+    provider = None
+
     def __init__(self, device_id: str, config: dict):
         self.device_id = device_id
         self.config = config
@@ -18,6 +23,18 @@ class BaseConnector(ABC):
         }
         """
         pass
+
+    async def fetch_data_async(self):
+        """
+        Async variant of fetch_data() (same return shape).
+        HTTP-backed connectors override this with a native implementation on the
+        shared client; the default runs the blocking fetch in a worker thread.
+        """
+        return await asyncio.to_thread(self.fetch_data)
+
+    def offline_result(self):
+        """Result returned when the source cannot be reached."""
+        return {"status": "offline", "ts": int(time.time()), "metrics": {}}
     
     @abstractmethod
     def get_history(self, range_str: str):
@@ -1,33 +1,46 @@
-import requests
+from ..services import http_client
+from ..services.http_client import sync_get
 import time
 from .base import BaseConnector
 from datetime import datetime, timedelta
 
 class OpenMeteoConnector(BaseConnector):
-    def fetch_data(self):
+    provider = "open_meteo"
+
+    def _current_url(self):
         lat = self.config.get("lat")
         lon = self.config.get("lon")
+        return f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,surface_pressure,wind_speed_10m&timezone=auto"
+
+    def _parse_current(self, data):
+        current = data.get("current", {})
         
+        return {
+            "ts": int(time.time()),
+            "metrics": {
+                "temperatureC": current.get("temperature_2m"),
+                "humidityPct": current.get("relative_humidity_2m"),
+                "pressureHPa": current.get("surface_pressure"),
+                "windMS": current.get("wind_speed_10m")
+            },
+            "status": "online"
+        }
+
+    def fetch_data(self):
         try:
-            url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,surface_pressure,wind_speed_10m&timezone=auto"
-            response = requests.get(url)
-            data = response.json()
-            
-            current = data.get("current", {})
-            
-            return {
-                "ts": int(time.time()),
-                "metrics": {
-                    "temperatureC": current.get("temperature_2m"),
-                    "humidityPct": current.get("relative_humidity_2m"),
-                    "pressureHPa": current.get("surface_pressure"),
-                    "windMS": current.get("wind_speed_10m")
-                },
-                "status": "online"
-            }
+            response = sync_get(self._current_url())
+            return self._parse_current(response.json())
+        except Exception as e:
+            print(f"Open-Meteo Fetch Error: {e}")
+            return self.offline_result()
+
+    async def fetch_data_async(self):
+        try:
+            response = await http_client.get(self._current_url())
+            return self._parse_current(response.json())
         except Exception as e:
             print(f"Open-Meteo Fetch Error: {e}")
-            return {"status": "offline", "ts": int(time.time()), "metrics": {}}
+            return self.offline_result()
 
     def get_history(self, range_str: str):
         # Determine days based on range (Open-Meteo limits free history, using forecast/recent history)
@@ -40,7 +53,7 @@ class OpenMeteoConnector(BaseConnector):
         
         try:
             url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&hourly=temperature_2m,relative_humidity_2m,surface_pressure&past_days={days}&forecast_days=1"
-            response = requests.get(url)
+            response = sync_get(url)
             data = response.json()
             
             hourly = data.get("hourly", {})
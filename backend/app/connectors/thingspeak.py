@@ -1,40 +1,51 @@
-import requests
+from ..services import http_client
+from ..services.http_client import sync_get
 import time
 from datetime import datetime
 from .base import BaseConnector
 
 class ThingSpeakConnector(BaseConnector):
-    def fetch_data(self):
+    def _last_url(self):
         channel_id = self.config.get("channel_id")
         # Optional field mapping: default field1=Temp, field2=Hum, etc.
+        return f"https://api.thingspeak.com/channels/{channel_id}/feeds/last.json"
+
+    def _parse_last(self, data):
+        # ThingSpeak returns timestamp in ISO 8601
+        created_at = data.get("created_at")
+        source_ts = int(datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp()) if created_at else int(time.time())
         
+        # Map Fields (Assumed standard mapping for demo, extendable via config)
+        metrics = {
+            "temperatureC": float(data.get("field1", 0) or 0),
+            "humidityPct": float(data.get("field2", 0) or 0),
+            "pressureHPa": float(data.get("field3", 0) or 0),
+            "windMS": float(data.get("field4", 0) or 0),
+            "pm25": float(data.get("field5", 0) or 0)
+        }
+        
+        return {
+            "ts": int(time.time()),
+            "source_ts": source_ts,
+            "metrics": metrics,
+            "status": "online"
+        }
+
+    def fetch_data(self):
         try:
-            url = f"https://api.thingspeak.com/channels/{channel_id}/feeds/last.json"
-            response = requests.get(url, timeout=10)
-            data = response.json()
-            
-            # ThingSpeak returns timestamp in ISO 8601
-            created_at = data.get("created_at")
-            source_ts = int(datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp()) if created_at else int(time.time())
-            
-            # Map Fields (Assumed standard mapping for demo, extendable via config)
-            metrics = {
-                "temperatureC": float(data.get("field1", 0) or 0),
-                "humidityPct": float(data.get("field2", 0) or 0),
-                "pressureHPa": float(data.get("field3", 0) or 0),
-                "windMS": float(data.get("field4", 0) or 0),
-                "pm25": float(data.get("field5", 0) or 0)
-            }
-            
-            return {
-                "ts": int(time.time()),
-                "source_ts": source_ts,
-                "metrics": metrics,
-                "status": "online"
-            }
+            response = sync_get(self._last_url(), timeout=10)
+            return self._parse_last(response.json())
+        except Exception as e:
+            print(f"ThingSpeak Fetch Error: {e}")
+            return self.offline_result()
+
+    async def fetch_data_async(self):
+        try:
+            response = await http_client.get(self._last_url(), timeout=10)
+            return self._parse_last(response.json())
         except Exception as e:
             print(f"ThingSpeak Fetch Error: {e}")
-            return {"status": "offline", "ts": int(time.time()), "metrics": {}}
+            return self.offline_result()
 
     def get_history(self, range_str: str):
         channel_id = self.config.get("channel_id")
@@ -43,7 +54,7 @@ class ThingSpeakConnector(BaseConnector):
         
         try:
             url = f"https://api.thingspeak.com/channels/{channel_id}/feeds.json?results={results}"
-            response = requests.get(url)
+            response = sync_get(url)
             data = response.json()
             feeds = data.get("feeds", [])
             
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import os
-from datetime import datetime as dt, timedelta
+from datetime import datetime as dt, timedelta, timezone
 from typing import List, Optional
 import math
 print(f"LOADING MAIN FROM {__file__}")
@@ -9,10 +9,11 @@ print(f"LOADING MAIN FROM {__file__}")
 
 from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
-from . import models, schemas, database, admin_setup
+from . import models, schemas, database, admin_setup, chat_engine
 from .connectors.open_meteo import OpenMeteoConnector
 from .connectors.thingspeak import ThingSpeakConnector
 from .connectors.waqi import WAQIConnector
@@ -20,11 +21,12 @@ from .connectors.openaq import OpenAQConnector
 from .connectors.esp32_stub import ESP32StubConnector
 
 from .routers import assistant, auth_v2 as auth, map as map_router, pro_api, push_notifications, industrial
-from .routers.push_notifications import send_push_notification_to_user
-from .services import kalman_filter, aqi_calculator, external_apis, fusion_engine, weather_service
+from .services import kalman_filter, aqi_calculator, external_apis, fusion_engine, weather_service, http_client, geo_cache, geo_index, alert_rules, mail_outbox, push_dispatcher, pubsub, rollups, data_export, cold_storage, aggregator, snapshot_cache
+from .services.latest_store import latest_store, sync_loop as latest_sync_loop
 
 from .services.websocket_manager import manager
-from .services.api_cache import refresh_map_cache, get_cached_markers
+from .ml_engine import anomaly_registry, ANOMALY_DETECTION_ENABLED
+from .services.api_cache import refresh_map_cache, get_cached_markers, cache_stats
 
 # --- Logging Configuration ---
 logging.basicConfig(
@@ -48,6 +50,8 @@ def health_check():
 # Moved to startup_event for better error handling in FastAPI
 @app.on_event("startup")
 async def startup_event():
+    http_client.bind_loop(asyncio.get_running_loop())  # For worker-thread callers (push fan-out)
+    await pubsub.start()  # WebSocket backplane (PUBSUB_URL)
     try:
         # 1. Database Schema
         models.Base.metadata.create_all(bind=database.engine)
@@ -57,11 +61,44 @@ async def startup_event():
         
         # 3. Map Cache
         asyncio.create_task(refresh_map_cache())
+
+        # 4. Geofencing index of user locations
+        await asyncio.to_thread(geo_index.user_index.load)
+        asyncio.create_task(geo_index.sync_loop())
+
+        # 5. Outbound mail workers (drain the email outbox)
+        mail_outbox.start_workers()
+
+        # 6. Per-device Kalman state (restore + periodic snapshot)
+        await kalman_filter.restore_filter_states()
+        asyncio.create_task(kalman_filter.snapshot_filter_states_loop())
+
+        # 7. Rollup compaction (backfills an empty rollup table first)
+        asyncio.create_task(rollups.compaction_loop())
+
+        # 8. Latest reading per device (warm from device_latest, then follow other workers)
+        await asyncio.to_thread(latest_store.load)
+        asyncio.create_task(latest_sync_loop())
+
+        # 9. Cold storage tiering (only with COLD_STORAGE_ENABLED=true)
+        asyncio.create_task(cold_storage.tiering_loop())
+
+        # 10. Chat follow-up contexts (only with CHAT_SESSION_FILE)
+        chat_engine.load_sessions()
         
         logger.info("EcoSync Backend Initialized Successfully.")
     except Exception as e:
         logger.error(f"Startup execution failed: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await kalman_filter.persist_filter_states(dirty_only=False)
+    await pubsub.stop()
+    await manager.close_all()
+    await http_client.close()
+    await asyncio.to_thread(mail_outbox.stop_workers)
+    chat_engine.save_sessions()
+
 
 
 
@@ -78,6 +115,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # --- Dependency Injection ---
@@ -120,63 +158,91 @@ def get_connector(device: models.Device):
         return ESP32StubConnector(device.id, config)
     return None
 
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "50"))
+
+# device id -> fetch time ("ts") of the last stored reading. Cells are cached
+# for longer than POLL_INTERVAL, so a poll may get back the same reading.
+_last_polled_ts = {}
+
 async def poll_devices():
     """Background task to poll external APIs"""
     while True:
-        # Use a fresh session for the query, then close it
         try:
-             # Prefetch device IDs to avoid holding DB while making http requests
-            db = database.SessionLocal()
-            devices_idx = db.query(models.Device).filter(models.Device.connector_type == "public_api").all()
-            device_ids = [d.id for d in devices_idx]
-            db.close()
-            
-            for dev_id in device_ids:
-                # Re-open small session per device processing
-                db = database.SessionLocal()
-                dev = db.query(models.Device).get(dev_id)
-                if not dev: 
-                    db.close()
-                    continue
-
-                connector = get_connector(dev)
-                if connector:
-                    try:
-                        # Offload blocking I/O to thread
-                        data = await asyncio.to_thread(connector.fetch_data)
-                        
-                        dev.last_seen = dt.utcnow()
-                        dev.status = data.get("status", "offline")
-                        
-                        metrics = data.get("metrics", {})
-                        if metrics:
-                            measurement = models.SensorData(
-                                device_id=dev.id,
-                                timestamp=dt.utcnow(),
-                                temperature=metrics.get("temperatureC"),
-                                humidity=metrics.get("humidityPct"),
-                                pressure=metrics.get("pressureHPa"),
-                                wind_speed=metrics.get("windMS"),
-                                pm2_5=metrics.get("pm25")
-                            )
-                            db.add(measurement)
-                            # Alerting could be slow (SMTP), offload it!
-                            # Pass IDs, not objects, if possible, but for now we pass the object 
-                            # and ensure it's bound. db.commit() first to save data.
-                            db.commit() 
-                            db.refresh(measurement)
-                            
-                            await asyncio.to_thread(check_alerts_wrapper, dev.id, measurement.id)
-                            
-                    except Exception as e:
-                        logger.error(f"Error polling device {dev.name}: {e}")
-                else:
-                    db.close()
-                    
+            await poll_devices_once()
         except Exception as e:
             logger.error(f"Polling cycle error: {e}")
         
-        await asyncio.sleep(60)
+        await asyncio.sleep(POLL_INTERVAL)
+
+async def poll_devices_once():
+    """
+    One polling cycle: fetch every public_api device concurrently (bounded by
+    POLL_CONCURRENCY, devices in the same grid cell share one upstream call),
+    then write all measurements in a single transaction. A reading already
+    stored by an earlier cycle (served again from geo_cache) is not re-inserted;
+    rows carry the time the reading was fetched.
+
+    Returns:
+        Number of measurements stored
+    """
+    # expire_on_commit=False keeps the loaded devices usable after the
+    # connection is handed back, so no DB connection is held during HTTP calls
+    db = database.SessionLocal(expire_on_commit=False)
+    try:
+        devices = db.query(models.Device).filter(models.Device.connector_type == "public_api").all()
+        db.commit()
+
+        polled = [(dev, get_connector(dev)) for dev in devices]
+        polled = [(dev, connector) for dev, connector in polled if connector]
+        semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+
+        async def fetch(dev, connector):
+            async with semaphore:
+                try:
+                    return await geo_cache.fetch_connector(connector)
+                except Exception as e:
+                    logger.error(f"Error polling device {dev.name}: {e}")
+                    return None
+
+        results = await asyncio.gather(*(fetch(dev, connector) for dev, connector in polled))
+
+        now = dt.utcnow()
+        measurements = []
+        for (dev, _), data in zip(polled, results):
+            if data is None:
+                continue
+            dev.last_seen = now
+            dev.status = data.get("status", "offline")
+            
+            metrics = data.get("metrics", {})
+            fetched_ts = data.get("ts")
+            if metrics and (fetched_ts is None or _last_polled_ts.get(dev.id) != fetched_ts):
+                if fetched_ts is not None:
+                    _last_polled_ts[dev.id] = fetched_ts
+                measurements.append(models.SensorData(
+                    device_id=dev.id,
+                    timestamp=dt.utcfromtimestamp(fetched_ts) if fetched_ts is not None else now,
+                    temperature=metrics.get("temperatureC"),
+                    humidity=metrics.get("humidityPct"),
+                    pressure=metrics.get("pressureHPa"),
+                    wind_speed=metrics.get("windMS"),
+                    pm2_5=metrics.get("pm25")
+                ))
+
+        db.add_all(measurements)
+        db.flush()
+        rollups.apply(db, measurements)
+        latest_store.stage(db, measurements)
+        alert_jobs = [(m.device_id, m.id) for m in measurements]
+        db.commit()
+    finally:
+        db.close()
+
+    # Alerting could be slow (SMTP), offload it!
+    for dev_id, m_id in alert_jobs:
+        await asyncio.to_thread(check_alerts_wrapper, dev_id, m_id)
+    return len(alert_jobs)
 
 def check_alerts_wrapper(dev_id, measurement_id, user_email: Optional[str] = None):
     """Wrapper to run check_alerts in a new thread with its own DB session"""
@@ -191,71 +257,17 @@ def check_alerts_wrapper(dev_id, measurement_id, user_email: Optional[str] = Non
     except Exception as e:
         logger.error(f"Async Alert Error: {e}")
 
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 # --- Alerting Service ---
 def send_email_alert(subject: str, body: str, recipient: str = None):
-    """Sends an email alert using SMTP (e.g., Gmail) with enhanced error handling"""
-    sender_email = os.getenv("EMAIL_USER")
-    sender_password = os.getenv("EMAIL_PASS")
-    receiver_email = recipient or os.getenv("ALERT_RECEIVER_EMAIL", sender_email)
+    """Queues an email alert in the outbox (delivered by the pooled SMTP workers)"""
+    receiver_email = recipient or os.getenv("ALERT_RECEIVER_EMAIL", mail_outbox.SMTP_USER)
 
-    if not sender_email or not sender_password:
+    if not mail_outbox.mail_configured():
         logger.warning("⚠️ Email Alert Skipped: EMAIL_USER or EMAIL_PASS not configured in .env")
         return False
 
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = receiver_email
-        msg['Subject'] = f"🚨 EcoSync Alert: {subject}"
-
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Connect to Gmail SMTP with timeout
-        logger.info(f"📧 Connecting to Gmail SMTP for {receiver_email}...")
-        server = smtplib.SMTP('smtp.gmail.com', 587, timeout=15)
-        server.starttls()
-        
-        # Login
-        logger.info(f"🔐 Authenticating as {sender_email}...")
-        server.login(sender_email, sender_password)
-        
-        # Send email
-        logger.info(f"📤 Sending alert email...")
-        text = msg.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        server.quit()
-        
-        logger.info(f"✅ Email Alert SENT successfully to {receiver_email}")
-        return True
-        
-    except smtplib.SMTPAuthenticationError as e:
-        logger.error(f"❌ SMTP Authentication Failed: {e}")
-        logger.error(f"💡 Solution: Generate new App Password at https://myaccount.google.com/apppasswords")
-        return False
-        
-    except smtplib.SMTPException as e:
-        error_msg = str(e)
-        logger.error(f"❌ SMTP Error: {error_msg}")
-        
-        # Specific error handling
-        if "550" in error_msg:
-            logger.error(f"💡 Gmail blocked the email. Possible reasons:")
-            logger.error(f"   - Daily sending quota exceeded")
-            logger.error(f"   - Suspicious activity detected")
-            logger.error(f"   - Recipient email invalid or blocked")
-            logger.error(f"   - Try again in a few hours or use a different Gmail account")
-        elif "535" in error_msg:
-            logger.error(f"💡 Invalid credentials. Check EMAIL_USER and EMAIL_PASS in .env")
-        
-        return False
-        
-    except Exception as e:
-        logger.error(f"❌ Unexpected error sending email: {type(e).__name__}: {e}")
-        return False
+    return mail_outbox.enqueue_now([receiver_email], f"🚨 EcoSync Alert: {subject}", body) > 0
 
 
 def calculate_distance(lat1, lon1, lat2, lon2):
@@ -278,194 +290,148 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     return c * r
 
 
+SENTINEL_RADIUS_KM = float(os.getenv("SENTINEL_RADIUS_KM", "50"))  # Geofence sector radius
+
 def check_alerts(db: Session, device: models.Device, measurement: models.SensorData, user_email: Optional[str] = None):
-    """Rule-based alerting with Email Notification (Dynamic Thresholds)"""
-    
-    # Fetch Settings: Try user-specific first, then fall back to default
-    settings = None
-    if user_email:
-        settings = db.query(models.AlertSettings).filter(
-            models.AlertSettings.user_email == user_email,
-            models.AlertSettings.is_active == True
-        ).first()
-    
-    if not settings:
-        settings = db.query(models.AlertSettings).filter(models.AlertSettings.is_active == True).first()
-    
-    # Defaults if no settings found
-    TEMP_THRESH = settings.temp_threshold if settings else 45.0
-    HUM_MIN = settings.humidity_min if settings else 20.0
-    HUM_MAX = settings.humidity_max if settings else 80.0
-    PM25_THRESH = settings.pm25_threshold if settings else 150.0
-    WIND_THRESH = settings.wind_threshold if settings else 30.0
-    # Logic change: We will fetch ALL users below instead of just one recipient
+    """Rule-based alerting with Email Notification (per-user thresholds, see services/alert_rules.py)"""
     
-    triggers = []
+    # Fast path: one vectorized pass over every threshold profile
+    rules = alert_rules.rule_engine.rules(db)
+    if not rules.evaluate(alert_rules.measurement_vector(measurement)).any():
+        return
     
-    # 1. High Temperature -> Fire Risk
-    if measurement.temperature and measurement.temperature > TEMP_THRESH:
-        triggers.append(f"CRITICAL TEMP: {measurement.temperature}°C (Limit: {TEMP_THRESH}°C)")
+    # Targeted Email Logic
+    audience = set()
     
-    # 2. Humidity Extremes -> Biological Stress
-    if measurement.humidity:
-        if measurement.humidity > HUM_MAX:
-            triggers.append(f"HIGH HUMIDITY: {measurement.humidity}% (Limit: {HUM_MAX}%)")
-        elif measurement.humidity < HUM_MIN:
-            triggers.append(f"LOW HUMIDITY: {measurement.humidity}% (Limit: {HUM_MIN}%)")
-
-    # 3. High PM2.5 -> Hazardous Air
-    if measurement.pm2_5 and measurement.pm2_5 > PM25_THRESH:
-        triggers.append(f"HAZARDOUS AIR: PM2.5 is {measurement.pm2_5} µg/m³ (Limit: {PM25_THRESH})")
+    # 1. Add the user who sent the data (Primary Target)
+    if user_email:
+        audience.add(user_email)
+        logger.info(f"Targeting Primary User: {user_email}")
         
-    # 4. High Wind Speed -> Physical Security Risk
-    if measurement.wind_speed and measurement.wind_speed > WIND_THRESH:
-        triggers.append(f"HAZARDOUS WIND: {measurement.wind_speed} km/h (Limit: {WIND_THRESH} km/h)")
-
-    if triggers:
-        alert_msg = " | ".join(triggers)
-        logger.warning(f"ALERT TRIGGERED: {alert_msg} on {device.name}")
+    # 2. Add fallback/admin from settings (Safety Net)
+    if rules.default_email:
+        audience.add(rules.default_email)
         
-        # --- COOLDOWN CHECK ---
-        # Prevent spamming alerts every second. Check if an alert was sent in the last 15 minutes.
+    # 3. Geofencing (The "Sentinel" Broadcast)
+    if device.lat and device.lon:
         try:
-             cutoff_time = dt.utcnow() - timedelta(minutes=15)
-             recent_alert = db.query(models.Alert).filter(
-                 models.Alert.message == alert_msg, # Same alert type
-                 models.Alert.timestamp >= cutoff_time
-             ).first()
-             
-             if recent_alert:
-                 if recent_alert.timestamp: # Ensure timestamp exists
-                     time_diff = (dt.utcnow() - recent_alert.timestamp).total_seconds() / 60
-                     logger.info(f"⏳ Alert Cooldown Active: Last alert sent {time_diff:.1f} mins ago. Skipping.")
-                     return
-        except Exception as e:
-             logger.error(f"Error checking alert cooldown: {e}")
-             # Proceed safely if cooldown check fails
-        
-        # Targeted Email Logic
-        recipients = set()
-        
-        # 1. Add the user who sent the data (Primary Target)
-        if user_email:
-            recipients.add(user_email)
-            logger.info(f"Targeting Primary User: {user_email}")
+            nearby_users = geo_index.users_near(device.lat, device.lon, SENTINEL_RADIUS_KM, db)
             
-        # 2. Add fallback/admin from settings (Safety Net)
-        if settings and settings.user_email:
-            recipients.add(settings.user_email)
-            
-        # 3. Geofencing (The "Sentinel" Broadcast)
-        if device.lat and device.lon:
-            try:
-                nearby_users = db.query(models.User).filter(
-                    models.User.is_active == True,
-                    models.User.location_lat != None,
-                    models.User.location_lon != None
-                ).all()
-                
-                logger.info(f"Sentinel Scan: Checking {len(nearby_users)} active users near Sector {device.lat},{device.lon}")
-                
-                for u in nearby_users:
-                    dist = calculate_distance(device.lat, device.lon, u.location_lat, u.location_lon)
-                    if dist <= 50.0: # 50km Sector Radius
-                        recipients.add(u.email)
-                        logger.info(f"Targeting Nearby User: {u.email} (Location: {u.location_name or 'Unknown'}, Distance: {dist:.1f}km)")
-            except Exception as geo_error:
-                logger.warning(f"Geofencing disabled (DB schema pending): {geo_error}")
-                # Fallback: Just send to the primary user
-                pass
-
-        if recipients:
-            timestamp_str = measurement.timestamp.strftime("%Y-%m-%d %H:%M:%S UTC")
-            dashboard_link = f"http://localhost:5173/dashboard?device={device.id}"
+            logger.info(f"Sentinel Scan: {len(nearby_users)} active users within {SENTINEL_RADIUS_KM:.0f}km of Sector {device.lat},{device.lon}")
             
-            # ============================================
-            # PRIMARY ALERT: CONSOLE NOTIFICATION (Always Works)
-            # ============================================
-            print("\n" + "="*80)
-            print("🚨 CRITICAL ALERT - THRESHOLD VIOLATION DETECTED 🚨")
-            print("="*80)
-            print(f"Device: {device.name}")
-            print(f"Location: {device.lat}, {device.lon}")
-            print(f"Time: {timestamp_str}")
-            print(f"\nVIOLATIONS:")
-            for trigger in triggers:
-                print(f"  ⚠️  {trigger}")
-            print(f"\nRecipients: {', '.join(recipients)}")
-            print(f"Dashboard: {dashboard_link}")
-            print("="*80 + "\n")
-            
-            # ============================================
-            # SECONDARY ALERT: EMAIL (Optional - May Fail)
-            # ============================================
-            body = (
-                f"🚨 EcoSync Alert System\n\n"
-                f"Source: {device.name}\n"
-                f"Location: {device.lat}, {device.lon}\n"
-                f"Time: {timestamp_str}\n\n"
-                f"The following threshold violations were detected:\n"
-                f"--------------------------------------------------\n"
-                f"{alert_msg}\n"
-                f"--------------------------------------------------\n\n"
-                f"View live dashboard here:\n{dashboard_link}\n\n"
-                f"- EcoSync Sentinel"
+            audience.update(email for email, _ in nearby_users)
+        except Exception as geo_error:
+            logger.warning(f"Geofencing disabled (DB schema pending): {geo_error}")
+            # Fallback: Just send to the primary user
+            pass
+
+    if not audience:
+        logger.warning("Alert triggered but no email recipients found (No users in DB).")
+        return
+
+    # Each user is checked against their own thresholds; metrics in cooldown
+    # for (user, device, metric) are skipped. Users with the same violations
+    # share one notification.
+    groups = alert_rules.rule_engine.evaluate(measurement, device.id, audience, db)
+    if not groups:
+        logger.info(f"⏳ Alert Cooldown Active for all recipients on {device.name}. Skipping.")
+        return
+
+    for group in groups:
+        deliver_alert(db, device, measurement, group["triggers"], group["recipients"], group["metrics"])
+
+
+def deliver_alert(db: Session, device: models.Device, measurement: models.SensorData, triggers: List[str], recipients: set, metrics: List[str]):
+    """Console + email + push notification for one set of violations, recorded as an Alert row."""
+    alert_msg = " | ".join(triggers)
+    logger.warning(f"ALERT TRIGGERED: {alert_msg} on {device.name}")
+    
+    if recipients:
+        timestamp_str = measurement.timestamp.strftime("%Y-%m-%d %H:%M:%S UTC")
+        dashboard_link = f"http://localhost:5173/dashboard?device={device.id}"
+        
+        # ============================================
+        # PRIMARY ALERT: CONSOLE NOTIFICATION (Always Works)
+        # ============================================
+        print("\n" + "="*80)
+        print("🚨 CRITICAL ALERT - THRESHOLD VIOLATION DETECTED 🚨")
+        print("="*80)
+        print(f"Device: {device.name}")
+        print(f"Location: {device.lat}, {device.lon}")
+        print(f"Time: {timestamp_str}")
+        print(f"\nVIOLATIONS:")
+        for trigger in triggers:
+            print(f"  ⚠️  {trigger}")
+        print(f"\nRecipients: {', '.join(recipients)}")
+        print(f"Dashboard: {dashboard_link}")
+        print("="*80 + "\n")
+        
+        # ============================================
+        # SECONDARY ALERT: EMAIL (Optional - May Fail)
+        # ============================================
+        body = (
+            f"🚨 EcoSync Alert System\n\n"
+            f"Source: {device.name}\n"
+            f"Location: {device.lat}, {device.lon}\n"
+            f"Time: {timestamp_str}\n\n"
+            f"The following threshold violations were detected:\n"
+            f"--------------------------------------------------\n"
+            f"{alert_msg}\n"
+            f"--------------------------------------------------\n\n"
+            f"View live dashboard here:\n{dashboard_link}\n\n"
+            f"- EcoSync Sentinel"
+        )
+        
+        # Queue one outbox message per recipient (committed with the Alert row;
+        # delivery, pooling and retries happen in the mail_outbox workers)
+        emails_queued = 0
+        if mail_outbox.mail_configured():
+            emails_queued = mail_outbox.enqueue(
+                db, recipients, f"🚨 EcoSync Alert: Alert: {device.name} - Action Required", body
             )
+            logger.info(f"📧 Queued email alerts for {emails_queued} recipients")
+        else:
+            logger.warning("⚠️ Email Alert Skipped: EMAIL_USER or EMAIL_PASS not configured in .env")
+        
+        # ============================================
+        # TERTIARY ALERT: PUSH NOTIFICATION
+        # ============================================
+        try:
+            push_title = f"🚨 {device.name} Alert"
+            push_body = f"Threshold Violation: {alert_msg}"
+            push_payload = {
+                 "title": push_title,
+                 "body": push_body,
+                 "icon": "/warning.png",
+                 "tag": "ecosync-alert",
+                 "data": {"url": dashboard_link}
+            }
             
-            # Track email sending success
-            emails_sent_successfully = 0
-            logger.info(f"📧 Attempting to send email alerts to {len(recipients)} recipients...")
-            
-            for email in recipients:
-                success = send_email_alert(f"Alert: {device.name} - Action Required", body, recipient=email)
-                if success:
-                    emails_sent_successfully += 1
-            
-            # ============================================
-            # TERTIARY ALERT: PUSH NOTIFICATION
-            # ============================================
-            try:
-                push_title = f"🚨 {device.name} Alert"
-                push_body = f"Threshold Violation: {alert_msg}"
-                push_payload = {
-                     "title": push_title,
-                     "body": push_body,
-                     "icon": "/warning.png",
-                     "tag": "ecosync-alert",
-                     "data": {"url": dashboard_link}
-                }
-                
-                # Send to all nearby users found in 'nearby_users' scope
-                # Note: 'nearby_users' var might not be available here if we didn't enter that block
-                # Better strategy: Get IDs of recipients
-                
-                # Fetch user objects for recipients to send push
-                target_users = db.query(models.User).filter(models.User.email.in_(recipients)).all()
-                for user in target_users:
-                     sent_push = send_push_notification_to_user(user.id, push_payload, db)
-                     if sent_push:
-                         logger.info(f"📲 Push notification sent to {user.email}")
-            except Exception as e:
-                logger.error(f"Failed to send push notifications: {e}")
-            
-            # Save to DB with email status
-            email_status = emails_sent_successfully > 0
-            db.add(models.Alert(
-                metric="multi",
-                value=0.0,
-                message=alert_msg,
-                recipient_email=f"BROADCAST_{len(recipients)}_RECIPIENTS",
-                email_sent=email_status
-            ))
-            
-            # Log final status
-            if email_status:
-                logger.info(f"✅ Alert emails sent successfully to {emails_sent_successfully}/{len(recipients)} recipients")
-            else:
-                logger.warning(f"⚠️ Email delivery failed, but CONSOLE ALERT was displayed above")
-                logger.warning(f"💡 Check the terminal output for alert details")
+            # One subscription query + concurrent fan-out for every recipient
+            push_result = push_dispatcher.send_to_users(db, push_payload, emails=recipients)
+            if push_result["sent"]:
+                logger.info(f"📲 Push notifications sent to {push_result['sent']}/{push_result['subscriptions']} subscriptions")
+        except Exception as e:
+            logger.error(f"Failed to send push notifications: {e}")
+        
+        # Save to DB with email status
+        email_status = emails_queued > 0
+        db.add(models.Alert(
+            metric=metrics[0] if len(metrics) == 1 else "multi",
+            value=0.0,
+            message=alert_msg,
+            recipient_email=f"BROADCAST_{len(recipients)}_RECIPIENTS",
+            email_sent=email_status
+        ))
+        
+        # Log final status
+        if email_status:
+            logger.info(f"✅ Alert emails queued for {emails_queued}/{len(recipients)} recipients")
         else:
-             logger.warning("Alert triggered but no email recipients found (No users in DB).")
+            logger.warning(f"⚠️ Email delivery failed, but CONSOLE ALERT was displayed above")
+            logger.warning(f"💡 Check the terminal output for alert details")
+    else:
+         logger.warning("Alert triggered but no email recipients found (No users in DB).")
 
 
 
@@ -475,7 +441,6 @@ async def startup_event():
     logger.info("Starting background services...")
     # redis = await aioredis.create_redis_pool("redis://localhost")
     asyncio.create_task(poll_devices()) 
-    asyncio.create_task(refresh_map_cache())
     logger.info("Startup: Background tasks initiated (Polling Enabled)")
 
 
@@ -491,124 +456,294 @@ class IoTSensorData(BaseModel):
     user_email: Optional[str] = None
     lat: Optional[float] = None
     lon: Optional[float] = None
+    timestamp: Optional[dt] = None  # Device-side capture time (buffered uploads)
+
+    @field_validator("timestamp")
+    @classmethod
+    def naive_utc_timestamp(cls, ts: Optional[dt]) -> Optional[dt]:
+        # Stored and compared naive (UTC) like every other SensorData timestamp
+        if ts is not None and ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        return ts
+
+
+# Upper bound for a single /iot/data/batch request
+MAX_INGEST_BATCH = int(os.getenv("MAX_INGEST_BATCH", "1000"))
 
 
 from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks
 
-@app.post("/iot/data", tags=["IoT"])
-async def receive_iot_data(data: IoTSensorData, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def dashboard_device_id(user_email: Optional[str]) -> str:
+    """Device ID used for readings posted from a dashboard / ESP32 (unique per user)."""
+    id_sanitized = user_email.replace("@", "_").replace(".", "_") if user_email else "MAIN"
+    return f"DASHBOARD_{id_sanitized}"
+
+def upsert_ingest_devices(db: Session, readings: List[IoTSensorData], current_ts) -> dict:
     """
-    Receives sensor data from ESP32, applies Kalman filtering, saves to DB, and broadcasts via WebSocket.
+    Get/Create the devices for a set of readings with a single lookup query.
+    The last reading per device wins for location. Nothing is committed here.
     """
-    try:
-        current_ts = dt.utcnow()
-        
-        # 1. Kalman Filtering & Cleaning
-        filtered_temp, temp_conf = kalman_filter.filter_temperature(data.temperature)
-        filtered_hum, hum_conf = kalman_filter.filter_humidity(data.humidity)
-        filtered_pm25, pm25_conf = kalman_filter.filter_pm25(data.pm25)
-        mq_cleaned = kalman_filter.clean_mq_data(data.mq_raw)
-        
-        # 2. Get/Create Device (Unique per User for localized geofencing)
-        id_sanitized = data.user_email.replace("@", "_").replace(".", "_") if data.user_email else "MAIN"
-        device_id = f"DASHBOARD_{id_sanitized}"
-        
-        device = db.query(models.Device).filter(models.Device.id == device_id).first()
+    device_ids = {dashboard_device_id(r.user_email) for r in readings}
+    devices = {
+        d.id: d for d in db.query(models.Device).filter(models.Device.id.in_(device_ids)).all()
+    }
+
+    for r in readings:
+        device_id = dashboard_device_id(r.user_email)
+        device = devices.get(device_id)
         if not device:
             device = models.Device(
-                id=device_id, name=f"Sector Explorer ({data.user_email or 'Public'})", 
+                id=device_id, name=f"Sector Explorer ({r.user_email or 'Public'})",
                 connector_type="esp32",
-                lat=data.lat or 0.0, lon=data.lon or 0.0, 
+                lat=r.lat or 0.0, lon=r.lon or 0.0,
                 status="online", last_seen=current_ts
             )
             db.add(device)
-            db.commit()
-            db.refresh(device)
+            devices[device_id] = device
         else:
             device.last_seen = current_ts
             device.status = "online"
             # Update location if provided
-            if data.lat and data.lon:
-                device.lat = data.lat
-                device.lon = data.lon
-            db.commit()
-
-        # 3. Store Filtered Data
-        mq_norm = min(100, max(0, (mq_cleaned["smoothed"] - 200) / 6))
-        measurement = models.SensorData(
-            device_id=device.id,
-            timestamp=current_ts,
-            temperature=filtered_temp,
-            humidity=filtered_hum,
-            pressure=data.pressure,
-            wind_speed=0.0,
-            pm2_5=filtered_pm25,
-            pm10=mq_cleaned["smoothed"], # Storing smoothed MQ here
-            motion=data.motion
-        )
+            if r.lat and r.lon:
+                device.lat = r.lat
+                device.lon = r.lon
+    return devices
+
+def process_reading(data: IoTSensorData, device_id: str, current_ts):
+    """
+    Applies Kalman filtering & cleaning to one reading.
+    Returns (SensorData row, WebSocket payload).
+    """
+    ts = data.timestamp or current_ts
+
+    # 1. Kalman Filtering & Cleaning (per-device filter state)
+    filters = kalman_filter.get_device_filters(device_id)
+    filtered_temp, temp_conf = filters.temp.update(data.temperature)
+    filtered_hum, hum_conf = filters.humidity.update(data.humidity)
+    filtered_pm25, pm25_conf = filters.pm25.update(data.pm25)
+    mq_cleaned = filters.mq.clean_and_smooth(data.mq_raw)
+
+    # 2. Filtered Data Row
+    mq_norm = min(100, max(0, (mq_cleaned["smoothed"] - 200) / 6))
+    measurement = models.SensorData(
+        device_id=device_id,
+        timestamp=ts,
+        temperature=filtered_temp,
+        humidity=filtered_hum,
+        pressure=data.pressure,
+        wind_speed=data.wind_speed,
+        pm2_5=filtered_pm25,
+        pm10=mq_cleaned["smoothed"], # Storing smoothed MQ here
+        motion=data.motion
+    )
+
+    # 3. WebSocket Payload
+    payload = {
+        "deviceId": device_id,
+        "timestamp": ts.isoformat(),
+        "raw": {
+            "temperature": data.temperature,
+            "humidity": data.humidity,
+            "pm25": data.pm25,
+            "mq_raw": data.mq_raw
+        },
+        "filtered": {
+            "temperature": round(filtered_temp, 2),
+            "humidity": round(filtered_hum, 2),
+            "pm25": round(filtered_pm25, 2),
+            "mq_smoothed": mq_cleaned["smoothed"]
+        },
+        "confidence": {
+            "temperature": round(temp_conf, 3),
+            "humidity": round(hum_conf, 3),
+            "pm25": round(pm25_conf, 3)
+        },
+        "mq_quality": {
+            "is_outlier": mq_cleaned["is_outlier"],
+            "z_score": mq_cleaned["z_score"]
+        },
+        "mq_index": mq_norm,
+        "pressure": data.pressure,
+        "wind_speed": data.wind_speed
+    }
+    return measurement, payload
+
+async def score_anomalies(rows: list):
+    """Per-device IsolationForest scoring of new rows (off the event loop)."""
+    if not ANOMALY_DETECTION_ENABLED:
+        return
+    try:
+        await asyncio.to_thread(anomaly_registry.score_readings, rows)
+    except Exception as e:
+        logger.error(f"Anomaly scoring error: {e}")
+
+@app.post("/iot/data", tags=["IoT"])
+async def receive_iot_data(data: IoTSensorData, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Receives sensor data from ESP32, applies Kalman filtering, saves to DB, and broadcasts via WebSocket.
+    """
+    try:
+        current_ts = dt.utcnow()
+        device_id = dashboard_device_id(data.user_email)
+
+        # 1. Get/Create Device (Unique per User for localized geofencing)
+        upsert_ingest_devices(db, [data], current_ts)
+
+        # 2. Filter & Store with rollups (single commit)
+        await kalman_filter.warm_filter_states([device_id])
+        measurement, payload = process_reading(data, device_id, current_ts)
+        await score_anomalies([measurement])
         db.add(measurement)
+        db.flush()
+        rollups.apply(db, [measurement])
+        latest_store.stage(db, [measurement])
+        measurement_id = measurement.id
         db.commit()
         
-        # 5. Alert Check (OFFLOADED TO BACKGROUND TO PREVENT EVENT LOOP BLOCKING)
+        # 3. Alert Check (OFFLOADED TO BACKGROUND TO PREVENT EVENT LOOP BLOCKING)
         # Using a wrapper that creates its own session as 'db' here will be closed when request ends
-        background_tasks.add_task(check_alerts_wrapper, device.id, measurement.id, data.user_email)
+        background_tasks.add_task(check_alerts_wrapper, device_id, measurement_id, data.user_email)
         
-        # 4. WebSocket Broadcast
-        payload = {
-            "deviceId": device_id,
-            "timestamp": current_ts.isoformat(),
-            "raw": {
-                "temperature": data.temperature,
-                "humidity": data.humidity,
-                "pm25": data.pm25,
-                "mq_raw": data.mq_raw
-            },
-            "filtered": {
-                "temperature": round(filtered_temp, 2),
-                "humidity": round(filtered_hum, 2),
-                "pm25": round(filtered_pm25, 2),
-                "mq_smoothed": mq_cleaned["smoothed"]
-            },
-            "confidence": {
-                "temperature": round(temp_conf, 3),
-                "humidity": round(hum_conf, 3),
-                "pm25": round(pm25_conf, 3)
-            },
-            "mq_quality": {
-                "is_outlier": mq_cleaned["is_outlier"],
-                "z_score": mq_cleaned["z_score"]
-            },
-            "mq_index": mq_norm,
-            "pressure": data.pressure,
-            "wind_speed": data.wind_speed
-        }
-        await manager.broadcast(payload, "ESP32_MAIN")
-        
-        # Save wind speed to DB
-        measurement.wind_speed = data.wind_speed
-        db.commit()
+        # 4. WebSocket Broadcast (queued; per-client writers do the sending)
+        pubsub.publish(payload, "ESP32_MAIN")
         
         return {"status": "ok", "message": "Data processed successfully"}
 
-        
     except Exception as e:
         logger.error(f"IoT Data Error: {e}")
         return {"status": "error", "detail": str(e)}
 
+@app.post("/iot/data/batch", tags=["IoT"])
+async def receive_iot_data_batch(readings: List[IoTSensorData], background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Bulk ingestion for buffered / fleet uploads (readings may span many devices).
+    Devices are upserted once, readings are filtered in capture order and inserted
+    in one transaction, and one alert evaluation is queued per device.
+    """
+    if not readings:
+        return {"status": "ok", "accepted": 0, "devices": 0}
+    if len(readings) > MAX_INGEST_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_INGEST_BATCH} readings)")
+
+    try:
+        current_ts = dt.utcnow()
+
+        # 1. Upsert all devices in the batch with one lookup
+        upsert_ingest_devices(db, readings, current_ts)
+
+        # 2. Filter in capture order so the Kalman state advances chronologically
+        ordered = sorted(readings, key=lambda r: r.timestamp or current_ts)
+        await kalman_filter.warm_filter_states({dashboard_device_id(r.user_email) for r in ordered})
+        rows = []
+        latest = {}  # device_id -> (row, payload, user_email)
+        for r in ordered:
+            device_id = dashboard_device_id(r.user_email)
+            measurement, payload = process_reading(r, device_id, current_ts)
+            rows.append(measurement)
+            latest[device_id] = (measurement, payload, r.user_email)
+
+        # 3. Anomaly scoring (one micro-batch per device), bulk insert + rollups, single commit
+        await score_anomalies(rows)
+        db.add_all(rows)
+        db.flush()
+        rollups.apply(db, rows)
+        latest_store.stage(db, rows)
+        alert_jobs = [(device_id, m.id, email) for device_id, (m, _, email) in latest.items()]
+        db.commit()
+
+        # 4. One alert evaluation per device (latest reading)
+        for device_id, measurement_id, email in alert_jobs:
+            background_tasks.add_task(check_alerts_wrapper, device_id, measurement_id, email)
+
+        # 5. Broadcast only the newest reading per device
+        for _, payload, _ in latest.values():
+            pubsub.publish(payload, "ESP32_MAIN")
+
+        return {"status": "ok", "accepted": len(rows), "devices": len(latest)}
+
+    except Exception as e:
+        db.rollback()
+        logger.error(f"IoT Batch Error: {e}")
+        return {"status": "error", "detail": str(e)}
+
 @app.get("/api/data", tags=["Analytics"])
-def get_historical_data(limit: int = 100, db: Session = Depends(get_db)):
+def get_historical_data(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    device_id: Optional[str] = None,
+    start: Optional[dt] = None,
+    end: Optional[dt] = None,
+    metrics: Optional[str] = None,
+    order: str = "desc",
+    format: str = "json",
+    db: Session = Depends(get_db)
+):
     """
     Returns historical sensor data for analytics visualization.
+
+    - json (default): one page of `limit` rows (default 100, max 5000), newest
+      first; the X-Next-Cursor header holds the cursor for the next page, if any.
+    - ndjson / csv: streams every matching row, or the first `limit` rows.
+    metrics: comma separated columns to include (id, timestamp, device_id always are).
     """
-    data = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).limit(limit).all()
-    return data
+    try:
+        fields = data_export.select_fields(metrics)
+        filters = dict(device_id=device_id, start=start, end=end, cursor=cursor, order=order)
+        data_export.build_query(db, fields, **filters)  # Validate before streaming starts
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "json":
+        rows, next_cursor = data_export.fetch_page(db, fields, limit or 100, **filters)
+        return JSONResponse(rows, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+    if format == "ndjson":
+        return StreamingResponse(
+            data_export.stream_ndjson(fields, limit or None, **filters), media_type="application/x-ndjson"
+        )
+    if format == "csv":
+        return StreamingResponse(
+            data_export.stream_csv(fields, limit or None, **filters), media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="sensor_data.csv"'}
+        )
+    raise HTTPException(status_code=400, detail="format must be json, ndjson or csv")
+
+@app.get("/api/data/aggregate", tags=["Analytics"])
+def get_aggregated_data(
+    hours: int = 24,
+    start: Optional[dt] = None,
+    end: Optional[dt] = None,
+    device_id: Optional[str] = None,
+    resolution: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Bucketed min/max/mean/last per metric from the rollup tables.
+    The resolution (1m/1h/1d) is picked from the range unless given;
+    without device_id all devices are combined. Each bucket also gets the
+    AQI of its mean PM2.5/PM10, computed for the whole series at once.
+    """
+    start = start or dt.utcnow() - timedelta(hours=hours)
+    try:
+        used, points = rollups.series(db, start, end, device_id=device_id, resolution=resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def means(metric):
+        return [(p.get(metric) or {}).get("mean") for p in points]
+
+    batch = aqi_calculator.calculate_overall_aqi_batch({"pm25": means("pm2_5"), "pm10": means("pm10")})
+    for p, aqi, dominant, category in zip(points, batch["aqi"].tolist(), batch["dominant"].tolist(), batch["category"].tolist()):
+        p["aqi"] = {
+            "value": aqi if aqi != aqi_calculator.NO_AQI else None,
+            "dominant_pollutant": batch["pollutants"][dominant] if dominant != aqi_calculator.NO_AQI else None,
+            "category": aqi_calculator.AQI_CATEGORIES[category][2] if category != aqi_calculator.NO_AQI else "Unavailable",
+        }
+    return {"resolution": used, "count": len(points), "data": points}
 
 @app.get("/api/filtered/latest", tags=["IoT"])
-async def get_filtered_iot_data(db: Session = Depends(get_db)):
+async def get_filtered_iot_data():
     """Returns latest Kalman-filtered data with AQI and health recommendations."""
-    reading = db.query(models.SensorData).filter(
-        models.SensorData.device_id == "ESP32_MAIN"
-    ).order_by(models.SensorData.timestamp.desc()).first()
+    reading = latest_store.get("ESP32_MAIN")
     
     if not reading:
         return {"status": "no_data", "message": "No ESP32 data available"}
@@ -656,7 +791,10 @@ async def websocket_endpoint(websocket: WebSocket, device_id: str):
     try:
         while True:
             await websocket.receive_text() # Keep connection alive
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: socket already closed by the writer (failed/slow client)
+        pass
+    finally:
         manager.disconnect(websocket, device_id)
 
 # --- Standard Device Endpoints ---
@@ -680,7 +818,7 @@ def list_devices(db: Session = Depends(get_db)):
 
 # --- Pro Mode ---
 @app.get("/api/pro-data", tags=["Pro Mode"])
-async def get_pro_data(lat: float = 17.3850, lon: float = 78.4867, city: str = None, db: Session = Depends(get_db)):
+async def get_pro_data(lat: float = 17.3850, lon: float = 78.4867, city: str = None):
     """Aggregates External API + Local Sensor Data + Kalman Fusion"""
     current_lat, current_lon = lat, lon
     location_name = "Custom Location"
@@ -695,19 +833,20 @@ async def get_pro_data(lat: float = 17.3850, lon: float = 78.4867, city: str = N
     external_data["location"]["name"] = location_name
     
     # 2. Fetch Local
-    latest = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+    latest = latest_store.newest()
     local_data = {"temp": latest.temperature, "humidity": latest.humidity, "pm25": latest.pm2_5} if latest else {}
     
     # 3. Fuse
+    weather = external_data["weather"] or {}
+    air_quality = external_data["air_quality"] or {}
     ext_simple = {
-        "temp": external_data["weather"]["temp"],
-        "humidity": external_data["weather"]["humidity"],
-        "pm25": external_data["air_quality"]["pm25"]
+        "temp": weather.get("temp"),
+        "humidity": weather.get("humidity"),
+        "pm25": air_quality.get("pm25")
     }
     external_data["fusion"] = fusion_engine.fuse_environmental_data(local_data, ext_simple)
     
     return external_data
-    return external_data
 
 # --- Alert Settings API ---
 @app.get("/api/settings/alerts", response_model=schemas.AlertSettingsResponse, tags=["Settings"])
@@ -726,6 +865,7 @@ def get_alert_settings(email: Optional[str] = None, db: Session = Depends(get_db
         db.add(settings)
         db.commit()
         db.refresh(settings)
+        alert_rules.rule_engine.invalidate()
     return settings
 
 @app.post("/api/settings/alerts", response_model=schemas.AlertSettingsResponse, tags=["Settings"])
@@ -744,10 +884,32 @@ def update_alert_settings(settings: schemas.AlertSettingsCreate, db: Session = D
     
     db.commit()
     db.refresh(db_settings)
+    alert_rules.rule_engine.invalidate()  # Recompile thresholds on next check
     return db_settings
+
 @app.get("/realtime/map", tags=["Map"])
 async def get_realtime_map_data():
     markers = get_cached_markers()
     return {"count": len(markers), "markers": markers, "cache_status": "active"}
 
+@app.get("/api/cache/stats", tags=["System"])
+async def get_cache_stats():
+    """Hit/miss/eviction counters and sizes of the in-memory API caches."""
+    return cache_stats()
+
+@app.get("/api/mail/stats", tags=["System"])
+def get_mail_stats(db: Session = Depends(get_db)):
+    """Outbound email delivery counters and outbox depth."""
+    return mail_outbox.stats(db)
+
+@app.get("/api/ws/stats", tags=["System"])
+async def get_ws_stats():
+    """Live WebSocket clients, queued/dropped frames, reaped connections and backplane state."""
+    return {**manager.stats(), "backplane": pubsub.stats()}
+
+@app.get("/api/pro/stats", tags=["System"])
+async def get_pro_pipeline_stats():
+    """Pro dashboard aggregation outcomes (ok/stale/timeout per source) and snapshot cache tiers."""
+    return {"aggregator": aggregator.stats(), "snapshots": snapshot_cache.stats()}
+
 
@@ -1,6 +1,9 @@
 import numpy as np
 from filterpy.kalman import KalmanFilter
 from sklearn.ensemble import IsolationForest
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import pickle
 import os
 
@@ -61,11 +64,154 @@ class Preprocessor:
         scaled = (features - self.min_vals) / (self.max_vals - self.min_vals)
         return scaled
 
+# Feature order expected by Preprocessor (SensorData column names)
+FEATURE_COLUMNS = [
+    "temperature", "pressure", "vibration", "wind_speed", "uv_index",
+    "soil_temp", "soil_moisture", "pm2_5", "pm10", "no2", "solar_radiation",
+]
+
+def feature_vector(reading) -> list:
+    """Feature vector from a SensorData row (missing values -> 0)."""
+    return [float(getattr(reading, c, None) or 0.0) for c in FEATURE_COLUMNS]
+
+
+class RingBuffer:
+    """Fixed-capacity 2D sample buffer (O(1) append, no list.pop(0))."""
+    __slots__ = ("_data", "_next", "_size")
+
+    def __init__(self, capacity: int, dim: int):
+        self._data = np.empty((capacity, dim))
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, rows: np.ndarray):
+        capacity = self._data.shape[0]
+        rows = rows[-capacity:]
+        n = rows.shape[0]
+        end = self._next + n
+        if end <= capacity:
+            self._data[self._next:end] = rows
+        else:
+            split = capacity - self._next
+            self._data[self._next:] = rows[:split]
+            self._data[:n - split] = rows[split:]
+        self._next = end % capacity
+        self._size = min(self._size + n, capacity)
+
+    def snapshot(self) -> np.ndarray:
+        """Copy of the buffered samples (order does not matter for fitting)."""
+        return self._data[:self._size].copy()
+
+
+# Background worker(s) shared by all detectors for IsolationForest refits
+ANOMALY_RETRAIN_WORKERS = int(os.getenv("ANOMALY_RETRAIN_WORKERS", "1"))
+_retrain_executor = ThreadPoolExecutor(max_workers=ANOMALY_RETRAIN_WORKERS, thread_name_prefix="anomaly-retrain")
+
+
+class StreamingAnomalyDetector:
+    """
+    IsolationForest over a ring buffer of recent (scaled) samples.
+    Refits periodically on a background worker and swaps the fitted model in
+    atomically, so scoring never waits on training.
+    """
+
+    def __init__(self, capacity: int = 1000, min_samples: int = 50, retrain_every: int = 250, dim: int = 11):
+        self.buffer = RingBuffer(capacity, dim)
+        self.min_samples = min_samples
+        self.retrain_every = retrain_every
+        self.model = None  # Replaced (never mutated) by the retrain worker
+        self._since_fit = 0
+        self._fitting = False
+        self._lock = threading.Lock()
+
+    def _fit(self, samples: np.ndarray):
+        try:
+            model = IsolationForest(n_estimators=100, contamination=0.1)
+            model.fit(samples)
+            self.model = model  # Atomic reference swap
+        except Exception as e:
+            print(f"Anomaly retrain failed: {e}")
+        finally:
+            self._fitting = False
+
+    def score_batch(self, scaled: np.ndarray):
+        """
+        Score a micro-batch with one score_samples call, then add it to the buffer.
+
+        Returns:
+            (is_anomaly bool array, decision score array); zeros until the first model is ready
+        """
+        scaled = np.atleast_2d(scaled)
+        model = self.model
+
+        if model is not None:
+            # decision_function == score_samples - offset_; predict == -1 where < 0
+            decision = model.score_samples(scaled) - model.offset_
+            is_anomaly = decision < 0
+        else:
+            decision = np.zeros(scaled.shape[0])
+            is_anomaly = np.zeros(scaled.shape[0], dtype=bool)
+
+        with self._lock:
+            self.buffer.extend(scaled)
+            self._since_fit += scaled.shape[0]
+            due = len(self.buffer) >= self.min_samples and (model is None or self._since_fit >= self.retrain_every)
+            if due and not self._fitting:
+                self._fitting = True
+                self._since_fit = 0
+                _retrain_executor.submit(self._fit, self.buffer.snapshot())
+
+        return is_anomaly, decision
+
+
+class AnomalyDetectorRegistry:
+    """One StreamingAnomalyDetector per device, LRU-bounded."""
+
+    def __init__(self, max_devices: int = 2000):
+        self.max_devices = max_devices
+        self.preprocessor = Preprocessor()
+        self._detectors: "OrderedDict[str, StreamingAnomalyDetector]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, device_id: str) -> StreamingAnomalyDetector:
+        with self._lock:
+            detector = self._detectors.get(device_id)
+            if detector is None:
+                detector = StreamingAnomalyDetector()
+                self._detectors[device_id] = detector
+                while len(self._detectors) > self.max_devices:
+                    self._detectors.popitem(last=False)
+            else:
+                self._detectors.move_to_end(device_id)
+            return detector
+
+    def score_readings(self, readings: list):
+        """
+        Sets anomaly_score / is_anomaly on SensorData rows (not yet flushed),
+        scoring each device's rows as one micro-batch. Blocking; run via asyncio.to_thread.
+        """
+        by_device = {}
+        for r in readings:
+            by_device.setdefault(r.device_id, []).append(r)
+
+        for device_id, rows in by_device.items():
+            features = self.preprocessor.scale([feature_vector(r) for r in rows])
+            is_anomaly, decision = self.get(device_id).score_batch(features)
+            for r, flag, score in zip(rows, is_anomaly, decision):
+                r.is_anomaly = bool(flag)
+                r.anomaly_score = float(score)
+
+
+ANOMALY_DETECTION_ENABLED = os.getenv("ANOMALY_DETECTION_ENABLED", "true").lower() == "true"
+anomaly_registry = AnomalyDetectorRegistry(max_devices=int(os.getenv("ANOMALY_MAX_DEVICES", "2000")))
+
+
 class IoTAnomalyDetector:
     def __init__(self):
-        self.buffer = []
-        self.model = IsolationForest(n_estimators=100, contamination=0.1)
-        self.is_fitted = False
+        self.detector = StreamingAnomalyDetector()
         self.preprocessor = Preprocessor()
         
         self.config = {
@@ -126,20 +272,11 @@ class IoTAnomalyDetector:
 
         return alerts, precautions
 
+    @property
+    def is_fitted(self):
+        return self.detector.model is not None
+
     def update_and_predict(self, feature_vector):
         scaled_features = self.preprocessor.scale(feature_vector)
-        self.buffer.append(scaled_features)
-        
-        if len(self.buffer) > 1000:
-            self.buffer.pop(0)
-        
-        if len(self.buffer) >= 50 and not self.is_fitted:
-            self.model.fit(self.buffer)
-            self.is_fitted = True
-            
-        if self.is_fitted:
-            prediction = self.model.predict([scaled_features])[0]
-            score = self.model.decision_function([scaled_features])[0]
-            return prediction == -1, score
-        
-        return False, 0.0
+        is_anomaly, score = self.detector.score_batch(scaled_features)
+        return bool(is_anomaly[0]), float(score[0])
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from .database import Base
 from datetime import datetime
@@ -87,6 +87,12 @@ class SensorData(Base):
     anomaly_score = Column(Float)
     is_anomaly = Column(Boolean, default=False)
 
+    __table_args__ = (
+        # Latest-per-device / per-device ranges, and global time ordering
+        Index("ix_sensor_data_device_ts", "device_id", "timestamp"),
+        Index("ix_sensor_data_timestamp", "timestamp"),
+    )
+
 class Alert(Base):
     __tablename__ = "alerts"
 
@@ -122,6 +128,10 @@ class AlertSettings(Base):
 
 class APISnapshot(Base):
     __tablename__ = "api_snapshots"
+    __table_args__ = (
+        # Newest snapshot per location (/api/pro/current cache, /api/pro/history)
+        Index("ix_api_snapshots_location_created", "location", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
@@ -130,6 +140,8 @@ class APISnapshot(Base):
     # Store aggregated metrics
     temp = Column(Float)
     humidity = Column(Float)
+    pressure = Column(Float)
+    wind_speed = Column(Float)
     
     # AQI Components
     aqi = Column(Float)
@@ -143,6 +155,103 @@ class APISnapshot(Base):
     source = Column(String) # "OpenMeteo", "OpenAQ", etc.
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class FilterStateSnapshot(Base):
+    """Persisted per-device Kalman/cleaner state so smoothing survives restarts"""
+    __tablename__ = "filter_states"
+
+    device_id = Column(String, primary_key=True)
+    state_json = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class EmailOutbox(Base):
+    """Durable queue of outgoing emails, drained by the mail_outbox workers"""
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    category = Column(String, default="alert") # alert, otp
+    status = Column(String, default="pending") # pending, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+class DeviceLatest(Base):
+    """Newest reading per device (write-through backing store of services/latest_store.py)"""
+    __tablename__ = "device_latest"
+
+    device_id = Column(String, primary_key=True)
+    sensor_data_id = Column(Integer, nullable=True)
+    timestamp = Column(DateTime, nullable=False)
+    temperature = Column(Float)
+    humidity = Column(Float)
+    pressure = Column(Float)
+    wind_speed = Column(Float)
+    pm2_5 = Column(Float)
+    pm10 = Column(Float)
+    motion = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class SensorRollup(Base):
+    """Per-device time-bucketed aggregates of SensorData (maintained by services/rollups.py)"""
+    __tablename__ = "sensor_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(String, nullable=False)
+    resolution = Column(String, nullable=False) # 1m, 1h, 1d
+    bucket = Column(DateTime, nullable=False)   # Bucket start (UTC)
+    samples = Column(Integer, default=0)
+    last_ts = Column(DateTime)                  # Newest reading folded into the bucket
+
+    # Per metric: min / max / sum / count (mean = sum / count) / last value
+    temperature_min = Column(Float)
+    temperature_max = Column(Float)
+    temperature_sum = Column(Float)
+    temperature_count = Column(Integer, default=0)
+    temperature_last = Column(Float)
+
+    humidity_min = Column(Float)
+    humidity_max = Column(Float)
+    humidity_sum = Column(Float)
+    humidity_count = Column(Integer, default=0)
+    humidity_last = Column(Float)
+
+    pressure_min = Column(Float)
+    pressure_max = Column(Float)
+    pressure_sum = Column(Float)
+    pressure_count = Column(Integer, default=0)
+    pressure_last = Column(Float)
+
+    pm2_5_min = Column(Float)
+    pm2_5_max = Column(Float)
+    pm2_5_sum = Column(Float)
+    pm2_5_count = Column(Integer, default=0)
+    pm2_5_last = Column(Float)
+
+    pm10_min = Column(Float)
+    pm10_max = Column(Float)
+    pm10_sum = Column(Float)
+    pm10_count = Column(Integer, default=0)
+    pm10_last = Column(Float)
+
+    wind_speed_min = Column(Float)
+    wind_speed_max = Column(Float)
+    wind_speed_sum = Column(Float)
+    wind_speed_count = Column(Integer, default=0)
+    wind_speed_last = Column(Float)
+
+    __table_args__ = (
+        UniqueConstraint("device_id", "resolution", "bucket", name="uq_sensor_rollups_bucket"),
+        Index("ix_sensor_rollups_res_bucket", "resolution", "bucket"),
+    )
+
 class DiaryEntry(Base):
     __tablename__ = "diary_entries"
 
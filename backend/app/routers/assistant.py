@@ -1,13 +1,48 @@
+import json
+import uuid
+from typing import Optional
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.assistant.service import process_chat
+from app.assistant.service import process_chat, stream_chat
+from app.chat_engine import chat_engine
 
 router = APIRouter(prefix="/api/assistant", tags=["assistant"])
 
 class ChatRequest(BaseModel):
     message: str
 
+class QueryRequest(BaseModel):
+    message: str
+    session_id: Optional[str] = None  # Returned by the first reply; send it back for follow-ups
+
 @router.post("/chat")
 async def chat_endpoint(request: ChatRequest):
     result = await process_chat(request.message)
     return result
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Server-Sent Events: `delta` (partial reply text), `tool_call`, `tool_result`
+    and a final `done` event carrying the full reply.
+    """
+    async def events():
+        async for event in stream_chat(request.message):
+            yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/query")
+async def query_endpoint(request: QueryRequest):
+    """
+    Rule-based C.E.O.S assistant (weather, time, status, general topics).
+    Follow-up context is kept per session_id; a new one is issued when none is sent.
+    """
+    session_id = request.session_id or uuid.uuid4().hex
+    reply = await chat_engine.process_query(request.message, session_id)
+    return {"reply": reply, "session_id": session_id}
@@ -8,6 +8,8 @@ from sqlalchemy.orm import Session
 from .. import schemas, models, database
 from ..core import security
 from ..services.email_service import send_email_notification
+from ..services.http_client import get_sync_session
+from ..services import geo_index
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
@@ -350,6 +352,12 @@ def update_user_location(
     db.commit()
     db.refresh(current_user)
     
+    # Keep the Sentinel geofencing index in sync
+    if current_user.is_active:
+        geo_index.user_index.upsert(current_user.email, current_user.location_lat, current_user.location_lon)
+    else:
+        geo_index.user_index.remove(current_user.email)
+    
     return {
         "status": "success",
         "message": "Location updated successfully",
@@ -372,7 +380,7 @@ def google_login(request: GoogleLoginRequest, db: Session = Depends(get_db)):
     """
     try:
         # Verify Google OAuth2 token
-        id_info = id_token.verify_oauth2_token(request.token, requests.Request())
+        id_info = id_token.verify_oauth2_token(request.token, requests.Request(session=get_sync_session()))
 
         email = id_info.get("email")
         if not email:
@@ -6,7 +6,8 @@ from typing import List, Dict, Any
 import numpy as np
 
 from .. import models, schemas, database
-from ..services import kalman_filter
+from ..services import kalman_filter, rollups
+from ..services.latest_store import latest_store
 
 router = APIRouter(prefix="/api/industrial", tags=["Industrial Safety"])
 
@@ -18,9 +19,9 @@ def get_db():
         db.close()
 
 @router.get("/safety-index")
-async def get_safety_index(db: Session = Depends(get_db)):
+async def get_safety_index():
     """Calculates the overall safety risk level for the firecracker industry."""
-    latest = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+    latest = latest_store.newest()
     if not latest:
         return {"status": "no_data", "risk_level": "UNKNOWN", "score": 0}
 
@@ -60,16 +61,13 @@ async def get_safety_index(db: Session = Depends(get_db)):
 @router.get("/historical-comparison")
 async def get_historical_comparison(db: Session = Depends(get_db)):
     """Compares current values with historical averages (last 7 days)."""
-    latest = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+    latest = latest_store.newest()
     if not latest:
         return {"status": "no_data"}
 
+    # 7-day means from hourly rollups (~168 rows per device instead of every reading)
     week_ago = datetime.utcnow() - timedelta(days=7)
-    avg_data = db.query(
-        func.avg(models.SensorData.temperature).label("avg_temp"),
-        func.avg(models.SensorData.humidity).label("avg_hum"),
-        func.avg(models.SensorData.pm2_5).label("avg_gas")
-    ).filter(models.SensorData.timestamp >= week_ago).first()
+    avg_data = rollups.averages(db, week_ago, metrics=("temperature", "humidity", "pm2_5"))
 
     return {
         "current": {
@@ -78,9 +76,9 @@ async def get_historical_comparison(db: Session = Depends(get_db)):
             "gas": round(latest.pm2_5, 2)
         },
         "normal": {
-            "temp": round(avg_data.avg_temp or 25.0, 2),
-            "humidity": round(avg_data.avg_hum or 45.0, 2),
-            "gas": round(avg_data.avg_gas or 50.0, 2)
+            "temp": round(avg_data["temperature"] or 25.0, 2),
+            "humidity": round(avg_data["humidity"] or 45.0, 2),
+            "gas": round(avg_data["pm2_5"] or 50.0, 2)
         }
     }
 
@@ -89,14 +87,12 @@ async def get_motion_stats(db: Session = Depends(get_db)):
     """Returns activity statistics for restricted areas."""
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     
-    motion_events = db.query(models.SensorData).filter(
+    daily_count = db.query(func.count(models.SensorData.id)).filter(
         models.SensorData.motion == True,
         models.SensorData.timestamp >= today_start
-    ).all()
+    ).scalar()
     
-    last_motion = db.query(models.SensorData).filter(
-        models.SensorData.motion == True
-    ).order_by(models.SensorData.timestamp.desc()).first()
+    last_motion = latest_store.last_motion()
     
     unusual_activity = False
     if last_motion:
@@ -106,16 +102,16 @@ async def get_motion_stats(db: Session = Depends(get_db)):
             unusual_activity = True
 
     return {
-        "daily_count": len(motion_events),
+        "daily_count": daily_count,
         "last_motion_time": last_motion.timestamp if last_motion else None,
         "unusual_activity": unusual_activity,
         "working_hours": "09:00 - 18:00"
     }
 
 @router.get("/sensor-health")
-async def get_sensor_health(db: Session = Depends(get_db)):
+async def get_sensor_health():
     """Checks for sensor faults or instabilities based on data patterns."""
-    readings = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).limit(30).all()
+    readings = latest_store.recent(30)
     if len(readings) < 10:
         return {"temperature": "INITIALIZING", "humidity": "INITIALIZING", "gas": "INITIALIZING"}
 
@@ -147,9 +143,9 @@ async def get_sensor_health(db: Session = Depends(get_db)):
     }
 
 @router.get("/predictions")
-async def get_safety_predictions(db: Session = Depends(get_db)):
+async def get_safety_predictions():
     """Calculates short-term safety predictions (next 10 mins)."""
-    readings = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).limit(10).all()
+    readings = latest_store.recent(10)
     if len(readings) < 5:
         return {"status": "insufficient_data"}
 
@@ -178,13 +174,10 @@ async def get_explainable_alerts(db: Session = Depends(get_db), limit: int = 20)
     alerts = db.query(models.Alert).order_by(models.Alert.timestamp.desc()).limit(limit).all()
     
     week_ago = datetime.utcnow() - timedelta(days=7)
-    avg_data = db.query(
-        func.avg(models.SensorData.temperature).label("avg_temp"),
-        func.avg(models.SensorData.pm2_5).label("avg_gas")
-    ).first()
+    avg_data = rollups.averages(db, week_ago, metrics=("temperature", "pm2_5"))
     
-    avg_temp = avg_data.avg_temp or 25.0
-    avg_gas = avg_data.avg_gas or 50.0
+    avg_temp = avg_data["temperature"] or 25.0
+    avg_gas = avg_data["pm2_5"] or 50.0
 
     explainable_alerts = []
     for a in alerts:
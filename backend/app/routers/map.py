@@ -1,16 +1,19 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Query
 from typing import Optional
 from datetime import datetime
 from ..connectors.open_meteo import OpenMeteoConnector
 from ..connectors.waqi import WAQIConnector
 from ..connectors.openaq import OpenAQConnector
+from ..services import geo_cache
 
 router = APIRouter(prefix="/api/map", tags=["map"])
 
 @router.get("/point")
-def get_map_point_data(lat: float, lon: float):
+async def get_map_point_data(lat: float, lon: float):
     """
     Aggregates live data from multiple public APIs for a specific Lat/Lon.
+    Sources are fetched concurrently through the grid-cell cache (geo_cache).
     """
     fetched_at = datetime.utcnow().isoformat()
     
@@ -20,21 +23,24 @@ def get_map_point_data(lat: float, lon: float):
         device_id="temp_map_point", 
         config={"lat": lat, "lon": lon}
     )
-    weather_data = weather_connector.fetch_data()
     
     # 2. AQI (WAQI)
     waqi_connector = WAQIConnector(
         device_id="temp_map_point",
         config={"lat": lat, "lon": lon, "token": "demo"} # Using demo token as per strict rules, or env if avail
     )
-    aqi_data = waqi_connector.fetch_data()
 
     # 3. Pollutants (OpenAQ)
     openaq_connector = OpenAQConnector(
         device_id="temp_map_point",
         config={"lat": lat, "lon": lon}
     )
-    pollutant_data = openaq_connector.fetch_data()
+
+    weather_data, aqi_data, pollutant_data = await asyncio.gather(
+        geo_cache.fetch_connector(weather_connector),
+        geo_cache.fetch_connector(waqi_connector),
+        geo_cache.fetch_connector(openaq_connector),
+    )
 
     # Construct Unified Response
     return {
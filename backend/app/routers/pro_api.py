@@ -6,7 +6,9 @@ import json
 import asyncio
 from typing import List
 from .. import models, database
-from ..services import external_apis
+from ..services import external_apis, http_client
+from ..services.latest_store import latest_store
+from ..services import aggregator, cold_storage, snapshot_cache
 
 router = APIRouter(
     prefix="/api/pro",
@@ -68,12 +70,12 @@ from ..ml_engine import AdaptiveKalmanFilter
 # --- ENDPOINTS ---
 
 @router.get("/predict")
-async def predict_future(steps: int = 10, db: Session = Depends(get_db)):
+async def predict_future(steps: int = 10):
     """
     Returns Kalman Filter predictions for the next N seconds.
     """
     # 1. Fetch recent data to train the filter
-    recent_data = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).limit(20).all()
+    recent_data = latest_store.recent(20)
     if not recent_data:
         return {"temperature": [25.0] * steps} # Fallback
     
@@ -94,14 +96,14 @@ async def predict_future(steps: int = 10, db: Session = Depends(get_db)):
 async def get_pro_current(
     lat: float = None, 
     lon: float = None, 
-    city: str = None, 
-    db: Session = Depends(get_db)
+    city: str = None
 ):
     """
     Aggregates current weather and air quality data.
-    - Caches results in DB (APISnapshot) for 5 minutes.
+    - Caches results in memory and in APISnapshot for 5 minutes (services/snapshot_cache.py).
     - Merges OpenWeather + OpenAQ.
     - Performs Kalman Fusion with local data.
+    - Answers within PRO_LATENCY_BUDGET_MS; sources.status reports each input.
     """
     # 0. Resolve Location If Needed
     # PRIORITIZE: User Saved Location > Query Params > Default
@@ -133,56 +135,31 @@ async def get_pro_current(
     if lat is None: lat = 17.3850
     if lon is None: lon = 78.4867
 
-    # 1. Check Cache (DB)
-    loc_key = f"{lat:.4f},{lon:.4f}"
-    cutoff = datetime.utcnow() - timedelta(minutes=5)
-    cached = db.query(models.APISnapshot).filter(
-        models.APISnapshot.location == loc_key,
-        models.APISnapshot.created_at > cutoff
-    ).order_by(models.APISnapshot.created_at.desc()).first()
-
-    # Prepare base data
+    # 1. Two-tier snapshot cache (memory -> APISnapshot -> upstream, written through),
+    # bounded by the request's latency budget; a late fetch still fills the cache
+    values, status = await aggregator.gather({
+        "snapshot": aggregator.Source(
+            lambda: snapshot_cache.get_snapshot(lat, lon),
+            fallback=lambda: snapshot_cache.peek(lat, lon),
+            age=snapshot_cache.age_seconds,
+        ),
+    })
+    snapshot = values["snapshot"]
     weather_data = {}
     aq_data = {}
     sources = {"details": "Live"}
-
-    if cached:
-        weather_data = {
-            "temp": cached.temp,
-            "humidity": cached.humidity,
-            "pressure": 1013,
-            "wind": 0
+    if snapshot:
+        weather_data = snapshot["weather"]
+        aq_data = snapshot["air_quality"]
+        sources = {
+            "cache": snapshot["tier"] != "live",
+            "tier": snapshot["tier"],
+            "age_seconds": int(snapshot_cache.age_seconds(snapshot)),
+            "details": snapshot["source"],
         }
-        aq_data = {
-            "pm25": cached.pm2_5,
-            "pm10": cached.pm10,
-            "no2": cached.no2,
-            "o3": cached.o3,
-            "so2": cached.so2,
-            "co": cached.co,
-            "aqi": cached.aqi
-        }
-        sources = {"cache": True, "details": cached.source}
-    else:
-        # Fetch Fresh Data
-        try:
-            weather_task = external_apis.fetch_open_weather(lat, lon)
-            aq_task = external_apis.fetch_air_quality(lat, lon)
-            
-            weather_data = await weather_task or {}
-            aq_data = await aq_task or {}
-            
-            # Save to Cache
-            # ... (Existing Cache Logic kept simple) ...
-            
-            sources = {"openweather": True, "openaq": True}
-
-        except Exception as e:
-            print(f"Pro API Cache Miss Error: {e}")
-            pass
 
     # --- FUSION LOGIC ---
-    latest_reading = db.query(models.SensorData).order_by(models.SensorData.timestamp.desc()).first()
+    latest_reading = latest_store.newest()
     local_data = {}
     if latest_reading:
         local_data = {
@@ -204,15 +181,18 @@ async def get_pro_current(
     if safe_aqi > 150: gas_status = "Hazardous"
     elif safe_aqi > 100: gas_status = "Unhealthy"
     
-    # Call Gemini
-    precautions = await ai_service.analyze_sensor_data(safe_temp, safe_hum, safe_aqi, gas_status)
+    # Gemini precautions come from the condition-bucket cache (rule-based until the
+    # model's answer for this bucket is cached), so they never wait on the model
+    precautions, precautions_source = ai_service.get_precautions(safe_temp, safe_hum, safe_aqi, gas_status)
+    status["precautions"] = {"status": "ok", "source": precautions_source}
+    sources["status"] = status
     
     # Inject into Fusion Result (Mocking the structure since we don't have full fusion engine import here)
     fused_state = {
         "temperature": {"local": local_data.get("temp"), "external": safe_temp, "fused": safe_temp},
         "humidity": {"local": local_data.get("humidity"), "external": safe_hum, "fused": safe_hum},
         "air_quality": {"local": local_data.get("pm25"), "external": safe_aqi, "fused": safe_aqi},
-        "precautions": precautions # From Gemini
+        "precautions": precautions # From Gemini (cached per condition bucket) or rules
     }
 
     # Return Normalized Shape with Fusion
@@ -227,58 +207,65 @@ async def get_pro_forecast(lat: float, lon: float):
     Returns hourly forecast data for both Weather and AQI.
     Uses Open-Meteo (Weather) and Open-Meteo Air Quality (Free).
     """
-    import httpx
-    
     weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&hourly=temperature_2m,relativehumidity_2m,precipitation_probability&timezone=auto"
     aqi_url = f"https://air-quality-api.open-meteo.com/v1/air-quality?latitude={lat}&longitude={lon}&hourly=pm10,pm2_5,us_aqi&timezone=auto"
     
-    async with httpx.AsyncClient() as client:
-        try:
-            # Parallel fetch
-            weather_resp, aqi_resp = await asyncio.gather(
-                client.get(weather_url),
-                client.get(aqi_url),
-                return_exceptions=True
-            )
-            
-            weather_data = weather_resp.json() if not isinstance(weather_resp, Exception) and weather_resp.status_code == 200 else {}
-            aqi_data = aqi_resp.json() if not isinstance(aqi_resp, Exception) and aqi_resp.status_code == 200 else {}
-            
-            return {
-                "weather": weather_data.get("hourly", {}),
-                "aqi": aqi_data.get("hourly", {}),
-                "source": "Open-Meteo + Open-Meteo AQ"
-            }
-        except Exception as e:
-            # Return partial or empty instead of crashing
-            print(f"Forecast Error: {e}")
-            return {"weather": {}, "aqi": {}, "error": str(e)}
+    try:
+        # Parallel fetch
+        weather_resp, aqi_resp = await asyncio.gather(
+            http_client.get(weather_url),
+            http_client.get(aqi_url),
+            return_exceptions=True
+        )
+        
+        weather_data = weather_resp.json() if not isinstance(weather_resp, Exception) and weather_resp.status_code == 200 else {}
+        aqi_data = aqi_resp.json() if not isinstance(aqi_resp, Exception) and aqi_resp.status_code == 200 else {}
+        
+        return {
+            "weather": weather_data.get("hourly", {}),
+            "aqi": aqi_data.get("hourly", {}),
+            "source": "Open-Meteo + Open-Meteo AQ"
+        }
+    except Exception as e:
+        # Return partial or empty instead of crashing
+        print(f"Forecast Error: {e}")
+        return {"weather": {}, "aqi": {}, "error": str(e)}
 
 @router.get("/history")
 async def get_pro_history(lat: float, lon: float, hours: int = 24, db: Session = Depends(get_db)):
     """
     Returns historical snapshots from local DB.
     """
-    loc_key_start = f"{int(lat)}.{int(lon * 100) // 100}" # Rough matching or exact?
-    # Let's try exact string match on first 4 decimals as used in cache
-    loc_key = f"{lat:.4f},{lon:.4f}"
+    # Same key the /current snapshot cache writes (every upstream fetch is stored)
+    loc_key = snapshot_cache.location_key(lat, lon)
     
     cutoff = datetime.utcnow() - timedelta(hours=hours)
     
-    history = db.query(models.APISnapshot).filter(
+    history = db.query(
+        models.APISnapshot.created_at, models.APISnapshot.temp,
+        models.APISnapshot.humidity, models.APISnapshot.aqi
+    ).filter(
         models.APISnapshot.location == loc_key,
         models.APISnapshot.created_at >= cutoff
     ).order_by(models.APISnapshot.created_at.asc()).all()
+    history = [h._asdict() for h in history]
+
+    # Older snapshots may have been moved to the Parquet cold tier
+    if cold_storage.enabled():
+        cold = cold_storage.scan(
+            "api_snapshots", columns=["created_at", "temp", "humidity", "aqi"], key=loc_key, start=cutoff
+        )
+        history = sorted(cold + history, key=lambda h: h["created_at"])
     
     return {
         "count": len(history),
         "range_hours": hours,
         "data": [
             {
-                "ts": int(h.created_at.timestamp()),
-                "temp": h.temp,
-                "humidity": h.humidity,
-                "aqi": h.aqi
+                "ts": int(h["created_at"].timestamp()),
+                "temp": h["temp"],
+                "humidity": h["humidity"],
+                "aqi": h["aqi"]
             }
             for h in history
         ]
@@ -290,7 +277,6 @@ async def get_top_locations():
     Returns a Real-Time list of Global Locations sorted by temperature.
     Fetches live data from OpenMeteo for ~20 global hotspots.
     """
-    import httpx
     
     # List of known hot/interesting places to check dynamically
     GLOBAL_HOTSPOTS = [
@@ -316,10 +302,10 @@ async def get_top_locations():
         {"city": "Mexico City, MX", "lat": 19.4326, "lon": -99.1332}
     ]
 
-    async def fetch_city(client, city_obj):
+    async def fetch_city(city_obj):
         try:
             url = f"https://api.open-meteo.com/v1/forecast?latitude={city_obj['lat']}&longitude={city_obj['lon']}&current=temperature_2m,weather_code&timezone=auto"
-            resp = await client.get(url, timeout=5.0)
+            resp = await http_client.get(url, timeout=5.0)
             if resp.status_code == 200:
                 data = resp.json()
                 temp = data.get('current', {}).get('temperature_2m', 0)
@@ -342,10 +328,9 @@ async def get_top_locations():
             return None
         return None
 
-    # Fetch all in parallel
-    async with httpx.AsyncClient() as client:
-        tasks = [fetch_city(client, c) for c in GLOBAL_HOTSPOTS]
-        results = await asyncio.gather(*tasks)
+    # Fetch all in parallel (shared pool, per-host concurrency limit)
+    tasks = [fetch_city(c) for c in GLOBAL_HOTSPOTS]
+    results = await asyncio.gather(*tasks)
 
     # Filter failures and Sort by Temp DESC
     valid_results = [r for r in results if r is not None]
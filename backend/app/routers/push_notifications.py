@@ -6,25 +6,14 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
-import json
-from pywebpush import webpush, WebPushException
-import os
-from dotenv import load_dotenv
 
 from .. import models, database
 from .auth_v2 import get_current_user
-
-load_dotenv()
+from ..services import push_dispatcher
+from ..services.push_dispatcher import VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY, VAPID_CLAIMS
 
 router = APIRouter(prefix="/api/push", tags=["push-notifications"])
 
-# VAPID keys (will be generated and stored in .env)
-VAPID_PRIVATE_KEY = os.getenv("VAPID_PRIVATE_KEY")
-VAPID_PUBLIC_KEY = os.getenv("VAPID_PUBLIC_KEY")
-VAPID_CLAIMS = {
-    "sub": "mailto:sreekar092004@gmail.com"  # Contact email
-}
-
 
 class PushSubscriptionRequest(BaseModel):
     subscription: dict  # Contains endpoint, keys (p256dh, auth)
@@ -164,35 +153,13 @@ async def send_test_notification(
         "data": {"url": "/dashboard"}
     }
 
-    sent_count = 0
-    failed_count = 0
-
-    for sub in subscriptions:
-        try:
-            subscription_info = {
-                "endpoint": sub.endpoint,
-                "keys": {
-                    "p256dh": sub.p256dh,
-                    "auth": sub.auth
-                }
-            }
+    result = await push_dispatcher.dispatch(push_dispatcher.to_dispatch_list(subscriptions), payload)
+    sent_count, failed_count = result["sent"], result["failed"]
 
-            webpush(
-                subscription_info=subscription_info,
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            sent_count += 1
-
-        except WebPushException as e:
-            print(f"Push failed for subscription {sub.id}: {e}")
-            failed_count += 1
-            
-            # If subscription is invalid (410 Gone), deactivate it
-            if e.response and e.response.status_code == 410:
-                sub.is_active = False
-                db.commit()
+    # Deactivate expired subscriptions (404/410 Gone) in one update
+    if result["dead"]:
+        push_dispatcher.deactivate(db, result["dead"])
+        db.commit()
 
     return {
         "success": True,
@@ -200,58 +167,3 @@ async def send_test_notification(
         "failed": failed_count,
         "message": f"Test notification sent to {sent_count} device(s)"
     }
-
-
-def send_push_notification_to_user(
-    user_id: int,
-    payload: dict,
-    db: Session
-):
-    """
-    Utility function to send push notification to a specific user
-    Used by alert system
-    """
-    if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
-        print("⚠️ VAPID keys not configured, skipping push notification")
-        return False
-
-    # Get user's active subscriptions
-    subscriptions = db.query(models.PushSubscription).filter(
-        models.PushSubscription.user_id == user_id,
-        models.PushSubscription.is_active == True
-    ).all()
-
-    if not subscriptions:
-        print(f"⚠️ No active push subscriptions for user {user_id}")
-        return False
-
-    sent_count = 0
-
-    for sub in subscriptions:
-        try:
-            subscription_info = {
-                "endpoint": sub.endpoint,
-                "keys": {
-                    "p256dh": sub.p256dh,
-                    "auth": sub.auth
-                }
-            }
-
-            webpush(
-                subscription_info=subscription_info,
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
-            )
-            sent_count += 1
-            print(f"✅ Push notification sent to user {user_id}")
-
-        except WebPushException as e:
-            print(f"❌ Push failed for subscription {sub.id}: {e}")
-            
-            # If subscription is invalid (410 Gone), deactivate it
-            if e.response and e.response.status_code == 410:
-                sub.is_active = False
-                db.commit()
-
-    return sent_count > 0
@@ -0,0 +1,129 @@
+"""
+Deadline-bounded aggregation of upstream sources for the Pro dashboard.
+Every source of a request runs concurrently and the request waits at most its
+latency budget (PRO_LATENCY_BUDGET_MS); sources that miss the deadline are
+answered from their stale fallback (if any) and reported as such.
+Late sources are not cancelled: they finish in the background and fill their
+caches (geo_cache, snapshot_cache), so the next caller gets them fresh.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+PRO_LATENCY_BUDGET_MS = int(os.getenv("PRO_LATENCY_BUDGET_MS", "1500"))
+
+# Late fetches still running after their request returned
+_background = set()
+_stats = {"requests": 0, "ok": 0, "stale": 0, "timeout": 0, "error": 0, "empty": 0, "late_completed": 0}
+
+
+class Source:
+    """
+    One upstream input of an aggregation.
+
+    Args:
+        fetch: Zero-argument coroutine function producing the value
+        fallback: Returns (value, age_seconds) of a cached value to use when
+            fetch fails or misses the deadline, or None
+        age: Returns the age in seconds of the value fetch produced (cache age), or None
+    """
+    __slots__ = ("fetch", "fallback", "age")
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[Any]],
+        fallback: Optional[Callable[[], Optional[Tuple[Any, float]]]] = None,
+        age: Optional[Callable[[Any], Optional[float]]] = None,
+    ):
+        self.fetch = fetch
+        self.fallback = fallback
+        self.age = age
+
+
+class Budget:
+    """Latency budget of one request; successive gather() calls share what is left."""
+
+    def __init__(self, budget_ms: Optional[int] = None):
+        self.total = (PRO_LATENCY_BUDGET_MS if budget_ms is None else budget_ms) / 1000.0
+        self.started = time.monotonic()
+
+    def remaining(self) -> float:
+        return max(0.0, self.total - (time.monotonic() - self.started))
+
+    async def gather(self, sources: Dict[str, Source]) -> Tuple[Dict[str, Any], Dict[str, dict]]:
+        """
+        Run all sources concurrently until they finish or the budget runs out.
+
+        Returns:
+            (values, status): values[name] is the result (or stale fallback, or None);
+            status[name] is {"status": ok|stale|timeout|error|empty, "latency_ms", "age_seconds"}
+        """
+        _stats["requests"] += 1
+        started = time.monotonic()
+        tasks = {name: asyncio.ensure_future(src.fetch()) for name, src in sources.items()}
+        finished_at: Dict[str, float] = {}
+        for name, task in tasks.items():
+            task.add_done_callback(lambda _t, n=name: finished_at.setdefault(n, time.monotonic()))
+        if tasks:
+            await asyncio.wait(tasks.values(), timeout=self.remaining())
+
+        values: Dict[str, Any] = {}
+        status: Dict[str, dict] = {}
+        for name, task in tasks.items():
+            src = sources[name]
+            value, age, error = None, None, None
+            if task.done():
+                latency = finished_at.get(name, time.monotonic()) - started
+                if task.exception() is not None:
+                    state, error = "error", str(task.exception())
+                else:
+                    value = task.result()
+                    state = "ok" if value is not None else "empty"
+                    if value is not None and src.age:
+                        age = src.age(value)
+            else:
+                latency = time.monotonic() - started
+                state = "timeout"
+                _track_late(name, task)
+
+            if value is None and src.fallback:
+                cached = src.fallback()
+                if cached is not None:
+                    value, age = cached
+                    state = "stale"
+
+            _stats[state] += 1
+            values[name] = value
+            status[name] = {
+                "status": state,
+                "latency_ms": int(latency * 1000),
+                "age_seconds": round(age, 1) if age is not None else None,
+            }
+            if error:
+                status[name]["error"] = error
+        return values, status
+
+
+def _track_late(name: str, task: asyncio.Future):
+    _background.add(task)
+
+    def done(t: asyncio.Future):
+        _background.discard(t)
+        if t.cancelled():
+            return
+        if t.exception() is not None:
+            print(f"[Aggregator] Late source '{name}' failed: {t.exception()}")
+        else:
+            _stats["late_completed"] += 1
+
+    task.add_done_callback(done)
+
+
+async def gather(sources: Dict[str, Source], budget_ms: Optional[int] = None):
+    """Single-stage shortcut for Budget(budget_ms).gather(sources)."""
+    return await Budget(budget_ms).gather(sources)
+
+
+def stats() -> dict:
+    return {**_stats, "budget_ms": PRO_LATENCY_BUDGET_MS, "late_running": len(_background)}
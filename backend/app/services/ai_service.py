@@ -1,11 +1,26 @@
 import google.generativeai as genai
+import math
 import os
 from dotenv import load_dotenv
 
+from .api_cache import APICache
+from .aqi_calculator import AQI_CATEGORIES
+
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Precautions are cached per quantized condition bucket, so the model is called
+# once per distinct condition instead of once per request.
+PRECAUTION_TTL = int(os.getenv("PRECAUTION_TTL", "1800"))
+PRECAUTION_CACHE_SIZE = int(os.getenv("PRECAUTION_CACHE_SIZE", "512"))
+TEMP_BUCKET_C = 2.0
+HUMIDITY_BUCKET_PCT = 10.0
+
+precaution_cache = APICache(
+    ttl_seconds=PRECAUTION_TTL, stale_seconds=PRECAUTION_TTL, max_entries=PRECAUTION_CACHE_SIZE, name="precautions"
+)
+
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
     model = genai.GenerativeModel('models/gemini-2.0-flash')
@@ -13,12 +28,90 @@ else:
     print("Warning: GEMINI_API_KEY not found. AI features will be disabled.")
     model = None
 
+def _aqi_band(aqi: float) -> int:
+    for band, (i_low, i_high, *_rest) in enumerate(AQI_CATEGORIES):
+        if aqi <= i_high:
+            return band
+    return len(AQI_CATEGORIES) - 1
+
+
+def condition_bucket(temp, humidity, aqi, gas_status):
+    """
+    Quantized condition: (2°C temperature step, 10% humidity step, AQI category, gas status).
+    Missing values fall back to the same defaults /api/pro/current uses.
+    """
+    temp = 25.0 if temp is None else float(temp)
+    humidity = 50.0 if humidity is None else float(humidity)
+    aqi = 50.0 if aqi is None else float(aqi)
+    return (
+        math.floor(temp / TEMP_BUCKET_C),
+        math.floor(humidity / HUMIDITY_BUCKET_PCT),
+        _aqi_band(aqi),
+        gas_status,
+    )
+
+
+def rule_based_precautions(temp, humidity, aqi, gas_status):
+    """Immediate precautions from fixed thresholds (used until the model's answer is cached)."""
+    temp = 25.0 if temp is None else temp
+    humidity = 50.0 if humidity is None else humidity
+    aqi = 50.0 if aqi is None else aqi
+    tips = []
+    if gas_status == "Hazardous" or aqi > 200:
+        tips.append("Hazardous air: Stay indoors and wear an N95 mask if you must go out.")
+    elif gas_status == "Unhealthy" or aqi > 100:
+        tips.append("Poor Air Quality: Wear an N95 mask outdoors and limit exertion.")
+    if temp >= 35:
+        tips.append("Extreme heat: Carry a water bottle and avoid direct sun at midday.")
+    elif temp >= 30:
+        tips.append("High temperature: Stay hydrated and apply sunscreen.")
+    elif temp <= 5:
+        tips.append("Cold conditions: Dress in warm layers.")
+    if humidity >= 80:
+        tips.append("High humidity: Ventilate indoor spaces; rain is likely, carry an umbrella.")
+    elif humidity <= 25:
+        tips.append("Dry air: Drink water regularly and protect your skin.")
+    if not tips:
+        tips.append("Conditions are comfortable: No special precautions needed.")
+    return tips[:3]
+
+
 async def analyze_sensor_data(temp, humidity, aqi, gas_status):
     """
-    Uses Gemini to generate a short safety precaution based on sensor metrics.
+    Safety precautions for the given conditions without waiting on Gemini.
+    Cached model output for the condition bucket is returned when available;
+    otherwise rule-based precautions are returned at once while the model
+    answer is generated in the background (one call per bucket).
+    """
+    return get_precautions(temp, humidity, aqi, gas_status)[0]
+
+
+def get_precautions(temp, humidity, aqi, gas_status):
+    """
+    Same as analyze_sensor_data, also reporting where the answer came from.
+    Must be called from the event loop.
+
+    Returns:
+        (precautions, "model" | "rules")
     """
     if not model:
-        return ["AI Offline: Check API Key"]
+        return rule_based_precautions(temp, humidity, aqi, gas_status), "rules"
+    bucket = condition_bucket(temp, humidity, aqi, gas_status)
+    cached = precaution_cache.get_or_schedule(
+        "|".join(map(str, bucket)), lambda: _generate_precautions(bucket)
+    )
+    if cached:
+        return cached, "model"
+    return rule_based_precautions(temp, humidity, aqi, gas_status), "rules"
+
+
+async def _generate_precautions(bucket):
+    """Gemini precautions for a condition bucket (prompted with the bucket's ranges). None on failure."""
+    t, h, band, gas_status = bucket
+    temp = f"{t * TEMP_BUCKET_C:g} to {(t + 1) * TEMP_BUCKET_C:g}"
+    humidity = f"{h * HUMIDITY_BUCKET_PCT:g} to {(h + 1) * HUMIDITY_BUCKET_PCT:g}"
+    i_low, i_high, level = AQI_CATEGORIES[band][:3]
+    aqi = f"{i_low}-{i_high} ({level})"
 
     prompt = f"""
     Act as an Environmental Safety Officer. 
@@ -40,7 +133,7 @@ async def analyze_sensor_data(temp, humidity, aqi, gas_status):
         
         # Simple parsing to get list from text if needed, or just return lines
         lines = [line.strip().lstrip('- ').lstrip('* ') for line in text.split('\n') if line.strip()]
-        return lines[:3] # Return top 3
+        return lines[:3] or None # Return top 3
     except Exception as e:
         print(f"Gemini Error: {e}")
-        return ["AI Analysis Unavailable"]
+        return None  # Not cached; the next miss retries
@@ -0,0 +1,205 @@
+"""
+Alert Rules Engine
+Every user's AlertSettings are compiled into one numpy threshold table.
+Users sharing identical thresholds share a row ("profile"), so evaluating a
+measurement is a single vectorized comparison over the distinct profiles,
+independent of the number of users.
+
+Cooldowns are kept in memory per (user, device, metric) with a TTL, so a user
+is not re-alerted for the same condition on the same device while it persists.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+ALERT_COOLDOWN_SECONDS = int(os.getenv("ALERT_COOLDOWN_SECONDS", "900"))  # 15 minutes
+ALERT_RULES_REFRESH_SECONDS = int(os.getenv("ALERT_RULES_REFRESH_SECONDS", "300"))
+COOLDOWN_MAX_KEYS = int(os.getenv("ALERT_COOLDOWN_MAX_KEYS", "200000"))
+
+# Rule columns: (metric key, AlertSettings column, default limit, direction)
+# direction +1: alert when value > limit, -1: alert when value < limit
+RULES = (
+    ("temperature", "temp_threshold", 45.0, 1),
+    ("humidity_high", "humidity_max", 80.0, 1),
+    ("humidity_low", "humidity_min", 20.0, -1),
+    ("pm25", "pm25_threshold", 150.0, 1),
+    ("wind", "wind_threshold", 30.0, 1),
+)
+METRICS = tuple(r[0] for r in RULES)
+_SIGNS = np.array([r[3] for r in RULES], dtype=float)
+DEFAULT_LIMITS = np.array([r[2] for r in RULES], dtype=float)
+
+
+def measurement_vector(measurement) -> np.ndarray:
+    """
+    Values compared by each rule column (NaN = not evaluated).
+    Zero/missing readings are skipped, as the original checks were truthiness based.
+    """
+    values = (
+        measurement.temperature,
+        measurement.humidity,
+        measurement.humidity,
+        measurement.pm2_5,
+        measurement.wind_speed,
+    )
+    return np.array([v if v else np.nan for v in values], dtype=float)
+
+
+def format_trigger(metric: str, value: float, limit: float) -> str:
+    """Human readable violation text (same wording as the legacy checks)."""
+    if metric == "temperature":
+        return f"CRITICAL TEMP: {value}°C (Limit: {limit}°C)"
+    if metric == "humidity_high":
+        return f"HIGH HUMIDITY: {value}% (Limit: {limit}%)"
+    if metric == "humidity_low":
+        return f"LOW HUMIDITY: {value}% (Limit: {limit}%)"
+    if metric == "pm25":
+        return f"HAZARDOUS AIR: PM2.5 is {value} µg/m³ (Limit: {limit})"
+    if metric == "wind":
+        return f"HAZARDOUS WIND: {value} km/h (Limit: {limit} km/h)"
+    return f"{metric.upper()}: {value} (Limit: {limit})"
+
+
+class CompiledRules:
+    """Immutable snapshot of all active AlertSettings."""
+    __slots__ = ("limits", "profile_of", "default_profile", "default_email", "compiled_at")
+
+    def __init__(self, limits: np.ndarray, profile_of: Dict[str, int], default_profile: int, default_email: Optional[str]):
+        self.limits = limits                    # profiles x metrics
+        self.profile_of = profile_of            # user email -> profile row
+        self.default_profile = default_profile  # used for users without settings
+        self.default_email = default_email      # owner of the default settings row
+        self.compiled_at = time.monotonic()
+
+    @classmethod
+    def compile(cls, rows: Iterable[Tuple]) -> "CompiledRules":
+        """
+        Args:
+            rows: (user_email, temp_threshold, humidity_max, humidity_min,
+                  pm25_threshold, wind_threshold) of active settings, in id order.
+                  The first row is the default for users without settings.
+        """
+        rows = list(rows)
+        if not rows:
+            return cls(DEFAULT_LIMITS[None, :].copy(), {}, 0, None)
+
+        # Distinct threshold tuples become profiles (None -> default limit)
+        profiles: Dict[Tuple, int] = {}
+        profile_of: Dict[str, int] = {}
+        defaults = DEFAULT_LIMITS.tolist()
+        for row in rows:
+            limits = tuple(defaults[i] if v is None else float(v) for i, v in enumerate(row[1:]))
+            p = profiles.setdefault(limits, len(profiles))
+            if row[0] and row[0] not in profile_of:  # First row per user wins (as .first())
+                profile_of[row[0]] = p
+
+        table = np.array(list(profiles), dtype=float)
+        return cls(table, profile_of, 0, rows[0][0])
+
+    def evaluate(self, values: np.ndarray) -> np.ndarray:
+        """Boolean profiles x metrics matrix of violated rules."""
+        with np.errstate(invalid="ignore"):
+            return (_SIGNS * values) > (_SIGNS * self.limits)
+
+    def profile_for(self, email: Optional[str]) -> int:
+        return self.profile_of.get(email, self.default_profile)
+
+
+class AlertRuleEngine:
+    def __init__(self, cooldown_seconds: int = ALERT_COOLDOWN_SECONDS, refresh_seconds: int = ALERT_RULES_REFRESH_SECONDS):
+        self.cooldown_seconds = cooldown_seconds
+        self.refresh_seconds = refresh_seconds
+        self._rules: Optional[CompiledRules] = None
+        self._cooldowns: Dict[Tuple[str, str, str], float] = {}
+        self._lock = threading.Lock()
+
+    # --- Rule table ---
+    def load(self, db=None) -> CompiledRules:
+        """Compile the rule table from every active AlertSettings row."""
+        from .. import database, models
+
+        own_session = db is None
+        db = db or database.SessionLocal()
+        try:
+            S = models.AlertSettings
+            rows = db.query(
+                S.user_email, *(getattr(S, column) for _, column, _, _ in RULES)
+            ).filter(S.is_active == True).order_by(S.id.asc()).all()
+            self._rules = CompiledRules.compile(rows)
+            print(f"[AlertRules] Compiled {len(rows)} settings into {len(self._rules.limits)} profiles")
+            return self._rules
+        finally:
+            if own_session:
+                db.close()
+
+    def invalidate(self):
+        """Force a recompile on next use (call after AlertSettings change)."""
+        self._rules = None
+
+    def rules(self, db=None) -> CompiledRules:
+        rules = self._rules
+        if rules is None or time.monotonic() - rules.compiled_at > self.refresh_seconds:
+            rules = self.load(db)
+        return rules
+
+    # --- Cooldowns ---
+    def _claim(self, key: Tuple[str, str, str], now: float) -> bool:
+        """True (and start the cooldown) unless `key` is cooling down."""
+        expires = self._cooldowns.get(key)
+        if expires is not None and expires > now:
+            return False
+        self._cooldowns[key] = now + self.cooldown_seconds
+        return True
+
+    def _sweep(self, now: float):
+        if len(self._cooldowns) > COOLDOWN_MAX_KEYS:
+            self._cooldowns = {k: exp for k, exp in self._cooldowns.items() if exp > now}
+
+    def reset_cooldowns(self):
+        with self._lock:
+            self._cooldowns.clear()
+
+    # --- Evaluation ---
+    def evaluate(self, measurement, device_id: str, audience: Iterable[str], db=None) -> List[dict]:
+        """
+        Evaluate a measurement for a set of candidate recipients.
+
+        Returns:
+            One group per distinct violation set: {"metrics", "triggers", "recipients"}.
+            Metrics still in cooldown for a recipient are dropped; recipients with
+            nothing left are omitted. Empty list = nothing to send.
+        """
+        rules = self.rules(db)
+        values = measurement_vector(measurement)
+        violated = rules.evaluate(values)
+        if not violated.any():
+            return []
+
+        now = time.monotonic()
+        groups: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        with self._lock:
+            self._sweep(now)
+            for email in audience:
+                p = rules.profile_for(email)
+                hits = tuple(
+                    int(m) for m in np.flatnonzero(violated[p])
+                    if self._claim((email, device_id, METRICS[m]), now)
+                )
+                if hits:
+                    groups.setdefault((p, hits), set()).add(email)
+
+        result = []
+        for (p, hits), recipients in groups.items():
+            result.append({
+                "metrics": [METRICS[m] for m in hits],
+                "triggers": [format_trigger(METRICS[m], float(values[m]), float(rules.limits[p, m])) for m in hits],
+                "recipients": recipients,
+            })
+        return result
+
+
+# Global engine instance
+rule_engine = AlertRuleEngine()
@@ -1,41 +1,255 @@
 """
 API Cache Module
-In-memory cache with TTL for external API data.
+Bounded in-memory TTL/LRU cache for external API data.
 Used to serve real-time map data without hitting rate limits.
 """
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 import random
 
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Named caches, for /api/cache/stats
+cache_registry: Dict[str, "APICache"] = {}
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """Approximate deep size in bytes of a JSON-like value (dict/list/str/number)."""
+    size = sys.getsizeof(value)
+    if _depth > 6:
+        return size
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+    elif isinstance(value, (list, tuple, set)):
+        for v in value:
+            size += estimate_size(v, _depth + 1)
+    return size
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at", "expires_at", "stale_until", "size")
+
+    def __init__(self, value, stored_at, expires_at, stale_until, size):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.size = size
+
+
 class APICache:
-    def __init__(self, ttl_seconds: int = 60):
-        self.ttl = timedelta(seconds=ttl_seconds)
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._timestamps: Dict[str, datetime] = {}
-    
+    """
+    Bounded TTL + LRU cache.
+    - At most `max_entries` entries and roughly `max_bytes` of payload;
+      least recently used entries are evicted first.
+    - Expiry uses the monotonic clock. An entry is fresh for `ttl_seconds`, then
+      stale for `stale_seconds` more, during which get_or_load() serves it while
+      refreshing in the background (stale-while-revalidate).
+    - Thread-safe (lock around the map), so threads and the event loop can share it.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = 60,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        stale_seconds: int = 0,
+        name: Optional[str] = None,
+    ):
+        self.ttl = float(ttl_seconds)
+        self.stale = float(stale_seconds)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.name = name
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "refreshes": 0}
+        if name:
+            cache_registry[name] = self
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _remove(self, key: str):
+        entry = self._cache.pop(key)
+        self._bytes -= entry.size
+
+    def _lookup(self, key: str, now: float):
+        """Entry and whether it is fresh; drops entries past their stale window."""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None, False
+        if now >= entry.stale_until:
+            self._remove(key)
+            self._stats["expirations"] += 1
+            return None, False
+        self._cache.move_to_end(key)
+        return entry, now < entry.expires_at
+
     def get(self, key: str) -> Optional[Any]:
-        """Get cached value if not expired."""
-        if key not in self._cache:
-            return None
-        if datetime.utcnow() - self._timestamps[key] > self.ttl:
-            del self._cache[key]
-            del self._timestamps[key]
+        """Get cached value if not expired (fresh entries only)."""
+        with self._lock:
+            entry, fresh = self._lookup(key, time.monotonic())
+            if entry is not None and fresh:
+                self._stats["hits"] += 1
+                return entry.value
+            self._stats["misses"] += 1
             return None
-        return self._cache[key]
-    
-    def set(self, key: str, value: Any):
-        """Set a cached value with timestamp."""
-        self._cache[key] = value
-        self._timestamps[key] = datetime.utcnow()
+
+    def get_stale(self, key: str) -> Optional[Any]:
+        """Get cached value even if past its TTL (within the stale window)."""
+        with self._lock:
+            entry, fresh = self._lookup(key, time.monotonic())
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits" if fresh else "stale_hits"] += 1
+            return entry.value
     
+    def peek(self, key: str) -> Optional[Tuple[Any, float]]:
+        """(value, age in seconds) of a fresh or stale entry, without touching stats or LRU order."""
+        with self._lock:
+            entry = self._cache.get(key)
+            now = time.monotonic()
+            if entry is None or now >= entry.stale_until:
+                return None
+            return entry.value, now - entry.stored_at
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Set a cached value, evicting least recently used entries if over budget."""
+        ttl = self.ttl if ttl_seconds is None else float(ttl_seconds)
+        size = estimate_size(value)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+            if size > self.max_bytes:
+                return  # Never cache a single value larger than the whole budget
+            self._cache[key] = _Entry(value, now, now + ttl, now + ttl + self.stale, size)
+            self._bytes += size
+            while len(self._cache) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._cache))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+
     def clear(self):
         """Clear all cache."""
-        self._cache.clear()
-        self._timestamps.clear()
+        with self._lock:
+            self._cache.clear()
+            self._bytes = 0
+
+    def _load(self, key: str, loader: Callable[[], Awaitable[Any]], cache_if) -> asyncio.Future:
+        """Start (or join) the single in-flight load for `key`."""
+        task = self._inflight.get(key)
+        if task is not None and not task.done():
+            return task
+
+        def done(t: asyncio.Future):
+            self._inflight.pop(key, None)
+            if t.cancelled() or t.exception() is not None:
+                return
+            if cache_if(t.result()):
+                self.set(key, t.result())
+
+        task = asyncio.ensure_future(loader())
+        task.add_done_callback(done)
+        self._inflight[key] = task
+        return task
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        cache_if: Optional[Callable[[Any], bool]] = None,
+    ):
+        """
+        Cached value for `key`, loading it with `loader()` on a miss.
+        Stale entries are returned immediately while a background refresh runs.
+        Concurrent misses for the same key share one load.
+
+        Args:
+            loader: Zero-argument coroutine function producing the value
+            cache_if: Predicate deciding whether a loaded value is cached (default: not None)
+        """
+        cache_if = cache_if or (lambda v: v is not None)
+        with self._lock:
+            entry, fresh = self._lookup(key, time.monotonic())
+            if entry is not None:
+                self._stats["hits" if fresh else "stale_hits"] += 1
+            else:
+                self._stats["misses"] += 1
+
+        if entry is not None:
+            if not fresh and key not in self._inflight:
+                self._stats["refreshes"] += 1
+                self._load(key, loader, cache_if)
+            return entry.value
+
+        # Run the load as its own task so a cancelled caller doesn't cancel the others
+        return await asyncio.shield(self._load(key, loader, cache_if))
+
+    def get_or_schedule(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        cache_if: Optional[Callable[[Any], bool]] = None,
+    ) -> Optional[Any]:
+        """
+        Non-blocking get_or_load(): the cached value (fresh or stale, refreshing
+        stale ones in the background), or None after starting the background
+        load on a miss. Must be called from the event loop.
+        """
+        cache_if = cache_if or (lambda v: v is not None)
+        with self._lock:
+            entry, fresh = self._lookup(key, time.monotonic())
+            if entry is not None:
+                self._stats["hits" if fresh else "stale_hits"] += 1
+            else:
+                self._stats["misses"] += 1
+
+        if entry is not None and fresh:
+            return entry.value
+        if key not in self._inflight:
+            if entry is not None:
+                self._stats["refreshes"] += 1
+            self._load(key, loader, cache_if)
+        return entry.value if entry is not None else None
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and current size."""
+        lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._cache),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "hit_ratio": round((self._stats["hits"] + self._stats["stale_hits"]) / lookups, 4) if lookups else None,
+        }
+
+
+def cache_stats() -> dict:
+    """Stats of every named cache."""
+    return {name: cache.stats() for name, cache in cache_registry.items()}
 
 # Global cache instance
-map_data_cache = APICache(ttl_seconds=60)
+map_data_cache = APICache(ttl_seconds=60, max_entries=16, stale_seconds=300, name="map_markers")
 
 # --- India City Data for Real-Time Map ---
 INDIA_CITIES = [
@@ -109,8 +323,8 @@ async def refresh_map_cache():
         await asyncio.sleep(30)  # Refresh every 30 seconds
 
 def get_cached_markers():
-    """Get markers from cache or generate fresh."""
-    cached = map_data_cache.get("india_markers")
+    """Get markers from cache (stale markers are fine until the refresher runs) or generate fresh."""
+    cached = map_data_cache.get_stale("india_markers")
     if cached:
         return cached
     # Generate fresh if no cache
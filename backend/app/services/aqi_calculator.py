@@ -3,9 +3,11 @@ US EPA AQI (Air Quality Index) Calculator.
 Implements the official EPA sub-index method for calculating AQI from pollutant concentrations.
 """
 
-from typing import Dict, Optional, Tuple
+from typing import Dict, Optional, Sequence, Tuple
 import math
 
+import numpy as np
+
 
 # EPA AQI Breakpoints for each pollutant
 # Format: [(C_low, C_high, I_low, I_high), ...]
@@ -200,6 +202,90 @@ def calculate_overall_aqi(pollutants: Dict[str, Optional[float]]) -> Dict[str, a
     }
 
 
+# --- Batch (NumPy) API ---
+# Breakpoints compiled into ascending arrays per pollutant:
+# (c_low, c_high, i_low, i_high). Ranges never overlap, so the range holding a
+# concentration is the last one whose c_low <= c (searchsorted).
+_COMPILED_BREAKPOINTS = {
+    pollutant: tuple(np.array(col, dtype=np.float64) for col in zip(*breakpoints))
+    for pollutant, breakpoints in AQI_BREAKPOINTS.items()
+}
+_CATEGORY_LOWS = np.array([c[0] for c in AQI_CATEGORIES], dtype=np.int64)
+_CATEGORY_HIGHS = np.array([c[1] for c in AQI_CATEGORIES], dtype=np.int64)
+NO_AQI = -1  # Marks "no value" in the integer result arrays
+
+
+def calculate_aqi_for_pollutant_batch(pollutant: str, concentrations) -> np.ndarray:
+    """
+    Vectorized calculate_aqi_for_pollutant over an array of concentrations.
+
+    Args:
+        pollutant: Pollutant name (pm25, pm10, o3, no2, so2, co)
+        concentrations: Array-like of concentrations (None / NaN for missing)
+
+    Returns:
+        int64 array of sub-indices; NO_AQI where the scalar function returns None
+    """
+    c = np.asarray(concentrations, dtype=np.float64)
+    out = np.full(c.shape, NO_AQI, dtype=np.int64)
+    if pollutant not in _COMPILED_BREAKPOINTS:
+        return out
+    c_low, c_high, i_low, i_high = _COMPILED_BREAKPOINTS[pollutant]
+
+    idx = np.searchsorted(c_low, c, side="right") - 1
+    safe = np.clip(idx, 0, len(c_low) - 1)
+    inside = (idx >= 0) & (c <= c_high[safe])  # False for NaN and for gaps between ranges
+    # Same float expression as the scalar path; np.rint rounds half to even like round()
+    aqi = ((i_high[safe] - i_low[safe]) / (c_high[safe] - c_low[safe])) * (c - c_low[safe]) + i_low[safe]
+    out[inside] = np.rint(aqi[inside]).astype(np.int64)
+    out[c > c_high[-1]] = 500  # Cap at maximum
+    return out
+
+
+def aqi_category_index_batch(aqi) -> np.ndarray:
+    """Index into AQI_CATEGORIES for each AQI (as get_aqi_category); NO_AQI stays NO_AQI."""
+    aqi = np.asarray(aqi, dtype=np.int64)
+    idx = np.searchsorted(_CATEGORY_LOWS, aqi, side="right") - 1
+    safe = np.clip(idx, 0, len(_CATEGORY_LOWS) - 1)
+    found = (idx >= 0) & (aqi <= _CATEGORY_HIGHS[safe])
+    out = np.where(found, safe, len(AQI_CATEGORIES) - 1)  # Out of range falls back to Hazardous
+    out[aqi == NO_AQI] = NO_AQI
+    return out
+
+
+def calculate_overall_aqi_batch(pollutants: Dict[str, Sequence[Optional[float]]]) -> Dict[str, any]:
+    """
+    Vectorized calculate_overall_aqi over equally long concentration columns.
+
+    Args:
+        pollutants: Dict mapping pollutant name -> concentrations (None / NaN for missing)
+                   e.g., {"pm25": pm25_array, "pm10": pm10_array}
+
+    Returns:
+        Dict with int64 arrays "aqi", "dominant" (index into "pollutants") and
+        "category" (index into AQI_CATEGORIES), NO_AQI where no sub-index exists,
+        plus "sub_indices" per pollutant and the "pollutants" key order used.
+        Ties for the dominant pollutant go to the first one, as in the scalar version.
+    """
+    keys = [p for p in pollutants if p in AQI_BREAKPOINTS]
+    sub_indices = {p: calculate_aqi_for_pollutant_batch(p, pollutants[p]) for p in keys}
+    if not keys:
+        n = len(next(iter(pollutants.values()), []))
+        empty = np.full(n, NO_AQI, dtype=np.int64)
+        return {"aqi": empty, "dominant": empty.copy(), "category": empty.copy(), "sub_indices": {}, "pollutants": []}
+
+    stacked = np.vstack([sub_indices[p] for p in keys])
+    overall = stacked.max(axis=0)
+    dominant = np.where(overall == NO_AQI, NO_AQI, stacked.argmax(axis=0))
+    return {
+        "aqi": overall,
+        "dominant": dominant,
+        "category": aqi_category_index_batch(overall),
+        "sub_indices": sub_indices,
+        "pollutants": keys,
+    }
+
+
 def get_health_recommendations(aqi: int, dominant_pollutant: str = None) -> Dict[str, any]:
     """
     Get health recommendations based on AQI and dominant pollutant.
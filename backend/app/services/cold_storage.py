@@ -0,0 +1,240 @@
+"""
+Cold storage tier for aged rows of `sensor_data` and `api_snapshots`.
+Rows older than COLD_AFTER_DAYS are moved into Parquet files partitioned by
+device (or snapshot location) and day, then deleted from the hot table, so the
+table and its indexes stay small. History reads merge the hot table with
+memory-mapped columnar scans of the matching partitions by timestamp (batch
+uploads can bring rows older than ones already in cold storage).
+
+Layout: COLD_STORAGE_DIR/<table>/<quoted key>/<YYYY-MM-DD>.parquet
+One file per (key, day): rows tiered later into an existing day (late uploads,
+or a re-run after an interrupted move) are merged into it, replacing rows with
+the same (id, time), so nothing is duplicated. Requires pyarrow; without it the tier
+is disabled and reads only see the hot table.
+"""
+import asyncio
+import os
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+from sqlalchemy import Boolean, DateTime, Float, Integer
+
+from .. import database, models
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", os.path.join(BASE_DIR, "cold_storage"))
+COLD_STORAGE_ENABLED = os.getenv("COLD_STORAGE_ENABLED", "false").lower() == "true"  # Run the tiering job
+COLD_AFTER_DAYS = int(os.getenv("COLD_AFTER_DAYS", "90"))
+COLD_TIER_INTERVAL = int(os.getenv("COLD_TIER_INTERVAL", str(6 * 3600)))
+COLD_READ_CHUNK = 50000
+COLD_DELETE_CHUNK = 1000  # Ids per DELETE ... WHERE id IN (...)
+
+# table -> (model, time column, partition key column)
+TABLES = {
+    "sensor_data": (models.SensorData, "timestamp", "device_id"),
+    "api_snapshots": (models.APISnapshot, "created_at", "location"),
+}
+
+
+def _arrow_type(column):
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _schema(table: str):
+    model = TABLES[table][0]
+    return pa.schema([(c.name, _arrow_type(c)) for c in model.__table__.columns])
+
+
+def enabled() -> bool:
+    """True when cold partitions may exist and can be read."""
+    return PARQUET_AVAILABLE and os.path.isdir(COLD_STORAGE_DIR)
+
+
+# --- Partitions ---
+def _key_dir(table: str, key: str) -> str:
+    return os.path.join(COLD_STORAGE_DIR, table, quote(str(key), safe=""))
+
+
+def partitions(table: str, key: Optional[str] = None, start: Optional[datetime] = None,
+               end: Optional[datetime] = None) -> List[Tuple[date, str, str]]:
+    """(day, key, path) of partition files overlapping [start, end), oldest day first."""
+    root = os.path.join(COLD_STORAGE_DIR, table)
+    if not PARQUET_AVAILABLE or not os.path.isdir(root):
+        return []
+    key_dirs = [quote(str(key), safe="")] if key is not None else os.listdir(root)
+    first, last = (start.date() if start else None), (end.date() if end else None)
+    found = []
+    for kd in key_dirs:
+        path = os.path.join(root, kd)
+        if not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            if not name.endswith(".parquet"):
+                continue
+            day = date.fromisoformat(name[:10])
+            if (first and day < first) or (last and day > last):
+                continue
+            found.append((day, unquote(kd), os.path.join(path, name)))
+    found.sort()
+    return found
+
+
+def _write_partition(table: str, key: str, day: date, columns: Dict[str, list]):
+    directory = _key_dir(table, key)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{day.isoformat()}.parquet")
+    data = pa.Table.from_pydict(columns, schema=_schema(table))
+    if os.path.exists(path):
+        # Merge into the day already on disk; a re-archived row (same id and
+        # time) replaces its old copy. SQLite may reuse ids of deleted rows, so
+        # the id alone does not identify a row.
+        time_col = TABLES[table][1]
+        existing = pq.read_table(path, schema=data.schema)
+        written = set(zip(columns["id"], columns[time_col]))
+        keep = [k not in written for k in zip(existing.column("id").to_pylist(), existing.column(time_col).to_pylist())]
+        data = pa.concat_tables([existing.filter(pa.array(keep, type=pa.bool_())), data])
+    tmp = path + ".tmp"
+    pq.write_table(data, tmp, compression="zstd")
+    os.replace(tmp, path)  # Readers never see a half-written file
+
+
+# --- Tiering ---
+def tier(table: str, older_than_days: int = COLD_AFTER_DAYS) -> dict:
+    """
+    Move rows older than `older_than_days` (whole days) from `table` to Parquet.
+    Rows are streamed per (key, day) partition; once every partition is on
+    disk exactly the ids written are deleted, so rows committed after the read
+    started (late device timestamps, out-of-order ids) stay hot until the
+    next run.
+
+    Returns:
+        {"rows": moved rows, "partitions": files written, "keys": keys touched}
+    """
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("pyarrow is not installed")
+    model, time_col, key_col = TABLES[table]
+    cutoff = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=older_than_days)
+    names = [c.name for c in model.__table__.columns]
+    T, K = getattr(model, time_col), getattr(model, key_col)
+
+    reader = database.SessionLocal()
+    writer = database.SessionLocal()
+    stats = {"rows": 0, "partitions": 0, "keys": 0}
+    try:
+        query = reader.query(*(getattr(model, n) for n in names)).filter(T < cutoff).order_by(
+            K.asc(), T.asc(), model.id.asc()
+        ).execution_options(yield_per=COLD_READ_CHUNK)
+
+        # Ids written to Parquet; deleted once the read cursor is closed
+        archived = array("q")
+        keys = set()
+        current, columns = None, None
+        key_idx, time_idx = names.index(key_col), names.index(time_col)
+        for row in query:
+            part = (row[key_idx], row[time_idx].date())
+            if part != current:
+                if columns:
+                    _write_partition(table, current[0], current[1], columns)
+                    archived.extend(columns["id"])
+                    stats["partitions"] += 1
+                current, columns = part, {n: [] for n in names}
+                keys.add(part[0])
+            for n, v in zip(names, row):
+                columns[n].append(v)
+            stats["rows"] += 1
+        if columns:
+            _write_partition(table, current[0], current[1], columns)
+            archived.extend(columns["id"])
+            stats["partitions"] += 1
+        reader.close()
+
+        for i in range(0, len(archived), COLD_DELETE_CHUNK):
+            chunk = archived[i:i + COLD_DELETE_CHUNK].tolist()
+            writer.query(model).filter(model.id.in_(chunk)).delete(synchronize_session=False)
+            writer.commit()
+        stats["keys"] = len(keys)
+        return stats
+    except Exception:
+        writer.rollback()
+        raise
+    finally:
+        reader.close()
+        writer.close()
+
+
+def tier_all(older_than_days: int = COLD_AFTER_DAYS) -> dict:
+    return {table: tier(table, older_than_days) for table in TABLES}
+
+
+async def tiering_loop(interval_seconds: int = COLD_TIER_INTERVAL):
+    """Background task moving aged rows to the cold tier (COLD_STORAGE_ENABLED=true)."""
+    if not COLD_STORAGE_ENABLED:
+        return
+    if not PARQUET_AVAILABLE:
+        print("⚠️ Cold storage enabled but pyarrow is not installed; tiering disabled")
+        return
+    while True:
+        try:
+            result = await asyncio.to_thread(tier_all)
+            print(f"[ColdStorage] Tiered: {result}")
+        except Exception as e:
+            print(f"[ColdStorage] Tiering error: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+# --- Reads ---
+def _read_day(table: str, paths: Sequence[str], columns: Sequence[str], start: Optional[datetime],
+              end: Optional[datetime]):
+    time_col = TABLES[table][1]
+    filters = []
+    if start:
+        filters.append((time_col, ">=", start))
+    if end:
+        filters.append((time_col, "<", end))
+    tables = [
+        pq.read_table(p, columns=list(columns), filters=filters or None, memory_map=True)
+        for p in paths
+    ]
+    return pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+
+
+def iter_days(table: str, columns: Sequence[str], key: Optional[str] = None, start: Optional[datetime] = None,
+              end: Optional[datetime] = None, descending: bool = False) -> Iterator["pa.Table"]:
+    """One Arrow table per day (all matching keys), sorted by (time, id) in the requested direction."""
+    time_col = TABLES[table][1]
+    by_day: Dict[date, List[str]] = {}
+    for day, _, path in partitions(table, key, start, end):
+        by_day.setdefault(day, []).append(path)
+    order = "descending" if descending else "ascending"
+    read = list(columns) + [c for c in (time_col, "id") if c not in columns]  # Sort keys
+    for day in sorted(by_day, reverse=descending):
+        data = _read_day(table, by_day[day], read, start, end)
+        if data.num_rows:
+            yield data.sort_by([(time_col, order), ("id", order)]).select(list(columns))
+
+
+def scan(table: str, columns: Optional[Sequence[str]] = None, key: Optional[str] = None,
+         start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """All cold rows in range as dicts, oldest first."""
+    columns = list(columns or _schema(table).names)
+    rows = []
+    for data in iter_days(table, columns, key, start, end):
+        rows.extend(data.to_pylist())
+    return rows
@@ -0,0 +1,191 @@
+"""
+Historical SensorData reads for /api/data.
+- Pages are keyset-paginated on (timestamp, id): each page is one index range
+  scan regardless of depth, and the opaque cursor survives concurrent inserts.
+- Exports (NDJSON / CSV) stream rows through a server-side cursor
+  (yield_per), so memory stays constant however many rows are exported.
+- Rows moved to the Parquet cold tier (services/cold_storage.py) are merged
+  in by (timestamp, id); hot and cold time ranges may overlap (late batch
+  uploads land in the hot table with old device timestamps).
+Rows are selected as plain column tuples, never as ORM objects.
+"""
+import base64
+import csv
+import heapq
+import io
+import json
+from itertools import chain, islice
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+from .. import database, models
+from . import cold_storage
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # Cold tier disabled (cold_storage.enabled() is False)
+    pa = pc = None
+
+SD = models.SensorData
+KEY_FIELDS = ("id", "timestamp", "device_id")
+# Every other column of sensor_data is a selectable metric
+METRIC_FIELDS = tuple(c.name for c in SD.__table__.columns if c.name not in KEY_FIELDS)
+MAX_PAGE_SIZE = 5000
+STREAM_CHUNK = 5000  # Rows fetched per server-side cursor round trip
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def select_fields(metrics: Optional[str]) -> List[str]:
+    """Key columns plus the requested (comma separated) metrics, or all of them."""
+    if not metrics:
+        return list(KEY_FIELDS + METRIC_FIELDS)
+    chosen = [m.strip() for m in metrics.split(",") if m.strip()]
+    unknown = [m for m in chosen if m not in METRIC_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown metric(s): {', '.join(unknown)}")
+    return list(KEY_FIELDS) + [m for m in chosen if m not in KEY_FIELDS]
+
+
+def build_query(db, fields: Sequence[str], device_id: Optional[str] = None, start: Optional[datetime] = None,
+                end: Optional[datetime] = None, cursor: Optional[str] = None, order: str = "desc"):
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be 'asc' or 'desc'")
+    query = db.query(*(getattr(SD, f) for f in fields)).filter(SD.timestamp.isnot(None))
+    if device_id:
+        query = query.filter(SD.device_id == device_id)
+    if start:
+        query = query.filter(SD.timestamp >= start)
+    if end:
+        query = query.filter(SD.timestamp < end)
+    key = tuple_(SD.timestamp, SD.id)
+    if cursor:
+        after = tuple_(*decode_cursor(cursor))
+        query = query.filter(key < after if order == "desc" else key > after)
+    if order == "desc":
+        return query.order_by(SD.timestamp.desc(), SD.id.desc())
+    return query.order_by(SD.timestamp.asc(), SD.id.asc())
+
+
+def _jsonable(fields: Sequence[str], row) -> dict:
+    return {f: (v.isoformat() if isinstance(v, datetime) else v) for f, v in zip(fields, row)}
+
+
+def _cold_days(fields: Sequence[str], device_id: Optional[str] = None, start: Optional[datetime] = None,
+               end: Optional[datetime] = None, cursor: Optional[str] = None, order: str = "desc",
+               limit: Optional[int] = None) -> Iterator[list]:
+    """
+    Cold-tier rows as tuples, one list per day partition, in page order.
+    With `limit`, each day is cut to its first `limit` rows in Arrow before
+    any Python objects are built, so a page costs O(limit) per day read.
+    """
+    if not cold_storage.enabled():
+        return
+    after = decode_cursor(cursor) if cursor else None
+    if after and order == "desc":
+        end = min(end, after[0] + timedelta(microseconds=1)) if end else after[0] + timedelta(microseconds=1)
+    elif after:
+        start = max(start, after[0]) if start else after[0]
+    descending = order == "desc"
+    for data in cold_storage.iter_days("sensor_data", fields, device_id, start, end, descending=descending):
+        if after:
+            # Exact (timestamp, id) bound; the day scan was only bounded by timestamp
+            ts, ids = data.column("timestamp"), data.column("id")
+            bound_ts = pa.scalar(after[0], type=ts.type)
+            past = pc.less if descending else pc.greater
+            mask = pc.or_(past(ts, bound_ts), pc.and_(pc.equal(ts, bound_ts), past(ids, after[1])))
+            data = data.filter(mask)
+        if limit is not None:
+            data = data.slice(0, limit)
+        if data.num_rows:
+            yield list(zip(*(data.column(f).to_pylist() for f in fields)))
+
+
+def fetch_page(db, fields: Sequence[str], limit: int, **filters) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of rows as JSON-ready dicts.
+
+    Returns:
+        (rows, next_cursor or None when this is the last page)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    descending = filters.get("order", "desc") == "desc"
+    # The page is the first limit+1 rows of the union: take that many from each tier
+    rows = [tuple(r) for r in build_query(db, fields, **filters).limit(limit + 1).all()]
+    cold = 0
+    for day in _cold_days(fields, limit=limit + 1, **filters):  # Cold days in page order
+        rows.extend(day)
+        cold += len(day)
+        if cold > limit:
+            break
+    rows.sort(key=lambda r: (r[1], r[0]), reverse=descending)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[1], last[0])
+    return [_jsonable(fields, r) for r in rows], next_cursor
+
+
+def _stream_hot(fields: Sequence[str], limit: Optional[int], **filters) -> Iterator[Iterable]:
+    """Yield lists of row tuples from a server-side cursor (own session, closed at the end)."""
+    db = database.SessionLocal()
+    try:
+        query = build_query(db, fields, **filters)
+        if limit:
+            query = query.limit(limit)
+        result = db.execute(query.statement.execution_options(yield_per=STREAM_CHUNK))
+        for partition in result.partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def _stream_rows(fields: Sequence[str], limit: Optional[int], **filters) -> Iterator[Iterable]:
+    """Hot and cold rows merged by (timestamp, id) in export order, up to `limit`, in chunks."""
+    descending = filters.get("order", "desc") == "desc"
+    hot = chain.from_iterable(_stream_hot(fields, limit, **filters))
+    cold = chain.from_iterable(_cold_days(fields, **filters))
+    merged = heapq.merge(hot, cold, key=lambda r: (r[1], r[0]), reverse=descending)
+    if limit:
+        merged = islice(merged, limit)
+    while True:
+        rows = list(islice(merged, STREAM_CHUNK))
+        if not rows:
+            return
+        yield rows
+
+
+def stream_ndjson(fields: Sequence[str], limit: Optional[int] = None, **filters) -> Iterator[str]:
+    for rows in _stream_rows(fields, limit, **filters):
+        yield "".join(json.dumps(_jsonable(fields, r)) + "\n" for r in rows)
+
+
+def stream_csv(fields: Sequence[str], limit: Optional[int] = None, **filters) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for rows in _stream_rows(fields, limit, **filters):
+        writer.writerows(
+            [v.isoformat() if isinstance(v, datetime) else ("" if v is None else v) for v in r] for r in rows
+        )
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
@@ -1,37 +1,19 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import os
 from dotenv import load_dotenv
 
-load_dotenv()
+from . import mail_outbox
 
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-SMTP_USER = os.getenv("EMAIL_USER")
-SMTP_PASS = os.getenv("EMAIL_PASS")
+load_dotenv()
 
 def send_email_notification(to_email, subject, body):
-    if not SMTP_USER or not SMTP_PASS:
+    """Queues a transactional email (e.g. OTP) for the pooled outbox workers."""
+    if not mail_outbox.mail_configured():
         print("Email service not configured. Missing SMTP_USER or SMTP_PASS.")
         return False
 
     try:
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_USER
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(body, 'plain'))
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
-        text = msg.as_string()
-        server.sendmail(SMTP_USER, to_email, text)
-        server.quit()
-        print(f"✅ Email sent successfully to {to_email}")
+        mail_outbox.enqueue_now([to_email], subject, body, category="otp")
+        print(f"✅ Email queued for {to_email}")
         return True
     except Exception as e:
-        print(f"❌ Failed to send email: {e}")
+        print(f"❌ Failed to queue email: {e}")
         return False
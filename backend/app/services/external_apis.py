@@ -1,9 +1,10 @@
 import os
 import random
-import httpx
 from datetime import datetime
 from dotenv import load_dotenv
 
+from . import aggregator, http_client, geo_cache, gazetteer
+
 load_dotenv()
 
 # --- Configuration ---
@@ -16,25 +17,29 @@ async def fetch_open_weather(lat: float, lon: float):
     Fetches weather data from OpenWeatherMap.
     Falls back to mock data if no key is provided or request fails.
     """
+    return await geo_cache.get_or_fetch("openweather", lat, lon, lambda: _fetch_open_weather(lat, lon))
+
+async def _fetch_open_weather(lat: float, lon: float):
     if not OPENWEATHER_API_KEY:
         print("Warning: No OPENWEATHER_API_KEY found. Returning None.")
         return None
 
     url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}&units=metric"
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(url, timeout=5.0)
-            resp.raise_for_status()
-            return parse_owm_response(resp.json())
-        except Exception as e:
-            print(f"OWM Fetch Error: {e}")
-            return None
+    try:
+        data = await http_client.get_json(url, timeout=5.0)
+        return parse_owm_response(data)
+    except Exception as e:
+        print(f"OWM Fetch Error: {e}")
+        return None
 
 async def fetch_air_quality(lat: float, lon: float):
     """
     Fetches Air Quality from OpenAQ.
     Uses the provided API Key.
     """
+    return await geo_cache.get_or_fetch("openaq_station", lat, lon, lambda: _fetch_air_quality(lat, lon))
+
+async def _fetch_air_quality(lat: float, lon: float):
     if not OPENAQ_API_KEY:
          print("Warning: No OPENAQ_API_KEY found. Returning None.")
          return None
@@ -43,18 +48,15 @@ async def fetch_air_quality(lat: float, lon: float):
     url = f"https://api.openaq.org/v2/latest?coordinates={lat},{lon}&radius=5000"
     headers = {"X-API-Key": OPENAQ_API_KEY}
     
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(url, headers=headers, timeout=5.0)
-            resp.raise_for_status()
-            data = resp.json()
-            if data["results"]:
-                return parse_openaq_response(data["results"][0])
-            else:
-                 return None # No station nearby
-        except Exception as e:
-            print(f"OpenAQ Fetch Error: {e}")
-            return None
+    try:
+        data = await http_client.get_json(url, headers=headers, timeout=5.0)
+        if data["results"]:
+            return parse_openaq_response(data["results"][0])
+        else:
+             return None # No station nearby
+    except Exception as e:
+        print(f"OpenAQ Fetch Error: {e}")
+        return None
 
 async def fetch_nasa_data(lat: float, lon: float):
     """
@@ -63,18 +65,23 @@ async def fetch_nasa_data(lat: float, lon: float):
     We will use the POWER API which is open but we can log the token if needed for other endpoints.
     For this demo, we'll hit the POWER API for solar irradiance.
     """
+    return await geo_cache.get_or_fetch(
+        "nasa", lat, lon, lambda: _fetch_nasa_data(lat, lon),
+        cache_if=lambda v: v.get("source") == "NASA POWER API"  # Don't pin the simulated fallback
+    )
+
+async def _fetch_nasa_data(lat: float, lon: float):
     # NASA POWER API is free and doesn't explicitly require this Bearer token for basic queries, 
     # but we will store it.
     url = f"https://power.larc.nasa.gov/api/temporal/daily/point?parameters=ALLSKY_SFC_SW_DWN&community=RE&longitude={lon}&latitude={lat}&start=20230101&end=20230102&format=JSON"
     
-    async with httpx.AsyncClient() as client:
-        try:
-           # Just a sample call to prove connectivity
-           resp = await client.get(url, timeout=5.0)
-           if resp.status_code == 200:
-               return {"solar_irradiance": "4.5 kWh/m2/day", "source": "NASA POWER API"}
-        except Exception as e:
-            print(f"NASA Fetch Error: {e}")
+    try:
+       # Just a sample call to prove connectivity
+       resp = await http_client.get(url, timeout=5.0)
+       if resp.status_code == 200:
+           return {"solar_irradiance": "4.5 kWh/m2/day", "source": "NASA POWER API"}
+    except Exception as e:
+        print(f"NASA Fetch Error: {e}")
     
     return {"solar_irradiance": "Simulated 5.2 kWh/m2/day", "source": "NASA (Simulated)"}
 
@@ -106,45 +113,57 @@ def parse_openaq_response(result):
 # --- MOCK GENERATORS REMOVED ---
 # User requested NO fake data. Only Live or None.
 
-async def get_pro_dashboard_data(lat: float, lon: float):
+def _geo_source(provider: str, fetch, lat: float, lon: float) -> aggregator.Source:
+    """Aggregator source for a geo_cache-backed fetch: stale cell on timeout, cell age as staleness."""
+    def age(_value):
+        cached = geo_cache.peek(provider, lat, lon)
+        return cached[1] if cached else None
+
+    return aggregator.Source(
+        lambda: fetch(lat, lon),
+        fallback=lambda: geo_cache.peek(provider, lat, lon),
+        age=age,
+    )
+
+async def get_pro_dashboard_data(lat: float, lon: float, budget_ms: int = None):
     """
     Aggregates all external data for the Pro Mode dashboard.
+    Weather, air quality and NASA are fetched concurrently within the latency
+    budget; "sources" reports each one's status and staleness.
     """
-    weather = await fetch_open_weather(lat, lon)
-    aq = await fetch_air_quality(lat, lon)
-    nasa = await fetch_nasa_data(lat, lon)
+    values, sources = await aggregator.gather({
+        "weather": _geo_source("openweather", fetch_open_weather, lat, lon),
+        "air_quality": _geo_source("openaq_station", fetch_air_quality, lat, lon),
+        "nasa_data": _geo_source("nasa", fetch_nasa_data, lat, lon),
+    }, budget_ms)
     
     return {
         "timestamp": datetime.utcnow().isoformat(),
         "location": {"lat": lat, "lon": lon},
-        "weather": weather,
-        "air_quality": aq,
-        "nasa_data": nasa,
+        "weather": values["weather"],
+        "air_quality": values["air_quality"],
+        "nasa_data": values["nasa_data"],
+        "sources": sources,
         "status": "active"
     }
 
 async def get_location_coordinates(city_name: str):
     """
-    Resolves a city name to latitude and longitude using Open-Meteo Geocoding API.
+    Resolves a city name to latitude and longitude.
+    Uses the offline gazetteer index, then the Open-Meteo Geocoding API (cached).
     """
-    url = f"https://geocoding-api.open-meteo.com/v1/search?name={city_name}&count=1&language=en&format=json"
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(url, timeout=5.0)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            if "results" in data and len(data["results"]) > 0:
-                result = data["results"][0]
-                return {
-                    "lat": result["latitude"],
-                    "lon": result["longitude"],
-                    "name": result["name"],
-                    "country": result.get("country", "")
-                }
-        except Exception as e:
-            print(f"Geocoding Error: {e}")
+    try:
+        place = await gazetteer.geocode(city_name)
+        if place:
+            return {
+                "lat": place["lat"],
+                "lon": place["lon"],
+                "name": place["name"],
+                "country": place.get("country", ""),
+                "timezone": place.get("timezone")
+            }
+    except Exception as e:
+        print(f"Geocoding Error: {e}")
             
     # Fallback for known major cities if API fails (or offline)
     fallback_map = {
@@ -0,0 +1,438 @@
+"""
+Offline gazetteer for city-name geocoding.
+A compact binary index of place names, coordinates, countries and timezones
+(built from a GeoNames dump by build_gazetteer.py) is memory-mapped, so
+lookups run in-process in microseconds and need no network. The OS page cache
+shares the file between workers.
+
+- Names are normalized (accents folded, lowercase, punctuation dropped) and
+  kept as one sorted key table: exact and prefix lookups are binary searches
+  over the mapped file (a flattened trie: every prefix is a contiguous range).
+- Typo-tolerant lookup runs a bounded edit distance over the keys that share
+  the query's first letter (or second, for an extra or swapped first letter)
+  and have a similar length. Only when that finds nothing, a wrong or missing
+  first letter is tried: for every first letter in the index, the keys
+  continuing with the query's 2nd-3rd letters ("xaris" -> "paris") or its
+  1st-2nd letters ("aris" -> "paris") are checked.
+- geocode() tries an exact index match, then the Open-Meteo geocoding API
+  (real places missing from the index beat a near-miss spelling), and only
+  then the typo-tolerant scan. Remote answers and fuzzy results, including
+  "not found", are cached (GAZETTEER_REMOTE_TTL), so a repeated miss costs
+  neither a request nor a scan.
+
+File layout (little-endian):
+    header   "GAZ1", n_places, n_keys, n_timezones, then 4 section offsets
+    places   n_places x (lat f4, lon f4, population u4, name_off u4, name_len u2, country 2s, tz u2)
+    keys     n_keys x (key_off u4, key_len u2, place u4), sorted by key bytes
+    timezones  n_timezones x (off u4, len u2)
+    strings  UTF-8 blob referenced by the offsets above
+"""
+import asyncio
+import mmap
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import http_client
+from .api_cache import APICache
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(BASE_DIR, "data", "gazetteer.bin"))
+GAZETTEER_REMOTE_TTL = int(os.getenv("GAZETTEER_REMOTE_TTL", str(7 * 24 * 3600)))
+
+MAGIC = b"GAZ1"
+HEADER = np.dtype([("magic", "S4"), ("n_places", "<u4"), ("n_keys", "<u4"), ("n_timezones", "<u4"),
+                   ("places", "<u8"), ("keys", "<u8"), ("timezones", "<u8"), ("strings", "<u8")])
+PLACE = np.dtype([("lat", "<f4"), ("lon", "<f4"), ("population", "<u4"), ("name_off", "<u4"),
+                  ("name_len", "<u2"), ("country", "S2"), ("tz", "<u2")])
+KEY = np.dtype([("off", "<u4"), ("len", "<u2"), ("place", "<u4")])
+TIMEZONE = np.dtype([("off", "<u4"), ("len", "<u2")])
+
+remote_cache = APICache(ttl_seconds=GAZETTEER_REMOTE_TTL, max_entries=4096, name="geocode_remote")
+fuzzy_cache = APICache(ttl_seconds=GAZETTEER_REMOTE_TTL, max_entries=4096, name="geocode_fuzzy")
+_stats = {"local_hits": 0, "fuzzy_hits": 0, "remote_lookups": 0, "misses": 0}
+
+
+def normalize(name: str) -> str:
+    """Accent-folded, lowercase, alphanumeric words separated by single spaces."""
+    folded = unicodedata.normalize("NFKD", name)
+    folded = "".join(c for c in folded if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", folded).split())
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance with adjacent transpositions, or limit + 1 once it exceeds `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    prev_best = 0
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        best = i
+        for j, cb in enumerate(b, 1):
+            cost = 0 if ca == cb else 1
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, prev2[j - 2] + 1)
+            cur[j] = d
+            best = min(best, d)
+        if best > limit and prev_best > limit:
+            return limit + 1  # A transposition can only reach back two rows
+        prev2, prev, prev_best = prev, cur, best
+    return prev[-1]
+
+
+def _pattern_masks(pattern: str) -> dict:
+    masks = {}
+    for i, c in enumerate(pattern):
+        masks[c] = masks.get(c, 0) | (1 << i)
+    return masks
+
+
+def _levenshtein_bits(masks: dict, m: int, text: str) -> int:
+    """Levenshtein distance between the pattern behind `masks` (length m) and `text` (Myers' bit-vector)."""
+    full = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for c in text:
+        eq = masks.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+
+class Gazetteer:
+    """Read-only view over a memory-mapped index file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._mm, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer index")
+        self.places = np.frombuffer(self._mm, dtype=PLACE, count=int(header["n_places"]), offset=int(header["places"]))
+        self.keys = np.frombuffer(self._mm, dtype=KEY, count=int(header["n_keys"]), offset=int(header["keys"]))
+        tzs = np.frombuffer(self._mm, dtype=TIMEZONE, count=int(header["n_timezones"]), offset=int(header["timezones"]))
+        self._strings = int(header["strings"])
+        self.timezones = [self._text(int(t["off"]), int(t["len"])) for t in tzs]
+        # Plain lists for the hot binary-search path (numpy scalar access is slower)
+        self._key_off = self.keys["off"].tolist()
+        self._key_len = self.keys["len"].tolist()
+        self._key_place = self.keys["place"].tolist()
+        self._firsts: Optional[List[bytes]] = None
+
+    def __len__(self):
+        return len(self.places)
+
+    def _text(self, off: int, length: int) -> str:
+        start = self._strings + off
+        return self._mm[start:start + length].decode("utf-8")
+
+    def key(self, i: int) -> bytes:
+        start = self._strings + self._key_off[i]
+        return self._mm[start:start + self._key_len[i]]
+
+    def _bisect(self, target: bytes) -> int:
+        lo, hi = 0, len(self._key_off)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _prefix_range(self, prefix: bytes):
+        """[start, end) of the keys starting with `prefix`."""
+        start = self._bisect(prefix)
+        return start, self._bisect(prefix + b"\xff")
+
+    def place(self, idx: int) -> dict:
+        lat, lon, population, name_off, name_len, country, tz = self.places[idx].item()
+        return {
+            "name": self._text(name_off, name_len),
+            "lat": round(lat, 5),
+            "lon": round(lon, 5),
+            "country": country.decode(),
+            "timezone": (self.timezones[tz] if self.timezones else None) or None,
+            "population": population,
+        }
+
+    def _best(self, place_ids) -> int:
+        return max(place_ids, key=lambda i: self.places[i]["population"])
+
+    # --- Lookups ---
+    def lookup(self, name: str) -> Optional[dict]:
+        """Exact (normalized) name match; the most populous place wins."""
+        target = normalize(name).encode()
+        if not target:
+            return None
+        start = self._bisect(target)
+        ids = []
+        while start < len(self._key_off) and self.key(start) == target:
+            ids.append(self._key_place[start])
+            start += 1
+        return self.place(self._best(ids)) if ids else None
+
+    def search(self, prefix: str, limit: int = 10) -> List[dict]:
+        """Places with a name starting with `prefix`, most populous first."""
+        target = normalize(prefix).encode()
+        if not target:
+            return []
+        start, end = self._prefix_range(target)
+        ids = set(self._key_place[start:end])
+        ranked = sorted(ids, key=lambda i: -int(self.places[i]["population"]))
+        return [self.place(i) for i in ranked[:limit]]
+
+    def _first_bytes(self) -> List[bytes]:
+        """Distinct first bytes of the keys (one binary search per letter, computed once)."""
+        if self._firsts is None:
+            firsts, i, n = [], 0, len(self._key_off)
+            while i < n:
+                first = self.key(i)[:1]
+                if not first:
+                    i += 1
+                    continue
+                firsts.append(first)
+                i = self._bisect(first + b"\xff")
+            self._firsts = firsts
+        return self._firsts
+
+    def fuzzy(self, name: str, max_distance: Optional[int] = None) -> Optional[dict]:
+        """
+        Closest name within `max_distance` edits (default: 1 up to 5 letters, else 2);
+        ties go to the most populous place.
+        Keys starting with the query's first or second letter are checked first;
+        if none is close enough, keys with any first letter followed by the
+        query's 2nd-3rd letters (mistyped first letter) or 1st-2nd letters
+        (missing first letter).
+        """
+        target = normalize(name)
+        if len(target) < 3:
+            return None
+        if max_distance is None:
+            max_distance = 1 if len(target) <= 5 else 2
+        masks, m = _pattern_masks(target), len(target)
+        best_ids, best_d = [], max_distance + 1
+
+        def scan(start: int, end: int):
+            nonlocal best_ids, best_d
+            for i in range(start, end):
+                if abs(self._key_len[i] - m) > max_distance:
+                    continue
+                key = self.key(i).decode()
+                d = _levenshtein_bits(masks, m, key)
+                if d > max_distance * 2:
+                    continue
+                if d > 1:
+                    # Transpositions count twice in Levenshtein distance but once here
+                    d = _edit_distance(target, key, best_d)
+                if d < best_d:
+                    best_ids, best_d = [self._key_place[i]], d
+                elif d == best_d and d <= max_distance:
+                    best_ids.append(self._key_place[i])
+
+        for first in dict.fromkeys(target[:2]):
+            scan(*self._prefix_range(first.encode()))
+        if not best_ids:
+            skip = {c.encode() for c in target[:2]}  # Already scanned in full
+            for first in self._first_bytes():
+                if first not in skip:
+                    for rest in dict.fromkeys((target[1:3].encode(), target[:2].encode())):
+                        scan(*self._prefix_range(first + rest))
+        return self.place(self._best(best_ids)) if best_ids else None
+
+    def close(self):
+        self._mm.close()
+
+
+_index: Optional[Gazetteer] = None
+_index_checked = False
+_index_lock = threading.Lock()
+
+
+def get_index() -> Optional[Gazetteer]:
+    """The shared index (mapped on first use), or None when no index file exists."""
+    global _index, _index_checked
+    if not _index_checked:
+        with _index_lock:
+            if not _index_checked:
+                if os.path.exists(GAZETTEER_PATH):
+                    try:
+                        _index = Gazetteer(GAZETTEER_PATH)
+                        print(f"[Gazetteer] Mapped {len(_index)} places from {GAZETTEER_PATH}")
+                    except Exception as e:
+                        print(f"[Gazetteer] Could not load index: {e}")
+                _index_checked = True
+    return _index
+
+
+def lookup_local(name: str, fuzzy: bool = True) -> Optional[dict]:
+    """Exact, then typo-tolerant, match in the local index (None without an index)."""
+    index = get_index()
+    if index is None:
+        return None
+    place = index.lookup(name)
+    if place:
+        _stats["local_hits"] += 1
+        return {**place, "source": "gazetteer"}
+    if fuzzy:
+        place = index.fuzzy(name)
+        if place:
+            _stats["fuzzy_hits"] += 1
+            return {**place, "source": "gazetteer"}
+    return None
+
+
+async def _lookup_remote(name: str) -> Optional[dict]:
+    _stats["remote_lookups"] += 1
+    try:
+        data = await http_client.get_json(
+            "https://geocoding-api.open-meteo.com/v1/search",
+            params={"name": name, "count": 1, "language": "en", "format": "json"},
+            timeout=5.0,
+        )
+    except Exception as e:
+        print(f"Geocoding Error: {e}")
+        return None
+    if not data.get("results"):
+        return {}  # Cached too: unknown names don't hit the API again
+    result = data["results"][0]
+    return {
+        "name": result["name"],
+        "lat": result["latitude"],
+        "lon": result["longitude"],
+        "country": result.get("country_code") or result.get("country", ""),
+        "timezone": result.get("timezone"),
+        "population": result.get("population"),
+        "source": "open-meteo",
+    }
+
+
+def _lookup_fuzzy(name: str) -> dict:
+    """Typo-tolerant local match, {} when nothing is close (cached like remote misses)."""
+    index = get_index()
+    place = index.fuzzy(name) if index is not None else None
+    return {**place, "source": "gazetteer"} if place else {}
+
+
+async def geocode(name: str) -> Optional[dict]:
+    """
+    Resolve a place name: exact local match, else the Open-Meteo geocoding API,
+    else a fuzzy local match (remote and fuzzy results are cached).
+
+    Returns:
+        {"name", "lat", "lon", "country", "timezone", "population", "source"} or None
+    """
+    place = lookup_local(name, fuzzy=False)
+    if place:
+        return place
+    key = normalize(name)
+    if not key:
+        return None
+    place = await remote_cache.get_or_load(key, lambda: _lookup_remote(name))
+    if place:
+        return place
+    # Unknown upstream (or unreachable): likely a typo of an indexed name.
+    # The scan runs off the event loop and its result, match or not, is cached.
+    place = await fuzzy_cache.get_or_load(key, lambda: asyncio.to_thread(_lookup_fuzzy, name))
+    if place:
+        _stats["fuzzy_hits"] += 1
+        return place
+    _stats["misses"] += 1
+    return None
+
+
+def utc_offset_seconds(timezone_name: Optional[str], at: Optional[datetime] = None) -> Optional[int]:
+    """Current UTC offset of an IANA timezone (None if unknown)."""
+    if not timezone_name:
+        return None
+    try:
+        from zoneinfo import ZoneInfo
+        offset = (at or datetime.utcnow()).replace(tzinfo=ZoneInfo("UTC")).astimezone(ZoneInfo(timezone_name)).utcoffset()
+        return int(offset.total_seconds())
+    except Exception:
+        return None
+
+
+def stats() -> dict:
+    index = get_index()
+    return {**_stats, "places": len(index) if index else 0, "keys": len(index.keys) if index else 0,
+            "path": GAZETTEER_PATH, "remote_cache": remote_cache.stats(), "fuzzy_cache": fuzzy_cache.stats()}
+
+
+# --- Building ---
+def write_index(path: str, places: List[dict], keys: Dict[str, List[int]]):
+    """
+    Write an index file.
+
+    Args:
+        places: [{"name", "lat", "lon", "country", "timezone", "population"}]
+        keys: normalized name -> indices into `places`
+    """
+    strings = bytearray()
+    timezones: Dict[str, int] = {}
+
+    def add(text: str):
+        data = text.encode("utf-8")
+        off = len(strings)
+        strings.extend(data)
+        return off, len(data)
+
+    place_rows = np.zeros(len(places), dtype=PLACE)
+    for i, p in enumerate(places):
+        off, length = add(p["name"])
+        tz = timezones.setdefault(p.get("timezone") or "", len(timezones))
+        place_rows[i] = (p["lat"], p["lon"], min(int(p.get("population") or 0), 2 ** 32 - 1), off, length,
+                         (p.get("country") or "")[:2].encode(), tz)
+
+    items = sorted((k.encode(), i) for k, ids in keys.items() for i in ids)
+    key_rows = np.zeros(len(items), dtype=KEY)
+    key_offsets: Dict[bytes, tuple] = {}
+    for n, (k, i) in enumerate(items):
+        if k not in key_offsets:
+            off = len(strings)
+            strings.extend(k)
+            key_offsets[k] = (off, len(k))
+        key_rows[n] = (*key_offsets[k], i)
+
+    tz_rows = np.zeros(len(timezones), dtype=TIMEZONE)
+    for tz, i in timezones.items():
+        tz_rows[i] = add(tz)
+
+    header = np.zeros(1, dtype=HEADER)
+    offset = HEADER.itemsize
+    sections = {}
+    for name, rows in (("places", place_rows), ("keys", key_rows), ("timezones", tz_rows)):
+        offset += -offset % 8  # Align sections
+        sections[name] = offset
+        offset += rows.nbytes
+    header[0] = (MAGIC, len(places), len(items), len(timezones),
+                 sections["places"], sections["keys"], sections["timezones"], offset)
+
+    tmp = path + ".tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(header.tobytes())
+        for name, rows in (("places", place_rows), ("keys", key_rows), ("timezones", tz_rows)):
+            f.write(b"\0" * (sections[name] - f.tell()))
+            f.write(rows.tobytes())
+        f.write(bytes(strings))
+    os.replace(tmp, path)
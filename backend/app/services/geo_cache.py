@@ -0,0 +1,115 @@
+"""
+Geospatial cache for external weather / air-quality lookups.
+Coordinates are snapped to a grid cell (GEO_CELL_DEG, ~2 km by default) so
+nearby users and devices share one cached upstream response per provider.
+Concurrent lookups for the same cell are coalesced into a single fetch
+(single-flight): only the first caller hits the API, the rest await its result.
+Cells past their TTL are served stale while one background refresh runs.
+"""
+import math
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .api_cache import APICache
+
+GEO_CELL_DEG = float(os.getenv("GEO_CELL_DEG", "0.02"))
+
+# Seconds a cell stays fresh, per provider (upstream update cadence).
+# Each provider name is also a cache namespace, so different response shapes
+# from the same upstream (connector vs. external_apis) use different names.
+PROVIDER_TTLS = {
+    "open_meteo": int(os.getenv("GEO_TTL_OPEN_METEO", "600")),
+    "openweather": int(os.getenv("GEO_TTL_OPENWEATHER", "600")),
+    "openaq": int(os.getenv("GEO_TTL_OPENAQ", "900")),
+    "openaq_station": int(os.getenv("GEO_TTL_OPENAQ", "900")),
+    "waqi": int(os.getenv("GEO_TTL_WAQI", "900")),
+    "nasa": int(os.getenv("GEO_TTL_NASA", "21600")),
+}
+DEFAULT_TTL = 300
+GEO_CACHE_MAX_CELLS = int(os.getenv("GEO_CACHE_MAX_CELLS", "5000"))
+
+_caches: Dict[str, APICache] = {}
+
+
+def cell_index(lat: float, lon: float, cell_deg: float = GEO_CELL_DEG):
+    """Integer (row, col) of the grid cell containing lat/lon."""
+    return math.floor(lat / cell_deg), math.floor(lon / cell_deg)
+
+
+def cell_key(provider: str, lat: float, lon: float) -> str:
+    row, col = cell_index(lat, lon)
+    return f"{provider}:{row}:{col}"
+
+
+def get_cache(provider: str) -> APICache:
+    cache = _caches.get(provider)
+    if cache is None:
+        ttl = PROVIDER_TTLS.get(provider, DEFAULT_TTL)
+        # Stale cells are served for one more TTL while being refreshed
+        cache = _caches[provider] = APICache(
+            ttl_seconds=ttl, stale_seconds=ttl, max_entries=GEO_CACHE_MAX_CELLS, name=f"geo:{provider}"
+        )
+    return cache
+
+
+async def get_or_fetch(
+    provider: str,
+    lat: float,
+    lon: float,
+    fetch: Callable[[], Awaitable[Any]],
+    cache_if: Optional[Callable[[Any], bool]] = None,
+):
+    """
+    Cached, coalesced upstream lookup for the grid cell containing lat/lon.
+
+    Args:
+        provider: Provider name (selects the TTL and cache namespace)
+        fetch: Zero-argument coroutine function doing the actual upstream call
+        cache_if: Predicate deciding whether a result is cached (default: not None)
+
+    Returns:
+        The cached or freshly fetched value
+    """
+    if lat is None or lon is None:
+        return await fetch()
+
+    return await get_cache(provider).get_or_load(cell_key(provider, lat, lon), fetch, cache_if)
+
+
+def peek(provider: str, lat: float, lon: float) -> Optional[Tuple[Any, float]]:
+    """(value, age in seconds) cached for the cell, fresh or stale; None if nothing is cached."""
+    cache = _caches.get(provider)
+    if cache is None or lat is None or lon is None:
+        return None
+    return cache.peek(cell_key(provider, lat, lon))
+
+
+def _is_online(result) -> bool:
+    return bool(result) and result.get("status") == "online"
+
+
+async def fetch_connector(connector):
+    """
+    connector.fetch_data_async() through the cell cache.
+    Connectors without a location-based provider (ThingSpeak channels, ESP32)
+    are fetched directly. Offline results are never cached.
+    """
+    provider = getattr(connector, "provider", None)
+    if not provider:
+        return await connector.fetch_data_async()
+    return await get_or_fetch(
+        provider,
+        connector.config.get("lat"),
+        connector.config.get("lon"),
+        connector.fetch_data_async,
+        cache_if=_is_online,
+    )
+
+
+def stats() -> dict:
+    return {"cell_deg": GEO_CELL_DEG, "providers": {p: c.stats() for p, c in _caches.items()}}
+
+
+def clear():
+    for cache in _caches.values():
+        cache.clear()
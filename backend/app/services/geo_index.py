@@ -0,0 +1,210 @@
+"""
+In-memory spatial index of user locations for Sentinel geofenced alerts.
+Users are bucketed into a lat/lon grid (GEO_INDEX_CELL_DEG); a radius query
+only visits the buckets overlapping the query's bounding box and then runs a
+vectorized Haversine over those candidates.
+
+Coordinates live in flat numpy arrays indexed by slot, so memory stays at a
+few dozen bytes per user (1M users ~ tens of MB).
+
+The index is rebuilt from the users table every GEO_INDEX_REFRESH_SECONDS
+(sync_loop), so users added, moved or deactivated by other paths or other
+workers are picked up; in-process location updates apply immediately.
+"""
+import asyncio
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+GEO_INDEX_CELL_DEG = float(os.getenv("GEO_INDEX_CELL_DEG", "0.25"))  # ~28 km
+GEO_INDEX_REFRESH_SECONDS = int(os.getenv("GEO_INDEX_REFRESH_SECONDS", "300"))
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Great-circle distance (km) from one point to arrays of points."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class UserLocationIndex:
+    """
+    Grid-bucketed point index keyed by user email.
+    Thread-safe: alert checks query it from worker threads while location
+    updates arrive from request handlers.
+    """
+
+    def __init__(self, cell_deg: float = GEO_INDEX_CELL_DEG, capacity: int = 1024):
+        self.cell_deg = cell_deg
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self._emails: List[Optional[str]] = [None] * capacity
+        self._slot_of: Dict[str, int] = {}
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+        self._buckets: Dict[Tuple[int, int], Set[int]] = {}
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _grow(self):
+        old = len(self._emails)
+        new = old * 2
+        self._lat = np.resize(self._lat, new)
+        self._lon = np.resize(self._lon, new)
+        self._emails.extend([None] * (new - old))
+        self._free.extend(range(new - 1, old - 1, -1))
+
+    def _unlink(self, slot: int):
+        cell = self._cell(self._lat[slot], self._lon[slot])
+        bucket = self._buckets.get(cell)
+        if bucket is not None:
+            bucket.discard(slot)
+            if not bucket:
+                del self._buckets[cell]
+
+    def upsert(self, email: str, lat: Optional[float], lon: Optional[float]):
+        """Add or move a user. A missing coordinate removes the user."""
+        if lat is None or lon is None:
+            self.remove(email)
+            return
+        with self._lock:
+            slot = self._slot_of.get(email)
+            if slot is None:
+                if not self._free:
+                    self._grow()
+                slot = self._free.pop()
+                self._slot_of[email] = slot
+                self._emails[slot] = email
+            else:
+                self._unlink(slot)
+            self._lat[slot] = lat
+            self._lon[slot] = lon
+            self._buckets.setdefault(self._cell(lat, lon), set()).add(slot)
+
+    def remove(self, email: str):
+        with self._lock:
+            slot = self._slot_of.pop(email, None)
+            if slot is None:
+                return
+            self._unlink(slot)
+            self._emails[slot] = None
+            self._free.append(slot)
+
+    def clear(self):
+        with self._lock:
+            self._slot_of.clear()
+            self._buckets.clear()
+            self._emails = [None] * len(self._emails)
+            self._free = list(range(len(self._emails) - 1, -1, -1))
+            self.loaded = False
+
+    def _candidate_slots(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Slots in the grid cells overlapping the query's bounding box."""
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        cos_lat = math.cos(math.radians(lat))
+        # Near the poles (or for huge radii) the box spans every longitude
+        dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+
+        row_min, col_min = self._cell(max(lat - dlat, -90.0), lon - dlon)
+        row_max, col_max = self._cell(min(lat + dlat, 90.0), lon + dlon)
+        col_origin = math.floor(-180.0 / self.cell_deg)
+        n_cols = math.ceil(360.0 / self.cell_deg)
+        if col_max - col_min + 1 >= n_cols:
+            col_min, col_max = col_origin, col_origin + n_cols - 1
+
+        slots: List[int] = []
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self._buckets):
+            # Box covers more cells than are populated: scan the populated rows
+            # instead (exact distances are checked by the caller anyway)
+            for (row, _), bucket in self._buckets.items():
+                if row_min <= row <= row_max:
+                    slots.extend(bucket)
+        else:
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    # Wrap columns past the antimeridian
+                    bucket = self._buckets.get((row, (col - col_origin) % n_cols + col_origin))
+                    if bucket:
+                        slots.extend(bucket)
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> List[Tuple[str, float]]:
+        """
+        Users within `radius_km` of (lat, lon).
+
+        Returns:
+            List of (email, distance_km), nearest first
+        """
+        with self._lock:
+            slots = self._candidate_slots(lat, lon, radius_km)
+            if slots.size == 0:
+                return []
+            dist = haversine_km(lat, lon, self._lat[slots], self._lon[slots])
+            hit = dist <= radius_km
+            slots, dist = slots[hit], dist[hit]
+            order = np.argsort(dist, kind="stable")
+            return [(self._emails[s], float(d)) for s, d in zip(slots[order], dist[order])]
+
+    def load(self, db=None, chunk: int = 50000, quiet: bool = False):
+        """
+        (Re)build the index from active users with a saved location.
+        The new index is built aside and swapped in, so queries keep being
+        answered from the previous one while the users table is read.
+        """
+        from .. import database, models
+
+        own_session = db is None
+        db = db or database.SessionLocal()
+        try:
+            query = db.query(models.User.email, models.User.location_lat, models.User.location_lon).filter(
+                models.User.is_active == True,
+                models.User.location_lat != None,
+                models.User.location_lon != None
+            ).execution_options(yield_per=chunk)
+            fresh = UserLocationIndex(self.cell_deg, capacity=max(len(self._emails), 1024))
+            for email, lat, lon in query:
+                fresh.upsert(email, lat, lon)
+            with self._lock:
+                self._lat, self._lon = fresh._lat, fresh._lon
+                self._emails, self._slot_of = fresh._emails, fresh._slot_of
+                self._free, self._buckets = fresh._free, fresh._buckets
+                self.loaded = True
+            if not quiet:
+                print(f"[GeoIndex] Indexed {len(self)} user locations")
+        finally:
+            if own_session:
+                db.close()
+
+    def ensure_loaded(self, db=None):
+        if not self.loaded:
+            self.load(db)
+
+
+# Global index instance
+user_index = UserLocationIndex()
+
+
+def users_near(lat: float, lon: float, radius_km: float, db=None) -> List[Tuple[str, float]]:
+    """Users within radius_km of a point (loads the index on first use)."""
+    user_index.ensure_loaded(db)
+    return user_index.query_radius(lat, lon, radius_km)
+
+
+async def sync_loop(interval_seconds: float = GEO_INDEX_REFRESH_SECONDS):
+    """Background task rebuilding the index from the users table."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(user_index.load, quiet=True)
+        except Exception as e:
+            print(f"[GeoIndex] Sync error: {e}")
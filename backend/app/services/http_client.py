@@ -0,0 +1,198 @@
+"""
+Shared outbound HTTP client.
+One pooled httpx.AsyncClient (keep-alive, HTTP/2 when `h2` is installed) for
+all async callers and one pooled requests.Session for the remaining blocking
+callers (connectors run in threads, Gemini tool functions, Google auth).
+Every outbound API call should go through this module.
+"""
+import asyncio
+import os
+import random
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# --- Configuration ---
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "8"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "40"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "16"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.25"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "4"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop = None
+_host_limits: Dict[str, asyncio.Semaphore] = {}
+_sync_session: Optional[requests.Session] = None
+_app_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared AsyncClient for the running event loop (created lazily)."""
+    global _client, _client_loop, _host_limits
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        # A pool is bound to the loop it was created on (tests may spin up new loops)
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            follow_redirects=True,
+            headers={"User-Agent": "EcoSync-Backend/2.0"},
+        )
+        _client_loop = loop
+        _host_limits = {}
+    return _client
+
+
+def _host_limit(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    sem = _host_limits.get(host)
+    if sem is None:
+        sem = _host_limits[host] = asyncio.Semaphore(HTTP_PER_HOST_LIMIT)
+    return sem
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with full jitter (honours a numeric Retry-After)."""
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+async def request(method: str, url: str, *, retries: Optional[int] = None, per_host_limit: bool = True, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared pool.
+    Idempotent requests are retried on transport errors and 429/5xx with jittered backoff.
+    The final response is returned as-is (callers decide on raise_for_status).
+    per_host_limit=False skips the HTTP_PER_HOST_LIMIT semaphore for callers
+    that bound their own fan-out (e.g. push delivery to a single push service).
+    """
+    method = method.upper()
+    retries = HTTP_RETRIES if retries is None else retries
+    if method not in IDEMPOTENT_METHODS:
+        retries = 0
+
+    client = get_client()
+    attempt = 0
+    while True:
+        try:
+            if per_host_limit:
+                async with _host_limit(url):
+                    response = await client.request(method, url, **kwargs)
+            else:
+                response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt >= retries:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            attempt += 1
+            continue
+
+        if response.status_code in RETRY_STATUSES and attempt < retries:
+            delay = _backoff(attempt, response.headers.get("Retry-After"))
+            await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        return response
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+async def get_json(url: str, **kwargs):
+    """GET and decode JSON, raising httpx.HTTPStatusError on non-2xx."""
+    response = await get(url, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_sync_session() -> requests.Session:
+    """Pooled requests.Session (keep-alive + urllib3 retries) for blocking callers."""
+    global _sync_session
+    if _sync_session is None:
+        retry = Retry(
+            total=HTTP_RETRIES,
+            backoff_factor=HTTP_BACKOFF_BASE,
+            backoff_jitter=HTTP_BACKOFF_BASE,
+            backoff_max=HTTP_BACKOFF_MAX,
+            status_forcelist=sorted(RETRY_STATUSES),
+            allowed_methods=sorted(IDEMPOTENT_METHODS),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=HTTP_PER_HOST_LIMIT, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["User-Agent"] = "EcoSync-Backend/2.0"
+        _sync_session = session
+    return _sync_session
+
+
+def sync_get(url: str, timeout: float = HTTP_TIMEOUT, **kwargs) -> requests.Response:
+    """Blocking GET through the pooled session (always with a timeout)."""
+    return get_sync_session().get(url, timeout=timeout, **kwargs)
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop):
+    """Remember the application event loop (called on startup) for run_sync()."""
+    global _app_loop
+    _app_loop = loop
+
+
+def run_sync(coro, timeout: Optional[float] = None):
+    """
+    Run a coroutine from a worker thread (e.g. alert checks) on the application
+    loop so it shares the pooled client. Falls back to a private loop when no
+    application loop is running (scripts).
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is not None:
+        coro.close()
+        raise RuntimeError("run_sync() called from the event loop; await the coroutine instead")
+    if _app_loop is not None and _app_loop.is_running():
+        return asyncio.run_coroutine_threadsafe(coro, _app_loop).result(timeout)
+    return asyncio.run(coro)
+
+
+async def close():
+    """Shutdown hook: close pooled connections."""
+    global _client, _sync_session
+    if _client is not None and not _client.is_closed:
+        try:
+            await _client.aclose()
+        except RuntimeError:
+            pass  # Loop already gone
+    _client = None
+    if _sync_session is not None:
+        _sync_session.close()
+        _sync_session = None
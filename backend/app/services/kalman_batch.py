@@ -0,0 +1,199 @@
+"""
+Vectorized batch versions of the streaming filters in kalman_filter.py.
+Used for bulk smoothing / backfilling of stored series (one device or a
+devices x time matrix) instead of calling KalmanFilter1D.update per value.
+
+NaN marks a missing reading: the filter state is held and the output is NaN.
+"""
+
+import numpy as np
+from scipy.signal import lfilter
+from typing import Dict, Optional
+
+from .kalman_filter import FILTER_PARAMS, OutlierDetector
+
+
+def _gain_schedule(n: int, q: float, r: float, p0: float, tol: float = 1e-15):
+    """
+    Kalman gains / posterior variances for n update steps.
+    For a constant model the covariance recursion does not depend on the data,
+    so it is computed once until it converges to its steady state.
+
+    Returns:
+        (gains, variances, converged_at) - arrays of length `converged_at`,
+        after which the gain/variance are constant (last element).
+    """
+    gains = []
+    variances = []
+    p = p0
+    for _ in range(max(n, 1)):
+        p_pred = p + q
+        k = p_pred / (p_pred + r)
+        p_new = (1 - k) * p_pred
+        gains.append(k)
+        variances.append(p_new)
+        if abs(p_new - p) <= tol * max(p, 1.0):
+            break
+        p = p_new
+    return np.array(gains), np.array(variances), len(gains)
+
+
+def _kalman_rows(z: np.ndarray, q: float, r: float, x0: np.ndarray, p0: float):
+    """
+    Run the filter over complete rows (no NaN) of z (rows x steps), every row
+    starting from state x0 with covariance p0. Returns (filtered, variances).
+    """
+    rows, n = z.shape
+    gains, variances, m = _gain_schedule(n, q, r, p0)
+    out = np.empty_like(z)
+
+    # Warm-up: time-varying gain, vectorized across rows
+    x = x0.astype(float).copy()
+    warm = min(m, n)
+    for t in range(warm):
+        x = x + gains[t] * (z[:, t] - x)
+        out[:, t] = x
+
+    # Steady state: constant gain -> first order IIR (exponential smoother)
+    if n > warm:
+        k = gains[-1]
+        out[:, warm:], _ = lfilter([k], [1.0, -(1.0 - k)], z[:, warm:], axis=1,
+                                   zi=((1.0 - k) * x)[:, None])
+
+    var = np.empty(n)
+    var[:warm] = variances[:warm]
+    var[warm:] = variances[-1]
+    return out, var
+
+
+def kalman_filter_batch(
+    values,
+    process_variance: float = 0.01,
+    measurement_variance: float = 0.1,
+    x0: Optional[float] = None,
+    p0: float = 1.0,
+) -> Dict[str, np.ndarray]:
+    """
+    Batch equivalent of feeding KalmanFilter1D.update() every value in order.
+
+    Args:
+        values: 1D series or 2D matrix (devices x time). NaN = missing.
+        x0: Existing state estimate to continue from (None = fresh filter,
+            which initializes on the first reading with confidence 0.5)
+        p0: Existing estimate covariance
+
+    Returns:
+        Dict with 'filtered' and 'confidence' arrays shaped like `values`
+    """
+    z = np.asarray(values, dtype=float)
+    one_d = z.ndim == 1
+    if one_d:
+        z = z[None, :]
+
+    filtered = np.full(z.shape, np.nan)
+    confidence = np.full(z.shape, np.nan)
+    if z.size == 0:
+        return {"filtered": filtered[0] if one_d else filtered,
+                "confidence": confidence[0] if one_d else confidence}
+
+    missing = np.isnan(z)
+
+    if not missing.any():
+        # Fast path: all rows share the same gain schedule
+        if x0 is None:
+            filtered[:, 0] = z[:, 0]
+            confidence[:, 0] = 0.5  # Low confidence on first reading
+            if z.shape[1] > 1:
+                out, var = _kalman_rows(z[:, 1:], process_variance, measurement_variance, z[:, 0], p0)
+                filtered[:, 1:] = out
+                confidence[:, 1:] = 1.0 / (1.0 + var)
+        else:
+            out, var = _kalman_rows(z, process_variance, measurement_variance, np.full(z.shape[0], x0), p0)
+            filtered[:] = out
+            confidence[:] = 1.0 / (1.0 + var)
+    else:
+        # Rows with gaps: filter the observed values of each row, scatter back
+        for i in range(z.shape[0]):
+            idx = np.flatnonzero(~missing[i])
+            if idx.size == 0:
+                continue
+            row = kalman_filter_batch(z[i, idx], process_variance, measurement_variance, x0, p0)
+            filtered[i, idx] = row["filtered"]
+            confidence[i, idx] = row["confidence"]
+
+    confidence = np.clip(confidence, 0.0, 1.0)
+    if one_d:
+        return {"filtered": filtered[0], "confidence": confidence[0]}
+    return {"filtered": filtered, "confidence": confidence}
+
+
+def clean_and_smooth_batch(
+    values,
+    alpha: float = 0.3,
+    window_size: int = 30,
+    z_threshold: float = 3.0,
+) -> Dict[str, np.ndarray]:
+    """
+    Batch version of DataCleaner.clean_and_smooth (unrounded): outliers are
+    flagged against the window of previously accepted values, replaced by the
+    running EMA, and the EMA is smoothed over the accepted values.
+
+    Flagged values never enter the window, so each flag depends on the
+    previous ones; flags come from a sequential OutlierDetector pass per row
+    and only the EMA is vectorized.
+
+    Returns:
+        Dict with 'raw', 'cleaned', 'smoothed', 'is_outlier', 'z_score' arrays
+    """
+    z = np.asarray(values, dtype=float)
+    one_d = z.ndim == 1
+    if one_d:
+        z = z[None, :]
+
+    z_scores = np.full(z.shape, np.nan)
+    is_outlier = np.zeros(z.shape, dtype=bool)
+    for i in range(z.shape[0]):
+        detector = OutlierDetector(window_size=window_size, z_threshold=z_threshold)
+        for j in np.flatnonzero(~np.isnan(z[i])):
+            is_outlier[i, j], z_scores[i, j] = detector.is_outlier(float(z[i, j]))
+    keep = ~np.isnan(z) & ~is_outlier
+
+    smoothed = np.full(z.shape, np.nan)
+    for i in range(z.shape[0]):
+        idx = np.flatnonzero(keep[i])
+        if idx.size == 0:
+            continue
+        good = z[i, idx]
+        ema = np.empty(idx.size)
+        ema[0] = good[0]
+        if idx.size > 1:
+            # Outliers hold the EMA, so it is a plain EMA over the accepted values
+            ema[1:], _ = lfilter([alpha], [1.0, -(1.0 - alpha)], good[1:], zi=[(1.0 - alpha) * good[0]])
+        row = np.full(z.shape[1], np.nan)
+        row[idx] = ema
+        # Forward-fill held EMA into outlier / missing positions
+        fill = np.where(~np.isnan(row), np.arange(row.size), 0)
+        np.maximum.accumulate(fill, out=fill)
+        row = row[fill]
+        row[: idx[0]] = np.nan
+        smoothed[i] = row
+
+    prev_ema = np.concatenate([np.full((z.shape[0], 1), np.nan), smoothed[:, :-1]], axis=1)
+    cleaned = np.where(is_outlier, prev_ema, z)
+
+    result = {
+        "raw": z,
+        "cleaned": cleaned,
+        "smoothed": smoothed,
+        "is_outlier": is_outlier,
+        "z_score": z_scores,
+    }
+    if one_d:
+        return {k: v[0] for k, v in result.items()}
+    return result
+
+
+def smooth_metric(values, metric: str) -> Dict[str, np.ndarray]:
+    """Kalman-smooth a stored series with the streaming filter parameters for `metric`."""
+    q, r = FILTER_PARAMS[metric]
+    return kalman_filter_batch(values, process_variance=q, measurement_variance=r)
@@ -3,9 +3,23 @@ Kalman Filter implementation for IoT sensor data fusion and noise reduction.
 Supports 1D filtering for individual sensors and multi-sensor fusion.
 """
 
+import asyncio
+import json
+import os
+from datetime import datetime
 import numpy as np
 from typing import Optional, Tuple, Dict
-from collections import deque
+from collections import deque, OrderedDict
+
+
+# (process_variance, measurement_variance) per metric, shared by the streaming
+# filters and the batch engine in kalman_batch.py
+FILTER_PARAMS = {
+    "temperature": (0.01, 0.5),
+    "humidity": (0.01, 1.0),
+    "pm25": (0.05, 2.0),
+    "pressure": (0.01, 0.5),
+}
 
 
 class KalmanFilter1D:
@@ -13,6 +27,7 @@ class KalmanFilter1D:
     1D Kalman filter for single sensor smoothing.
     Reduces noise and provides confidence estimates.
     """
+    __slots__ = ("q", "r", "x", "p", "k", "initialized")
     
     def __init__(self, process_variance: float = 0.01, measurement_variance: float = 0.1):
         """
@@ -72,6 +87,14 @@ class KalmanFilter1D:
         self.p = 1.0
         self.initialized = False
 
+    def get_state(self) -> list:
+        """Compact serializable state: [x, p, initialized]."""
+        return [self.x, self.p, self.initialized]
+
+    def set_state(self, state: list):
+        """Restore state produced by get_state()."""
+        self.x, self.p, self.initialized = float(state[0]), float(state[1]), bool(state[2])
+
 
 class MultiSensorFusion:
     """
@@ -185,6 +208,45 @@ class OutlierDetector:
         self.window_size = window_size
         self.z_threshold = z_threshold
         self.history = deque(maxlen=window_size)
+
+        # Running window statistics (Welford, sliding) instead of np.mean/np.std per call
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._updates = 0
+
+    def _push(self, value: float):
+        """Append to the window, updating mean / M2 incrementally."""
+        if len(self.history) == self.window_size:
+            old = self.history[0]
+            self.history.append(value)  # deque drops `old`
+            old_mean = self._mean
+            delta = value - old
+            self._mean += delta / self.window_size
+            self._m2 += delta * (value - self._mean + old - old_mean)
+        else:
+            self.history.append(value)
+            delta = value - self._mean
+            self._mean += delta / len(self.history)
+            self._m2 += delta * (value - self._mean)
+
+        # Re-sync occasionally to stop floating point drift accumulating
+        self._updates += 1
+        if self._updates >= self.window_size * 100:
+            self._recompute()
+
+    def _recompute(self):
+        self._updates = 0
+        if self.history:
+            arr = np.fromiter(self.history, dtype=float)
+            self._mean = float(arr.mean())
+            self._m2 = float(((arr - self._mean) ** 2).sum())
+        else:
+            self._mean = 0.0
+            self._m2 = 0.0
+
+    def _std(self) -> float:
+        """Population std of the window (same as np.std)."""
+        return float(np.sqrt(max(self._m2, 0.0) / len(self.history)))
         
     def is_outlier(self, value: float) -> Tuple[bool, float]:
         """
@@ -194,15 +256,15 @@ class OutlierDetector:
             Tuple of (is_outlier, z_score)
         """
         if len(self.history) < 5:  # Need minimum samples
-            self.history.append(value)
+            self._push(value)
             return False, 0.0
         
-        # Calculate mean and std from history
-        mean = np.mean(self.history)
-        std = np.std(self.history)
+        # Mean and std from running window statistics
+        mean = self._mean
+        std = self._std()
         
         if std < 1e-6:  # Avoid division by zero
-            self.history.append(value)
+            self._push(value)
             return False, 0.0
         
         # Calculate z-score
@@ -212,7 +274,7 @@ class OutlierDetector:
         
         # Add to history only if not an outlier
         if not is_outlier:
-            self.history.append(value)
+            self._push(value)
         
         return is_outlier, z_score
     
@@ -223,6 +285,13 @@ class OutlierDetector:
         is_outlier, _ = self.is_outlier(value)
         return None if is_outlier else value
 
+    def get_state(self) -> list:
+        return list(self.history)
+
+    def set_state(self, state: list):
+        self.history = deque(state, maxlen=self.window_size)
+        self._recompute()
+
 
 class DataCleaner:
     """
@@ -268,12 +337,131 @@ class DataCleaner:
             "z_score": round(z_score, 2)
         }
 
+    def get_state(self) -> dict:
+        return {"ema": self.ema_value, "history": self.outlier_detector.get_state()}
+
+    def set_state(self, state: dict):
+        self.ema_value = state.get("ema")
+        self.outlier_detector.set_state(state.get("history", []))
+
+
+class DeviceFilterState:
+    """
+    Filter set for one device (temperature, humidity, PM2.5 Kalman + MQ cleaner).
+    """
+    __slots__ = ("temp", "humidity", "pm25", "mq")
+
+    def __init__(self):
+        self.temp = KalmanFilter1D(*FILTER_PARAMS["temperature"])
+        self.humidity = KalmanFilter1D(*FILTER_PARAMS["humidity"])
+        self.pm25 = KalmanFilter1D(*FILTER_PARAMS["pm25"])
+        self.mq = DataCleaner(alpha=0.4)  # More smoothing for noisy MQ sensor
+
+    def to_dict(self) -> dict:
+        return {
+            "temp": self.temp.get_state(),
+            "humidity": self.humidity.get_state(),
+            "pm25": self.pm25.get_state(),
+            "mq": self.mq.get_state(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DeviceFilterState":
+        state = cls()
+        state.temp.set_state(data["temp"])
+        state.humidity.set_state(data["humidity"])
+        state.pm25.set_state(data["pm25"])
+        state.mq.set_state(data["mq"])
+        return state
+
+
+class FilterRegistry:
+    """
+    Keyed store of per-device filter state with LRU eviction of idle devices.
+    Accessed from the event loop only (ingest handlers).
+    Dirty devices pushed out by the LRU keep their serialized state until the
+    next snapshot writes it, and come back from it if they return before then.
+    """
+
+    def __init__(self, max_devices: int = 5000):
+        self.max_devices = max_devices
+        self._states: "OrderedDict[str, DeviceFilterState]" = OrderedDict()
+        self._dirty = set()
+        self._evicted: Dict[str, dict] = {}  # Evicted before being persisted
+
+    def get(self, device_id: str) -> DeviceFilterState:
+        """Return (creating if needed) the filter set for a device, marking it recently used."""
+        state = self._states.get(device_id)
+        if state is None:
+            pending = self._evicted.pop(device_id, None)
+            state = DeviceFilterState.from_dict(pending) if pending else DeviceFilterState()
+            self._states[device_id] = state
+            self._evict()
+        else:
+            self._states.move_to_end(device_id)
+        self._dirty.add(device_id)
+        return state
+
+    def _evict(self):
+        while len(self._states) > self.max_devices:
+            device_id, state = self._states.popitem(last=False)
+            if device_id in self._dirty:
+                self._dirty.discard(device_id)
+                self._evicted[device_id] = state.to_dict()
+
+    def __len__(self):
+        return len(self._states)
 
-# Global instances for persistence across requests
-_temp_filter = KalmanFilter1D(process_variance=0.01, measurement_variance=0.5)
-_humidity_filter = KalmanFilter1D(process_variance=0.01, measurement_variance=1.0)
-_pm25_filter = KalmanFilter1D(process_variance=0.05, measurement_variance=2.0)
-_mq_cleaner = DataCleaner(alpha=0.4)  # More smoothing for noisy MQ sensor
+    def __contains__(self, device_id: str):
+        return device_id in self._states
+
+    def missing(self, device_ids) -> list:
+        """Devices that are neither in memory nor waiting to be persisted (candidates for a DB restore)."""
+        return [d for d in device_ids if d not in self._states and d not in self._evicted]
+
+    def export_states(self, dirty_only: bool = False) -> Dict[str, dict]:
+        """
+        Serialize states (call on the event loop, then persist off-thread),
+        including evicted devices not yet persisted.
+        Exported devices stop being dirty; call requeue() with them if the write fails.
+        """
+        ids = list(self._dirty) if dirty_only else list(self._states.keys())
+        exported = {d: self._states[d].to_dict() for d in ids if d in self._states}
+        self._dirty.difference_update(ids)
+        exported.update(self._evicted)
+        self._evicted.clear()
+        return exported
+
+    def requeue(self, states: Dict[str, dict]):
+        """Keep exported states for the next snapshot (e.g. after a failed write)."""
+        for device_id, data in states.items():
+            if device_id in self._states:
+                self._dirty.add(device_id)
+            else:
+                self._evicted.setdefault(device_id, data)
+
+    def import_states(self, states: Dict[str, dict], overwrite: bool = True):
+        """
+        Load serialized states, oldest first so LRU order is preserved.
+        With overwrite=False, devices already in memory keep their (newer) state.
+        """
+        for device_id, data in states.items():
+            if not overwrite and (device_id in self._states or device_id in self._evicted):
+                continue
+            try:
+                self._states[device_id] = DeviceFilterState.from_dict(data)
+                self._states.move_to_end(device_id)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"[Kalman] Skipping corrupt state for {device_id}: {e}")
+        self._evict()
+
+
+# Global registry for persistence across requests
+KALMAN_MAX_DEVICES = int(os.getenv("KALMAN_MAX_DEVICES", "5000"))
+KALMAN_PERSIST_STATE = os.getenv("KALMAN_PERSIST_STATE", "true").lower() == "true"
+DEFAULT_DEVICE = "MAIN"
+
+filter_registry = FilterRegistry(max_devices=KALMAN_MAX_DEVICES)
 
 _fusion_engine = MultiSensorFusion()
 _fusion_engine.add_source("esp32", measurement_variance=0.8)
@@ -281,24 +469,122 @@ _fusion_engine.add_source("openweather", measurement_variance=0.3)
 _fusion_engine.add_source("openaq", measurement_variance=0.5)
 
 
-def filter_temperature(temp: float) -> Tuple[float, float]:
+def get_device_filters(device_id: str = DEFAULT_DEVICE) -> DeviceFilterState:
+    """Filter set for a device (created on first use)."""
+    return filter_registry.get(device_id)
+
+
+def filter_temperature(temp: float, device_id: str = DEFAULT_DEVICE) -> Tuple[float, float]:
     """Apply Kalman filter to temperature reading."""
-    return _temp_filter.update(temp)
+    return filter_registry.get(device_id).temp.update(temp)
 
 
-def filter_humidity(humidity: float) -> Tuple[float, float]:
+def filter_humidity(humidity: float, device_id: str = DEFAULT_DEVICE) -> Tuple[float, float]:
     """Apply Kalman filter to humidity reading."""
-    return _humidity_filter.update(humidity)
+    return filter_registry.get(device_id).humidity.update(humidity)
 
 
-def filter_pm25(pm25: float) -> Tuple[float, float]:
+def filter_pm25(pm25: float, device_id: str = DEFAULT_DEVICE) -> Tuple[float, float]:
     """Apply Kalman filter to PM2.5 reading."""
-    return _pm25_filter.update(pm25)
+    return filter_registry.get(device_id).pm25.update(pm25)
 
 
-def clean_mq_data(mq_raw: float) -> Dict[str, any]:
+def clean_mq_data(mq_raw: float, device_id: str = DEFAULT_DEVICE) -> Dict[str, any]:
     """Clean and smooth MQ-135 sensor data."""
-    return _mq_cleaner.clean_and_smooth(mq_raw)
+    return filter_registry.get(device_id).mq.clean_and_smooth(mq_raw)
+
+
+# --- Snapshot / Restore (DB) ---
+
+def save_filter_states(states: Dict[str, dict]) -> int:
+    """
+    Persist exported filter states (blocking; run via asyncio.to_thread).
+    Returns number of rows written.
+    """
+    if not states:
+        return 0
+    from .. import database, models
+    db = database.SessionLocal()
+    try:
+        existing = {
+            row.device_id: row for row in db.query(models.FilterStateSnapshot).filter(
+                models.FilterStateSnapshot.device_id.in_(list(states.keys()))
+            ).all()
+        }
+        now = datetime.utcnow()
+        for device_id, data in states.items():
+            row = existing.get(device_id)
+            if row:
+                row.state_json = json.dumps(data)
+                row.updated_at = now
+            else:
+                db.add(models.FilterStateSnapshot(device_id=device_id, state_json=json.dumps(data), updated_at=now))
+        db.commit()
+        return len(states)
+    finally:
+        db.close()
+
+
+def load_filter_states(limit: int = KALMAN_MAX_DEVICES, device_ids=None) -> Dict[str, dict]:
+    """Load the most recently updated snapshots (optionally only `device_ids`), ordered oldest -> newest."""
+    from .. import database, models
+    db = database.SessionLocal()
+    try:
+        query = db.query(models.FilterStateSnapshot)
+        if device_ids is not None:
+            query = query.filter(models.FilterStateSnapshot.device_id.in_(list(device_ids)))
+        rows = query.order_by(models.FilterStateSnapshot.updated_at.desc()).limit(limit).all()
+        return {row.device_id: json.loads(row.state_json) for row in reversed(rows)}
+    finally:
+        db.close()
+
+
+async def restore_filter_states():
+    """Warm the registry from the last DB snapshot (startup)."""
+    if not KALMAN_PERSIST_STATE:
+        return
+    try:
+        states = await asyncio.to_thread(load_filter_states)
+        filter_registry.import_states(states)
+        print(f"[Kalman] Restored filter state for {len(states)} devices")
+    except Exception as e:
+        print(f"[Kalman] Restore Error: {e}")
+
+
+async def warm_filter_states(device_ids):
+    """
+    Restore snapshots of devices not held in memory (e.g. evicted by the LRU)
+    before their readings are filtered, so they don't cold-start.
+    """
+    if not KALMAN_PERSIST_STATE:
+        return
+    missing = filter_registry.missing(set(device_ids))
+    if not missing:
+        return
+    try:
+        states = await asyncio.to_thread(load_filter_states, len(missing), missing)
+        filter_registry.import_states(states, overwrite=False)
+    except Exception as e:
+        print(f"[Kalman] Restore Error: {e}")
+
+
+async def persist_filter_states(dirty_only: bool = True):
+    """Snapshot filter state to the DB (serialized on the loop, written off-thread)."""
+    if not KALMAN_PERSIST_STATE:
+        return
+    states = filter_registry.export_states(dirty_only=dirty_only)
+    try:
+        await asyncio.to_thread(save_filter_states, states)
+    except Exception as e:
+        filter_registry.requeue(states)  # Retry on the next snapshot
+        print(f"[Kalman] Snapshot Error: {e}")
+
+
+async def snapshot_filter_states_loop(interval_seconds: int = 300):
+    """Background task to periodically persist dirty filter state."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await persist_filter_states(dirty_only=True)
 
 
 def fuse_environmental_data(measurements: Dict[str, Dict[str, Optional[float]]]) -> Dict[str, any]:
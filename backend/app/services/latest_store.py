@@ -0,0 +1,288 @@
+"""
+Latest Reading Store
+In-memory newest reading per device, so "current value" endpoints answer
+without an ORDER BY timestamp DESC query.
+
+- Write-through: ingest calls stage(db, rows) before committing; the newest
+  row per device is upserted into `device_latest` in the same transaction and
+  copied into memory only once that transaction commits.
+- A short ring of the most recent readings (any device) serves "last N
+  readings" views (sensor health, trend predictions).
+- Warm start: load() reads `device_latest` on startup (seeding it from
+  sensor_data the first time).
+- Other workers' writes are picked up by a sync loop that reads rows changed
+  since the last pass every LATEST_SYNC_SECONDS (off the request path).
+"""
+import asyncio
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, func
+
+from .. import database
+
+LATEST_SYNC_SECONDS = float(os.getenv("LATEST_SYNC_SECONDS", "5"))
+LATEST_RECENT_SIZE = int(os.getenv("LATEST_RECENT_SIZE", "64"))
+FIELDS = ("temperature", "humidity", "pressure", "wind_speed", "pm2_5", "pm10", "motion")
+
+
+class LatestReading:
+    """Detached snapshot with the SensorData attributes endpoints read."""
+    __slots__ = ("id", "device_id", "timestamp") + FIELDS
+
+    def __init__(self, device_id: str, timestamp: datetime, id: Optional[int] = None, **values):
+        self.id = id
+        self.device_id = device_id
+        self.timestamp = timestamp
+        for f in FIELDS:
+            setattr(self, f, values.get(f))
+
+    @classmethod
+    def from_row(cls, row) -> "LatestReading":
+        """From a SensorData or DeviceLatest row."""
+        ts = row.timestamp
+        if ts is not None and ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        return cls(
+            row.device_id, ts,
+            id=getattr(row, "sensor_data_id", None) or getattr(row, "id", None),
+            **{f: getattr(row, f, None) for f in FIELDS},
+        )
+
+    def as_columns(self) -> dict:
+        return {
+            "device_id": self.device_id, "sensor_data_id": self.id, "timestamp": self.timestamp,
+            "updated_at": datetime.utcnow(), **{f: getattr(self, f) for f in FIELDS},
+        }
+
+
+class LatestStore:
+    def __init__(self):
+        self._by_device: Dict[str, LatestReading] = {}
+        self._newest: Optional[LatestReading] = None
+        self._last_motion: Optional[LatestReading] = None
+        self._recent: deque = deque()
+        self._recent_ids: set = set()
+        self._max_id = 0
+        self._lock = threading.Lock()
+        self._synced_at: Optional[datetime] = None
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._by_device)
+
+    # --- Reads (no DB access) ---
+    def get(self, device_id: str) -> Optional[LatestReading]:
+        return self._by_device.get(device_id)
+
+    def newest(self) -> Optional[LatestReading]:
+        """Most recent reading across all devices."""
+        return self._newest
+
+    def all(self) -> List[LatestReading]:
+        return list(self._by_device.values())
+
+    def recent(self, limit: int = LATEST_RECENT_SIZE) -> List[LatestReading]:
+        """Up to `limit` (<= LATEST_RECENT_SIZE) most recent readings across devices, newest first."""
+        with self._lock:
+            items = list(self._recent)
+        items.sort(key=lambda r: (r.timestamp, r.id or 0), reverse=True)
+        return items[:limit]
+
+    def last_motion(self) -> Optional[LatestReading]:
+        """Most recent reading that reported motion."""
+        return self._last_motion
+
+    # --- Writes ---
+    def remember(self, readings: Iterable[LatestReading]):
+        """Keep each reading if it is newer than what the store holds for its device."""
+        with self._lock:
+            for r in readings:
+                if r.timestamp is None:
+                    continue
+                cur = self._by_device.get(r.device_id)
+                if cur is None or r.timestamp >= cur.timestamp:
+                    self._by_device[r.device_id] = r
+                    if self._newest is None or r.timestamp >= self._newest.timestamp:
+                        self._newest = r
+
+    def remember_recent(self, readings: Iterable[LatestReading]):
+        """Add readings to the recent ring (deduplicated by SensorData id)."""
+        with self._lock:
+            for r in readings:
+                if r.id is not None:
+                    if r.id in self._recent_ids:
+                        continue
+                    self._recent_ids.add(r.id)
+                    self._max_id = max(self._max_id, r.id)
+                self._recent.append(r)
+                if len(self._recent) > LATEST_RECENT_SIZE:
+                    old = self._recent.popleft()
+                    self._recent_ids.discard(old.id)
+                if r.motion and (self._last_motion is None or r.timestamp >= self._last_motion.timestamp):
+                    self._last_motion = r
+
+    def stage(self, db, rows: Iterable) -> int:
+        """
+        Upsert the newest of `rows` (flushed SensorData) per device into
+        device_latest within the caller's transaction; memory is updated on commit.
+
+        Returns:
+            Number of devices touched
+        """
+        readings = [LatestReading.from_row(row) for row in rows if row.device_id is not None and row.timestamp is not None]
+        if not readings:
+            return 0
+        newest = _newest_per_device(readings)
+        _write(db, newest)
+        pending = db.info.setdefault("latest_pending", ([], []))
+        pending[0].extend(newest)
+        pending[1].extend(sorted(readings, key=lambda r: r.timestamp)[-LATEST_RECENT_SIZE:])
+        return len(newest)
+
+    def clear(self):
+        with self._lock:
+            self._by_device.clear()
+            self._newest = None
+            self._last_motion = None
+            self._recent.clear()
+            self._recent_ids.clear()
+            self._max_id = 0
+            self.loaded = False
+
+    # --- Warm start / cross-worker sync ---
+    def load(self, db=None):
+        """(Re)load the store from device_latest, seeding that table from sensor_data if empty."""
+        from .. import models
+
+        own_session = db is None
+        db = db or database.SessionLocal()
+        try:
+            rows = db.query(models.DeviceLatest).all()
+            if not rows:
+                seeded = seed_from_sensor_data(db)
+                if seeded:
+                    db.commit()
+                    rows = db.query(models.DeviceLatest).all()
+            self.clear()
+            self.remember(LatestReading.from_row(r) for r in rows)
+            self._synced_at = max((r.updated_at for r in rows if r.updated_at), default=None)
+
+            SD = models.SensorData
+            recent = db.query(SD).order_by(SD.timestamp.desc()).limit(LATEST_RECENT_SIZE).all()
+            self.remember_recent(LatestReading.from_row(r) for r in reversed(recent))
+            if self._last_motion is None:
+                motion = db.query(SD).filter(SD.motion == True).order_by(SD.timestamp.desc()).first()
+                if motion:
+                    self._last_motion = LatestReading.from_row(motion)
+            self.loaded = True
+            print(f"[LatestStore] Loaded latest readings for {len(self)} devices")
+        finally:
+            if own_session:
+                db.close()
+
+    def sync(self, db=None) -> int:
+        """Pull device_latest rows updated since the last pass (writes from other workers)."""
+        from .. import models
+
+        own_session = db is None
+        db = db or database.SessionLocal()
+        try:
+            DL = models.DeviceLatest
+            query = db.query(DL)
+            if self._synced_at is not None:
+                query = query.filter(DL.updated_at >= self._synced_at)
+            rows = query.all()
+            if rows:
+                self.remember(LatestReading.from_row(r) for r in rows)
+                self._synced_at = max((r.updated_at for r in rows if r.updated_at), default=self._synced_at)
+
+            SD = models.SensorData
+            recent = db.query(SD).filter(SD.id > self._max_id).order_by(SD.id.desc()).limit(LATEST_RECENT_SIZE).all()
+            self.remember_recent(LatestReading.from_row(r) for r in reversed(recent))
+            return len(rows)
+        finally:
+            if own_session:
+                db.close()
+
+
+def _newest_per_device(readings: Iterable[LatestReading]) -> List[LatestReading]:
+    newest: Dict[str, LatestReading] = {}
+    for r in readings:
+        cur = newest.get(r.device_id)
+        if cur is None or r.timestamp >= cur.timestamp:
+            newest[r.device_id] = r
+    return list(newest.values())
+
+
+def _write(db, readings: List[LatestReading]):
+    from .. import models
+
+    DL = models.DeviceLatest
+    dialect = db.get_bind().dialect.name
+    rows = [r.as_columns() for r in sorted(readings, key=lambda r: r.device_id)]
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(DL.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["device_id"],
+            set_={c: stmt.excluded[c] for c in rows[0] if c != "device_id"},
+            where=stmt.excluded.timestamp >= DL.__table__.c.timestamp,
+        )
+        db.execute(stmt, rows)
+        return
+    for values in rows:
+        cur = db.query(DL).filter(DL.device_id == values["device_id"]).with_for_update().first()
+        if cur is None:
+            db.add(DL(**values))
+        elif cur.timestamp is None or values["timestamp"] >= cur.timestamp:
+            for key, value in values.items():
+                setattr(cur, key, value)
+
+
+def seed_from_sensor_data(db) -> int:
+    """Fill device_latest from the newest sensor_data row per device (uses ix_sensor_data_device_ts)."""
+    from .. import models
+
+    SD = models.SensorData
+    newest = db.query(SD.device_id, func.max(SD.timestamp).label("ts")).group_by(SD.device_id).subquery()
+    rows = db.query(SD).join(
+        newest, (SD.device_id == newest.c.device_id) & (SD.timestamp == newest.c.ts)
+    ).all()
+    readings = _newest_per_device(LatestReading.from_row(r) for r in rows if r.device_id)
+    if readings:
+        _write(db, readings)
+    return len(readings)
+
+
+# Global store instance
+latest_store = LatestStore()
+
+
+@event.listens_for(database.SessionLocal, "after_commit")
+def _on_commit(session):
+    pending = session.info.pop("latest_pending", None)
+    if pending:
+        latest_store.remember(pending[0])
+        latest_store.remember_recent(pending[1])
+
+
+@event.listens_for(database.SessionLocal, "after_rollback")
+def _on_rollback(session):
+    session.info.pop("latest_pending", None)
+
+
+async def sync_loop(interval_seconds: float = LATEST_SYNC_SECONDS):
+    """Background task picking up other workers' ingest."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(latest_store.sync)
+        except Exception as e:
+            print(f"[LatestStore] Sync error: {e}")
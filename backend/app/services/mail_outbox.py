@@ -0,0 +1,348 @@
+"""
+Outbound Mail Subsystem
+Emails are written to the `email_outbox` table and delivered by a few worker
+threads sharing a small pool of long-lived, authenticated SMTP connections,
+so an alert to 200 recipients costs a handful of TLS handshakes instead of 200.
+
+- Durable: queued messages survive restarts; rows claimed by a crashed worker
+  are picked up again once their lease expires.
+- Retries: transient failures (connection errors, 4xx) are retried with
+  exponential backoff up to MAIL_MAX_ATTEMPTS; permanent 5xx rejections fail fast.
+- Multi-process safe on PostgreSQL (claims use FOR UPDATE SKIP LOCKED).
+
+Point SMTP_HOST/SMTP_PORT at a local stand-in (e.g. `python -m aiosmtpd -n -l
+localhost:8025` with SMTP_USE_TLS=false) to test without credentials.
+"""
+import os
+import queue
+import random
+import re
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"   # STARTTLS
+SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "false").lower() == "true"  # Implicit TLS (465)
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "15"))
+SMTP_USER = os.getenv("EMAIL_USER")
+SMTP_PASS = os.getenv("EMAIL_PASS")
+MAIL_FROM = os.getenv("MAIL_FROM", SMTP_USER or "ecosync@localhost")
+
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "3"))
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", str(MAIL_POOL_SIZE)))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_RETRY_BASE = float(os.getenv("MAIL_RETRY_BASE", "30"))      # seconds
+MAIL_RETRY_MAX = float(os.getenv("MAIL_RETRY_MAX", "3600"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", "2"))
+MAIL_LEASE_SECONDS = int(os.getenv("MAIL_LEASE_SECONDS", "300"))  # Claimed rows become retryable after this
+SMTP_IDLE_CHECK = float(os.getenv("SMTP_IDLE_CHECK", "30"))       # NOOP idle connections before reuse
+
+
+def mail_configured() -> bool:
+    """Credentials are present, or an explicit (e.g. local, no-auth) SMTP host is set."""
+    return bool(SMTP_USER and SMTP_PASS) or "SMTP_HOST" in os.environ
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "queued": 0, "sent": 0, "retried": 0, "failed": 0,
+            "connections_opened": 0, "connections_reused": 0, "connection_errors": 0,
+        }
+        self.last_error: Optional[str] = None
+        self.send_seconds_total = 0.0
+
+    def inc(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] += n
+
+
+metrics = _Metrics()
+
+
+class SMTPConnectionPool:
+    """Up to `size` authenticated SMTP connections, reused across messages."""
+
+    def __init__(self, size: int = MAIL_POOL_SIZE):
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        if SMTP_USE_SSL:
+            server = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if SMTP_USE_TLS:
+                server.starttls()
+        if SMTP_USER and SMTP_PASS:
+            server.login(SMTP_USER, SMTP_PASS)
+        metrics.inc("connections_opened")
+        return server
+
+    def acquire(self) -> smtplib.SMTP:
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - idle_since < SMTP_IDLE_CHECK:
+                    metrics.inc("connections_reused")
+                    return server
+                try:
+                    # Servers drop idle sessions; probe before reuse
+                    if server.noop()[0] == 250:
+                        metrics.inc("connections_reused")
+                        return server
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._close(server)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, server: smtplib.SMTP, broken: bool = False):
+        if broken:
+            self._close(server)
+        else:
+            self._idle.put((server, time.monotonic()))
+        self._slots.release()
+
+    def _close(self, server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def close_all(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(server)
+
+
+pool = SMTPConnectionPool()
+_wakeup = threading.Event()
+_stop = threading.Event()
+_claim_lock = threading.Lock()
+_workers: List[threading.Thread] = []
+
+
+def enqueue(db, recipients: Iterable[str], subject: str, body: str, category: str = "alert") -> int:
+    """
+    Add one outbox row per recipient to `db` (the caller commits).
+
+    Returns:
+        Number of messages queued
+    """
+    from .. import models
+
+    rows = [
+        models.EmailOutbox(recipient=r, subject=subject, body=body, category=category)
+        for r in sorted(set(recipients)) if r
+    ]
+    db.add_all(rows)
+    metrics.inc("queued", len(rows))
+    _wakeup.set()
+    return len(rows)
+
+
+def enqueue_now(recipients: Iterable[str], subject: str, body: str, category: str = "alert") -> int:
+    """enqueue() in its own session, committed immediately."""
+    from .. import database
+
+    db = database.SessionLocal()
+    try:
+        count = enqueue(db, recipients, subject, body, category)
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def build_message(recipient: str, subject: str, body: str) -> str:
+    msg = MIMEMultipart()
+    msg['From'] = MAIL_FROM
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_string()
+
+
+def _retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter."""
+    delay = min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claim_batch(db) -> list:
+    """Lease up to MAIL_BATCH_SIZE due messages (pending, or sending with an expired lease)."""
+    from .. import models
+
+    E = models.EmailOutbox
+    now = datetime.utcnow()
+    with _claim_lock:
+        rows = db.query(E).filter(
+            E.status.in_(("pending", "sending")),
+            E.next_attempt_at <= now
+        ).order_by(E.next_attempt_at.asc(), E.id.asc()).limit(MAIL_BATCH_SIZE).with_for_update(skip_locked=True).all()
+        lease_until = now + timedelta(seconds=MAIL_LEASE_SECONDS)
+        for row in rows:
+            row.status = "sending"
+            row.next_attempt_at = lease_until
+        db.commit()
+    return rows
+
+
+def _deliver(row) -> Optional[str]:
+    """
+    Send one message over a pooled connection.
+
+    Returns:
+        None on success, "retry" for transient failures, "fail" for permanent ones
+    """
+    started = time.monotonic()
+    try:
+        server = pool.acquire()
+    except (smtplib.SMTPException, OSError) as e:
+        metrics.inc("connection_errors")
+        metrics.last_error = redact(f"connect: {e}")
+        row.last_error = str(e)[:500]
+        # Bad credentials won't fix themselves, but the message should survive a config fix
+        return "retry"
+
+    broken = False
+    try:
+        server.sendmail(MAIL_FROM, [row.recipient], build_message(row.recipient, row.subject, row.body))
+        metrics.send_seconds_total += time.monotonic() - started
+        return None
+    except smtplib.SMTPRecipientsRefused as e:
+        row.last_error = str(e)[:500]
+        return "fail"
+    except smtplib.SMTPResponseException as e:
+        row.last_error = f"{e.smtp_code} {e.smtp_error!r}"[:500]
+        # 4xx: transient (quota, greylisting); 5xx: permanent rejection
+        broken = e.smtp_code in (421,)
+        return "retry" if 400 <= e.smtp_code < 500 else "fail"
+    except (smtplib.SMTPException, OSError) as e:
+        broken = True
+        row.last_error = str(e)[:500]
+        return "retry"
+    finally:
+        pool.release(server, broken=broken)
+
+
+def process_batch() -> int:
+    """Claim and deliver one batch. Returns the number of messages handled."""
+    from .. import database
+
+    # Claimed rows stay loaded across the per-message commits
+    db = database.SessionLocal(expire_on_commit=False)
+    try:
+        rows = _claim_batch(db)
+        for row in rows:
+            outcome = _deliver(row)
+            row.attempts = (row.attempts or 0) + 1
+            if outcome is None:
+                row.status = "sent"
+                row.sent_at = datetime.utcnow()
+                row.last_error = None
+                metrics.inc("sent")
+            elif outcome == "retry" and row.attempts < MAIL_MAX_ATTEMPTS:
+                row.status = "pending"
+                row.next_attempt_at = datetime.utcnow() + timedelta(seconds=_retry_delay(row.attempts))
+                metrics.inc("retried")
+            else:
+                row.status = "failed"
+                metrics.inc("failed")
+                metrics.last_error = redact(row.last_error)
+                print(f"❌ Email to {row.recipient} failed after {row.attempts} attempt(s): {row.last_error}")
+            db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+
+def _worker_loop():
+    while not _stop.is_set():
+        try:
+            handled = process_batch()
+        except Exception as e:
+            print(f"[Mail] Worker error: {e}")
+            handled = 0
+        if not handled:
+            _wakeup.wait(MAIL_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_workers(count: int = MAIL_WORKERS):
+    """Start the delivery threads (no-op if mail is not configured or already running)."""
+    if _workers:
+        return
+    if not mail_configured():
+        print("⚠️ Mail outbox disabled: EMAIL_USER/EMAIL_PASS (or SMTP_HOST) not configured")
+        return
+    _stop.clear()
+    for i in range(count):
+        t = threading.Thread(target=_worker_loop, name=f"mail-worker-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
+    print(f"[Mail] {count} outbox workers started ({SMTP_HOST}:{SMTP_PORT}, pool={MAIL_POOL_SIZE})")
+
+
+def stop_workers(timeout: float = 5.0):
+    _stop.set()
+    _wakeup.set()
+    for t in _workers:
+        t.join(timeout)
+    _workers.clear()
+    pool.close_all()
+
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+
+
+def redact(text: Optional[str]) -> Optional[str]:
+    """Strip email addresses (SMTP errors quote recipients) from text exposed by stats()."""
+    return _EMAIL_RE.sub("<address>", text) if text else text
+
+
+def stats(db=None) -> dict:
+    """Delivery counters plus outbox depth by status."""
+    from sqlalchemy import func
+    from .. import database, models
+
+    own_session = db is None
+    db = db or database.SessionLocal()
+    try:
+        depth = dict(db.query(models.EmailOutbox.status, func.count()).group_by(models.EmailOutbox.status).all())
+    finally:
+        if own_session:
+            db.close()
+    sent = metrics.counters["sent"]
+    return {
+        **metrics.counters,
+        "outbox": depth,
+        "workers": len(_workers),
+        "avg_send_ms": round(metrics.send_seconds_total / sent * 1000, 2) if sent else None,
+        "last_error": metrics.last_error,
+    }
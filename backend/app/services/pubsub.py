@@ -0,0 +1,416 @@
+"""
+Pub/Sub backplane for live WebSocket streams across workers.
+Ingest handlers call `publish(message, device_id)` once: the frame is fanned
+out to this worker's sockets immediately and forwarded to the backplane, and
+every other worker fans it out to its own sockets when it arrives. Frames a
+worker published itself are ignored on the way back.
+
+Backends (PUBSUB_URL):
+- memory://                 single process (default)
+- unix:///tmp/ecosync.sock  local broker, for multi-worker runs on one host
+                            and tests (`python -m app.services.pubsub broker /tmp/ecosync.sock`)
+- redis://host:6379/0       Redis PUBLISH/SUBSCRIBE (requires the `redis` package)
+- postgresql://...          Postgres LISTEN/NOTIFY (psycopg2)
+
+Wire format is one line per frame: "<origin>\\t<device_id>\\t<json>".
+"""
+import abc
+import asyncio
+import os
+import sys
+import uuid
+from typing import Callable, Optional
+
+from .websocket_manager import manager
+
+PUBSUB_URL = os.getenv("PUBSUB_URL", "memory://")
+PUBSUB_CHANNEL = os.getenv("PUBSUB_CHANNEL", "ecosync_ws")
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "10000"))
+PUBSUB_RECONNECT_MAX = float(os.getenv("PUBSUB_RECONNECT_MAX", "30"))
+PG_NOTIFY_MAX_BYTES = 7900  # NOTIFY payloads must be < 8000 bytes
+
+WORKER_ID = uuid.uuid4().hex[:12]
+
+
+def encode_frame(origin: str, device_id: str, text: str) -> str:
+    return f"{origin}\t{device_id}\t{text}"
+
+
+def decode_frame(line: str):
+    origin, device_id, text = line.rstrip("\n").split("\t", 2)
+    return origin, device_id, text
+
+
+class Backplane(abc.ABC):
+    """Base class: forwards frames between workers. Subclasses implement send()."""
+    name = "base"
+
+    def __init__(self, url: str):
+        self.url = url
+        self.on_frame: Optional[Callable[[str], None]] = None
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+
+    async def start(self, on_frame: Callable[[str], None]):
+        self.on_frame = on_frame
+
+    @abc.abstractmethod
+    async def send(self, frame: str):
+        """Forward one frame to the other workers."""
+
+    async def close(self):
+        self.connected = False
+
+    def _deliver(self, frame: str):
+        self.received += 1
+        if self.on_frame:
+            self.on_frame(frame)
+
+
+class MemoryBackplane(Backplane):
+    """Single process: local fan-out already happened in publish()."""
+    name = "memory"
+
+    async def start(self, on_frame):
+        await super().start(on_frame)
+        self.connected = True
+
+    async def send(self, frame: str):
+        self.published += 1
+
+
+class _ReconnectingBackplane(Backplane):
+    """
+    Runs a listener that reconnects with exponential backoff.
+    Subclasses implement _connect/_listen/_send and may override _disconnect.
+    """
+
+    def __init__(self, url: str):
+        super().__init__(url)
+        self._listener: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+
+    async def start(self, on_frame):
+        await super().start(on_frame)
+        self._listener = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._ready.wait(), 5)
+        except asyncio.TimeoutError:
+            print(f"⚠️ PubSub: {self.name} backplane not reachable yet, retrying in background")
+
+    async def _run(self):
+        delay = 0.5
+        while True:
+            try:
+                await self._connect()
+                self.connected = True
+                self._ready.set()
+                delay = 0.5
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ PubSub: {self.name} connection lost: {e!r}")
+            self.connected = False
+            await self._disconnect()
+            await asyncio.sleep(delay)
+            delay = min(PUBSUB_RECONNECT_MAX, delay * 2)
+
+    async def send(self, frame: str):
+        if not self.connected:
+            raise ConnectionError(f"{self.name} backplane not connected")
+        await self._send(frame)
+        self.published += 1
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        self.connected = False
+        await self._disconnect()
+
+    @abc.abstractmethod
+    async def _connect(self):
+        """Open the connection / subscription."""
+
+    @abc.abstractmethod
+    async def _listen(self):
+        """Deliver incoming frames until the connection fails (must not return while healthy)."""
+
+    @abc.abstractmethod
+    async def _send(self, frame: str):
+        """Write one frame on the open connection."""
+
+    async def _disconnect(self):
+        """Release the connection (no-op unless the subclass holds one)."""
+
+
+class UnixSocketBackplane(_ReconnectingBackplane):
+    """Client of the local line-based broker (see run_broker)."""
+    name = "unix"
+
+    def __init__(self, url: str):
+        super().__init__(url)
+        self.path = url[len("unix://"):]
+        self._reader = self._writer = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=1 << 20)
+
+    async def _listen(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                raise ConnectionError("broker closed the connection")
+            self._deliver(line.decode())
+
+    async def _send(self, frame: str):
+        self._writer.write(frame.encode() + b"\n")
+        await self._writer.drain()
+
+    async def _disconnect(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+class RedisBackplane(_ReconnectingBackplane):
+    name = "redis"
+
+    def __init__(self, url: str):
+        super().__init__(url)
+        import redis.asyncio as redis  # Optional dependency
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._pubsub = None
+
+    async def _connect(self):
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(PUBSUB_CHANNEL)
+
+    async def _listen(self):
+        async for message in self._pubsub.listen():
+            if message.get("type") == "message":
+                self._deliver(message["data"])
+
+    async def _send(self, frame: str):
+        await self._redis.publish(PUBSUB_CHANNEL, frame)
+
+    async def _disconnect(self):
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
+
+    async def close(self):
+        await super().close()
+        await self._redis.close()
+
+
+class PostgresBackplane(_ReconnectingBackplane):
+    """LISTEN/NOTIFY on a dedicated autocommit connection, read via the event loop."""
+    name = "postgres"
+
+    def __init__(self, url: str):
+        super().__init__(url)
+        self.dsn = url.replace("postgres://", "postgresql://", 1)
+        self._listen_conn = None
+        self._notify_conn = None
+        self._notify_lock = asyncio.Lock()
+
+    def _open(self):
+        import psycopg2
+
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    async def _connect(self):
+        self._listen_conn = await asyncio.to_thread(self._open)
+        with self._listen_conn.cursor() as cur:
+            cur.execute(f"LISTEN {PUBSUB_CHANNEL}")
+
+    async def _listen(self):
+        conn = self._listen_conn
+        loop = asyncio.get_running_loop()
+        lost = loop.create_future()
+
+        def on_readable():
+            try:
+                conn.poll()
+            except Exception as e:
+                if not lost.done():
+                    lost.set_exception(e)
+                return
+            while conn.notifies:
+                self._deliver(conn.notifies.pop(0).payload)
+
+        loop.add_reader(conn.fileno(), on_readable)
+        try:
+            await lost
+        finally:
+            loop.remove_reader(conn.fileno())
+
+    def _notify(self, frame: str):
+        if self._notify_conn is None or self._notify_conn.closed:
+            self._notify_conn = self._open()
+        with self._notify_conn.cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (PUBSUB_CHANNEL, frame))
+
+    async def _send(self, frame: str):
+        if len(frame.encode()) > PG_NOTIFY_MAX_BYTES:
+            raise ValueError("frame exceeds the NOTIFY payload limit")
+        async with self._notify_lock:
+            await asyncio.to_thread(self._notify, frame)
+
+    async def _disconnect(self):
+        if self._listen_conn is not None:
+            self._listen_conn.close()
+            self._listen_conn = None
+
+    async def close(self):
+        await super().close()
+        if self._notify_conn is not None:
+            self._notify_conn.close()
+            self._notify_conn = None
+
+
+def create_backplane(url: str = PUBSUB_URL) -> Backplane:
+    if url.startswith("unix://"):
+        return UnixSocketBackplane(url)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackplane(url)
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackplane(url)
+    return MemoryBackplane(url)
+
+
+_backplane: Optional[Backplane] = None
+_outbox: Optional[asyncio.Queue] = None
+_publisher: Optional[asyncio.Task] = None
+_dropped = 0
+
+
+def _on_frame(frame: str):
+    """Fan a frame from another worker out to local sockets."""
+    try:
+        origin, device_id, text = decode_frame(frame)
+    except ValueError:
+        return
+    if origin != WORKER_ID:
+        manager.broadcast_text(text, device_id)
+
+
+async def _publish_loop():
+    while True:
+        frame = await _outbox.get()
+        try:
+            await _backplane.send(frame)
+        except Exception as e:
+            _backplane.errors += 1
+            print(f"⚠️ PubSub publish failed: {e!r}")
+
+
+def publish(message: dict, device_id: str) -> int:
+    """
+    Deliver an ingest event to every worker's subscribers of `device_id`.
+    Never blocks: local sockets get it now, the backplane send is queued.
+
+    Returns:
+        Number of local clients the message was queued for
+    """
+    global _dropped
+    text = manager.serialize(message)
+    local = manager.broadcast_text(text, device_id)
+    if _outbox is not None:
+        try:
+            _outbox.put_nowait(encode_frame(WORKER_ID, device_id, text))
+        except asyncio.QueueFull:
+            _dropped += 1
+    return local
+
+
+async def start(url: str = PUBSUB_URL):
+    """Connect the backplane and start the publisher task (call on startup)."""
+    global _backplane, _outbox, _publisher
+    if _backplane is not None:
+        return
+    try:
+        _backplane = create_backplane(url)
+    except ImportError as e:
+        print(f"⚠️ PubSub: {e}; falling back to in-process fan-out")
+        _backplane = MemoryBackplane("memory://")
+    _outbox = asyncio.Queue(PUBSUB_QUEUE_SIZE)
+    await _backplane.start(_on_frame)
+    _publisher = asyncio.create_task(_publish_loop())
+    print(f"[PubSub] {_backplane.name} backplane started (worker {WORKER_ID})")
+
+
+async def stop():
+    global _backplane, _outbox, _publisher
+    if _publisher:
+        _publisher.cancel()
+    if _backplane:
+        await _backplane.close()
+    _backplane = _outbox = _publisher = None
+
+
+def stats() -> dict:
+    if _backplane is None:
+        return {"backend": None}
+    return {
+        "backend": _backplane.name,
+        "worker": WORKER_ID,
+        "connected": _backplane.connected,
+        "published": _backplane.published,
+        "received": _backplane.received,
+        "errors": _backplane.errors,
+        "pending": _outbox.qsize() if _outbox else 0,
+        "dropped": _dropped,
+    }
+
+
+# --- Local broker (unix://) ---
+async def run_broker(path: str):
+    """Relay every line received from one client to all other clients."""
+    clients = set()
+
+    async def handle(reader, writer):
+        clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for other in list(clients):
+                    if other is not writer:
+                        try:
+                            other.write(line)
+                        except Exception:
+                            clients.discard(other)
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path=path, limit=1 << 20)
+    print(f"[PubSub] Broker listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    # python -m app.services.pubsub broker /tmp/ecosync.sock
+    if len(sys.argv) == 3 and sys.argv[1] == "broker":
+        asyncio.run(run_broker(sys.argv[2]))
+    else:
+        print("usage: python -m app.services.pubsub broker <socket path>")
@@ -0,0 +1,180 @@
+"""
+Web Push Dispatcher
+Fans a notification out to many subscriptions:
+- all recipients' subscriptions are loaded in one query (chunked IN lists),
+- VAPID JWT headers are signed once per push service origin and reused for
+  their validity window (they only depend on the audience and expiry),
+- payloads are encrypted off the event loop and POSTed concurrently over the
+  shared pooled HTTP client (PUSH_CONCURRENCY in flight),
+- endpoints answering 404/410 are deactivated with a single UPDATE.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+from py_vapid import Vapid
+from pywebpush import WebPusher
+
+from . import http_client
+
+load_dotenv()
+
+# VAPID keys (will be generated and stored in .env)
+VAPID_PRIVATE_KEY = os.getenv("VAPID_PRIVATE_KEY")
+VAPID_PUBLIC_KEY = os.getenv("VAPID_PUBLIC_KEY")
+VAPID_CLAIMS = {
+    "sub": "mailto:sreekar092004@gmail.com"  # Contact email
+}
+
+PUSH_CONCURRENCY = int(os.getenv("PUSH_CONCURRENCY", "100"))
+PUSH_TTL = int(os.getenv("PUSH_TTL", "0"))                    # Seconds the push service may hold the message
+PUSH_TIMEOUT = float(os.getenv("PUSH_TIMEOUT", "10"))
+VAPID_TOKEN_LIFETIME = 12 * 60 * 60                           # Max allowed by the spec is 24h
+VAPID_REFRESH_MARGIN = 60 * 60                                # Re-sign when less than this is left
+QUERY_CHUNK = 1000                                            # Bound IN (...) list sizes
+ENCRYPT_CHUNK = 200                                           # Payloads encrypted per worker-thread hop
+
+_vapid: Optional[Vapid] = None
+_vapid_headers: Dict[str, Tuple[dict, float]] = {}
+
+
+def push_configured() -> bool:
+    return bool(VAPID_PRIVATE_KEY and VAPID_PUBLIC_KEY)
+
+
+def vapid_headers(endpoint: str) -> dict:
+    """Signed VAPID headers for the endpoint's push service, cached until near expiry."""
+    global _vapid
+    parts = urlsplit(endpoint)
+    aud = f"{parts.scheme}://{parts.netloc}"
+    now = time.time()
+    cached = _vapid_headers.get(aud)
+    if cached and cached[1] - now > VAPID_REFRESH_MARGIN:
+        return cached[0]
+
+    if _vapid is None:
+        _vapid = Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+    exp = int(now) + VAPID_TOKEN_LIFETIME
+    headers = dict(_vapid.sign({**VAPID_CLAIMS, "aud": aud, "exp": exp}))
+    _vapid_headers[aud] = (headers, exp)
+    return headers
+
+
+def load_subscriptions(db, user_ids: Iterable[int] = (), emails: Iterable[str] = ()) -> list:
+    """Active subscriptions of the given users (by id and/or email)."""
+    from .. import models
+
+    PS = models.PushSubscription
+    subs = []
+    user_ids, emails = list(set(user_ids)), list(set(emails))
+    for i in range(0, len(user_ids), QUERY_CHUNK):
+        subs += db.query(PS).filter(PS.user_id.in_(user_ids[i:i + QUERY_CHUNK]), PS.is_active == True).all()
+    for i in range(0, len(emails), QUERY_CHUNK):
+        subs += db.query(PS).join(models.User, models.User.id == PS.user_id).filter(
+            models.User.email.in_(emails[i:i + QUERY_CHUNK]), PS.is_active == True
+        ).all()
+    unique = {sub.id: sub for sub in subs}
+    return list(unique.values())
+
+
+def _encrypt(sub: dict, data: bytes) -> Tuple[bytes, dict]:
+    """aes128gcm-encrypt the payload for one subscription, plus request headers."""
+    body = WebPusher(sub).encode(data, content_encoding="aes128gcm")["body"]
+    headers = {
+        **vapid_headers(sub["endpoint"]),
+        "Content-Encoding": "aes128gcm",
+        "TTL": str(PUSH_TTL),
+    }
+    return body, headers
+
+
+async def dispatch(subscriptions: List[dict], payload: dict) -> dict:
+    """
+    Send `payload` to plain subscription dicts ({"id", "endpoint", "keys"}).
+
+    Returns:
+        {"sent", "failed", "dead": [subscription ids answering 404/410]}
+    """
+    data = json.dumps(payload).encode()
+    semaphore = asyncio.Semaphore(PUSH_CONCURRENCY)
+    result = {"sent": 0, "failed": 0, "dead": []}
+
+    async def send_one(sub: dict, encrypted):
+        if isinstance(encrypted, Exception):
+            print(f"❌ Push failed for subscription {sub['id']}: {encrypted}")
+            result["failed"] += 1
+            return
+        body, headers = encrypted
+        async with semaphore:
+            try:
+                response = await http_client.post(
+                    sub["endpoint"], content=body, headers=headers,
+                    timeout=PUSH_TIMEOUT, per_host_limit=False,
+                )
+            except Exception as e:
+                print(f"❌ Push failed for subscription {sub['id']}: {e}")
+                result["failed"] += 1
+                return
+        if response.status_code <= 202:
+            result["sent"] += 1
+            return
+        result["failed"] += 1
+        # Subscription expired or unsubscribed (404/410 Gone)
+        if response.status_code in (404, 410):
+            result["dead"].append(sub["id"])
+        else:
+            print(f"❌ Push failed for subscription {sub['id']}: {response.status_code} {response.text[:200]}")
+
+    def encrypt_chunk(chunk: List[dict]) -> list:
+        out = []
+        for sub in chunk:
+            try:
+                out.append(_encrypt(sub, data))
+            except Exception as e:
+                out.append(e)
+        return out
+
+    async def send_chunk(chunk: List[dict]):
+        # One thread hop per chunk; sends of earlier chunks overlap with encryption
+        encrypted = await asyncio.to_thread(encrypt_chunk, chunk)
+        await asyncio.gather(*(send_one(sub, enc) for sub, enc in zip(chunk, encrypted)))
+
+    await asyncio.gather(*(
+        send_chunk(subscriptions[i:i + ENCRYPT_CHUNK]) for i in range(0, len(subscriptions), ENCRYPT_CHUNK)
+    ))
+    return result
+
+
+def to_dispatch_list(subscriptions) -> List[dict]:
+    """Detach ORM rows into plain dicts (safe to use on another thread/loop)."""
+    return [
+        {"id": s.id, "endpoint": s.endpoint, "keys": {"p256dh": s.p256dh, "auth": s.auth}}
+        for s in subscriptions
+    ]
+
+
+def deactivate(db, subscription_ids: List[int]) -> int:
+    """Mark dead subscriptions inactive in one UPDATE (the caller commits)."""
+    from .. import models
+
+    if not subscription_ids:
+        return 0
+    return db.query(models.PushSubscription).filter(
+        models.PushSubscription.id.in_(subscription_ids)
+    ).update({"is_active": False}, synchronize_session=False)
+
+
+def send_to_users(db, payload: dict, user_ids: Iterable[int] = (), emails: Iterable[str] = ()) -> dict:
+    """Blocking variant for worker threads (alert checks); runs on the app loop."""
+    if not push_configured():
+        print("⚠️ VAPID keys not configured, skipping push notification")
+        return {"sent": 0, "failed": 0, "dead": [], "subscriptions": 0}
+    subs = to_dispatch_list(load_subscriptions(db, user_ids, emails))
+    result = http_client.run_sync(dispatch(subs, payload)) if subs else {"sent": 0, "failed": 0, "dead": []}
+    deactivate(db, result["dead"])
+    result["subscriptions"] = len(subs)
+    return result
@@ -0,0 +1,402 @@
+"""
+Sensor Rollups
+Per-device 1-minute / 1-hour / 1-day aggregates of SensorData (min, max,
+sum, count and last value per metric) in the `sensor_rollups` table.
+
+- Ingest folds each batch of new readings into its buckets inside the same
+  transaction as the raw insert (one multi-row upsert, merged atomically with
+  ON CONFLICT on PostgreSQL / SQLite), so rollups never disagree with raw data.
+- A compaction job prunes fine buckets past their retention and backfills
+  an empty table from raw history (see also backfill_rollups.py).
+- Readers ask pick_resolution() for the finest resolution that keeps a range
+  under ROLLUP_MAX_POINTS buckets: a 30-day chart reads ~720 hourly rows.
+"""
+import asyncio
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, case, func, or_
+
+METRICS = ("temperature", "humidity", "pressure", "pm2_5", "pm10", "wind_speed")
+STATS = ("min", "max", "sum", "count", "last")
+
+# Bucket widths in seconds, finest first
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+RETENTION_DAYS = {
+    "1m": int(os.getenv("ROLLUP_RETENTION_1M_DAYS", "7")),
+    "1h": int(os.getenv("ROLLUP_RETENTION_1H_DAYS", "400")),
+    "1d": None,  # Kept forever
+}
+ROLLUP_MAX_POINTS = int(os.getenv("ROLLUP_MAX_POINTS", "1500"))
+ROLLUP_COMPACT_INTERVAL = int(os.getenv("ROLLUP_COMPACT_INTERVAL", "3600"))
+ROLLUP_BACKFILL_DAYS = int(os.getenv("ROLLUP_BACKFILL_DAYS", "30"))
+ROLLUP_FLUSH_BUCKETS = 20000  # Partial aggregates written per rebuild step
+
+_TRUNCATE = {
+    "1m": dict(second=0, microsecond=0),
+    "1h": dict(minute=0, second=0, microsecond=0),
+    "1d": dict(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+def _naive_utc(ts: Optional[datetime]) -> Optional[datetime]:
+    if ts is not None and ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def bucket_start(ts: datetime, resolution: str) -> datetime:
+    return _naive_utc(ts).replace(**_TRUNCATE[resolution])
+
+
+# --- Aggregation ---
+def _empty() -> dict:
+    agg = {"samples": 0, "last_ts": None}
+    for m in METRICS:
+        agg.update({f"{m}_min": None, f"{m}_max": None, f"{m}_sum": None, f"{m}_count": 0, f"{m}_last": None})
+    return agg
+
+
+def _fold(agg: dict, last_seen: dict, ts: datetime, reading):
+    agg["samples"] += 1
+    if agg["last_ts"] is None or ts >= agg["last_ts"]:
+        agg["last_ts"] = ts
+    for m in METRICS:
+        v = getattr(reading, m, None)
+        if v is None or (isinstance(v, float) and math.isnan(v)):
+            continue
+        v = float(v)
+        lo, hi = agg[f"{m}_min"], agg[f"{m}_max"]
+        agg[f"{m}_min"] = v if lo is None or v < lo else lo
+        agg[f"{m}_max"] = v if hi is None or v > hi else hi
+        agg[f"{m}_sum"] = (agg[f"{m}_sum"] or 0.0) + v
+        agg[f"{m}_count"] += 1
+        if m not in last_seen or ts >= last_seen[m]:
+            last_seen[m] = ts
+            agg[f"{m}_last"] = v
+
+
+def _merge(cur: dict, agg: dict) -> dict:
+    """Fold partial aggregate `agg` into `cur` (both column dicts), in place."""
+    newer = cur["last_ts"] is None or (agg["last_ts"] is not None and agg["last_ts"] >= cur["last_ts"])
+    cur["samples"] = (cur["samples"] or 0) + (agg["samples"] or 0)
+    if newer:
+        cur["last_ts"] = agg["last_ts"]
+    for m in METRICS:
+        for stat, pick in (("min", min), ("max", max)):
+            vals = [v for v in (cur[f"{m}_{stat}"], agg[f"{m}_{stat}"]) if v is not None]
+            cur[f"{m}_{stat}"] = pick(vals) if vals else None
+        if agg[f"{m}_sum"] is not None:
+            cur[f"{m}_sum"] = (cur[f"{m}_sum"] or 0.0) + agg[f"{m}_sum"]
+        cur[f"{m}_count"] = (cur[f"{m}_count"] or 0) + (agg[f"{m}_count"] or 0)
+        if agg[f"{m}_last"] is not None and (newer or cur[f"{m}_last"] is None):
+            cur[f"{m}_last"] = agg[f"{m}_last"]
+    return cur
+
+
+def _columns(row) -> dict:
+    return {key: getattr(row, key) for key in _empty()}
+
+
+def aggregate(readings: Iterable, resolutions: Iterable[str] = tuple(RESOLUTIONS)) -> Dict[Tuple, dict]:
+    """
+    Fold readings (SensorData rows or anything with the same attributes) into buckets.
+
+    Returns:
+        {(device_id, resolution, bucket): column values}
+    """
+    out: Dict[Tuple, dict] = {}
+    last_seen: Dict[Tuple, dict] = {}
+    for r in readings:
+        ts = _naive_utc(r.timestamp)
+        if ts is None or r.device_id is None:
+            continue
+        for res in resolutions:
+            key = (r.device_id, res, bucket_start(ts, res))
+            agg = out.get(key)
+            if agg is None:
+                agg = out[key] = _empty()
+                last_seen[key] = {}
+            _fold(agg, last_seen[key], ts, r)
+    return out
+
+
+_upsert_cache: Dict[str, object] = {}
+
+
+def _upsert_statement(dialect: str):
+    """Multi-row INSERT .. ON CONFLICT that merges a partial aggregate into a stored bucket."""
+    from .. import models
+
+    if dialect in _upsert_cache:
+        return _upsert_cache[dialect]
+
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        least, greatest = func.least, func.greatest
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+        least, greatest = func.min, func.max  # Two-argument scalar forms in SQLite
+
+    t = models.SensorRollup.__table__.c
+    stmt = insert(models.SensorRollup.__table__)
+    ex = stmt.excluded
+    newer = or_(t.last_ts.is_(None), ex.last_ts >= t.last_ts)
+    set_ = {
+        "samples": func.coalesce(t.samples, 0) + ex.samples,
+        "last_ts": case((newer, ex.last_ts), else_=t.last_ts),
+    }
+    for m in METRICS:
+        cur = {s: t[f"{m}_{s}"] for s in STATS}
+        new = {s: ex[f"{m}_{s}"] for s in STATS}
+        set_[f"{m}_min"] = least(func.coalesce(cur["min"], new["min"]), func.coalesce(new["min"], cur["min"]))
+        set_[f"{m}_max"] = greatest(func.coalesce(cur["max"], new["max"]), func.coalesce(new["max"], cur["max"]))
+        set_[f"{m}_sum"] = case(
+            (cur["sum"].is_(None), new["sum"]),
+            (new["sum"].is_(None), cur["sum"]),
+            else_=cur["sum"] + new["sum"],
+        )
+        set_[f"{m}_count"] = func.coalesce(cur["count"], 0) + func.coalesce(new["count"], 0)
+        set_[f"{m}_last"] = case(
+            (and_(newer, new["last"].isnot(None)), new["last"]),
+            else_=func.coalesce(cur["last"], new["last"]),
+        )
+    stmt = stmt.on_conflict_do_update(index_elements=["device_id", "resolution", "bucket"], set_=set_)
+    _upsert_cache[dialect] = stmt
+    return stmt
+
+
+def _merge_orm(db, aggs: Dict[Tuple, dict]):
+    """Read-modify-write fallback for databases without ON CONFLICT."""
+    from .. import models
+
+    R = models.SensorRollup
+    for (device_id, res, bucket), agg in aggs.items():
+        row = db.query(R).filter_by(device_id=device_id, resolution=res, bucket=bucket).with_for_update().first()
+        if row is None:
+            db.add(R(device_id=device_id, resolution=res, bucket=bucket, **agg))
+            continue
+        for key, value in _merge(_columns(row), agg).items():
+            setattr(row, key, value)
+
+
+def write(db, aggs: Dict[Tuple, dict]) -> int:
+    """Merge partial aggregates into the table (the caller commits)."""
+    if not aggs:
+        return 0
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        rows = [
+            {"device_id": device_id, "resolution": res, "bucket": bucket, **agg}
+            for (device_id, res, bucket), agg in sorted(aggs.items())  # Stable lock order
+        ]
+        db.execute(_upsert_statement(dialect), rows)
+    else:
+        _merge_orm(db, aggs)
+    return len(aggs)
+
+
+def apply(db, readings: Iterable) -> int:
+    """
+    Fold newly inserted readings into their 1m/1h/1d buckets, in the caller's
+    transaction. Returns the number of buckets touched.
+    """
+    return write(db, aggregate(readings))
+
+
+# --- Reading ---
+def pick_resolution(start: datetime, end: Optional[datetime] = None, max_points: int = ROLLUP_MAX_POINTS) -> str:
+    """Finest resolution still retained for `start` that keeps the range under max_points buckets."""
+    now = datetime.utcnow()
+    start, end = _naive_utc(start), _naive_utc(end) or now
+    span = max((end - start).total_seconds(), 0)
+    for res, step in RESOLUTIONS.items():
+        keep = RETENTION_DAYS[res]
+        if keep is not None and start < now - timedelta(days=keep):
+            continue
+        if span / step <= max_points:
+            return res
+    return "1d"
+
+
+def _point(row) -> dict:
+    point = {"bucket": row.bucket, "samples": row.samples}
+    for m in METRICS:
+        count = getattr(row, f"{m}_count") or 0
+        point[m] = {
+            "min": getattr(row, f"{m}_min"),
+            "max": getattr(row, f"{m}_max"),
+            "mean": getattr(row, f"{m}_sum") / count if count else None,
+            "last": getattr(row, f"{m}_last"),
+            "count": count,
+        }
+    return point
+
+
+def _combine(rows) -> list:
+    """Merge several devices' rows of the same bucket into one."""
+    merged: Dict[datetime, dict] = {}
+    for r in rows:
+        cur = merged.get(r.bucket)
+        if cur is None:
+            merged[r.bucket] = _columns(r)
+        else:
+            _merge(cur, _columns(r))
+    return [SimpleNamespace(bucket=b, **merged[b]) for b in sorted(merged)]
+
+
+def series(db, start: datetime, end: Optional[datetime] = None, device_id: Optional[str] = None,
+           resolution: Optional[str] = None) -> Tuple[str, List[dict]]:
+    """
+    Bucketed series for one device (or all devices combined) over [start, end).
+
+    Returns:
+        (resolution used, [{"bucket", "samples", <metric>: {"min", "max", "mean", "last", "count"}}])
+    """
+    from .. import models
+
+    resolution = resolution or pick_resolution(start, end)
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    R = models.SensorRollup
+    query = db.query(R).filter(R.resolution == resolution, R.bucket >= bucket_start(start, resolution))
+    if end is not None:
+        query = query.filter(R.bucket < _naive_utc(end))
+    if device_id:
+        rows = query.filter(R.device_id == device_id).order_by(R.bucket.asc()).all()
+    else:
+        rows = _combine(query.all())
+    return resolution, [_point(r) for r in rows]
+
+
+def averages(db, start: datetime, end: Optional[datetime] = None, metrics: Iterable[str] = METRICS,
+             device_id: Optional[str] = None) -> Dict[str, Optional[float]]:
+    """
+    Mean of each metric over [start, end) from hourly buckets (daily past the
+    hourly retention). The range is widened to whole buckets.
+    """
+    from .. import models
+
+    R = models.SensorRollup
+    keep = RETENTION_DAYS["1h"]
+    resolution = "1d" if keep is not None and _naive_utc(start) < datetime.utcnow() - timedelta(days=keep) else "1h"
+    metrics = list(metrics)
+    columns = []
+    for m in metrics:
+        columns += [func.sum(getattr(R, f"{m}_sum")), func.sum(getattr(R, f"{m}_count"))]
+    query = db.query(*columns).filter(R.resolution == resolution, R.bucket >= bucket_start(start, resolution))
+    if end is not None:
+        query = query.filter(R.bucket < _naive_utc(end))
+    if device_id:
+        query = query.filter(R.device_id == device_id)
+    totals = query.one()
+    return {
+        m: (totals[2 * i] / totals[2 * i + 1]) if totals[2 * i + 1] else None
+        for i, m in enumerate(metrics)
+    }
+
+
+# --- Compaction ---
+def prune(db, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Delete buckets past their resolution's retention (the caller commits)."""
+    from .. import models
+
+    now = now or datetime.utcnow()
+    R = models.SensorRollup
+    deleted = {}
+    for res, keep in RETENTION_DAYS.items():
+        if keep is None:
+            continue
+        deleted[res] = db.query(R).filter(
+            R.resolution == res, R.bucket < now - timedelta(days=keep)
+        ).delete(synchronize_session=False)
+    return deleted
+
+
+def rebuild(db, start: datetime, device_id: Optional[str] = None, chunk: int = 50000) -> int:
+    """
+    Recompute every bucket from `start` (aligned to the day) up to now from raw
+    SensorData. Existing buckets in that range are replaced. Readings ingested
+    while a rebuild runs may be counted twice; run it at quiet times.
+
+    Returns:
+        Number of raw readings folded
+    """
+    from .. import models
+
+    SD, R = models.SensorData, models.SensorRollup
+    start = bucket_start(start, "1d")
+    now = datetime.utcnow()
+    keep_1m = RETENTION_DAYS["1m"]
+    minute_cutoff = now - timedelta(days=keep_1m) if keep_1m is not None else None
+
+    delete = db.query(R).filter(R.bucket >= start)
+    if device_id:
+        delete = delete.filter(R.device_id == device_id)
+    delete.delete(synchronize_session=False)
+
+    query = db.query(SD.device_id, SD.timestamp, *(getattr(SD, m) for m in METRICS)).filter(SD.timestamp >= start)
+    if device_id:
+        query = query.filter(SD.device_id == device_id)
+    query = query.order_by(SD.timestamp.asc()).execution_options(yield_per=chunk)
+
+    folded, pending, old, recent = 0, {}, [], []
+    for row in query:
+        # 1m buckets are only built inside their retention window
+        (recent if minute_cutoff is None or row.timestamp >= minute_cutoff else old).append(row)
+        folded += 1
+        if len(old) + len(recent) >= chunk:
+            pending = _merge_pending(pending, aggregate(old, ("1h", "1d")), aggregate(recent))
+            old, recent = [], []
+            if len(pending) >= ROLLUP_FLUSH_BUCKETS:
+                write(db, pending)
+                pending = {}
+    pending = _merge_pending(pending, aggregate(old, ("1h", "1d")), aggregate(recent))
+    write(db, pending)
+    return folded
+
+
+def _merge_pending(pending: dict, *parts: dict) -> dict:
+    for part in parts:
+        for key, agg in part.items():
+            if key in pending:
+                _merge(pending[key], agg)
+            else:
+                pending[key] = agg
+    return pending
+
+
+def compact(backfill: bool = False) -> dict:
+    """One compaction pass in its own session: optional empty-table backfill, then pruning."""
+    from .. import database, models
+
+    db = database.SessionLocal()
+    try:
+        result = {}
+        if backfill and db.query(models.SensorRollup.id).first() is None \
+                and db.query(models.SensorData.id).first() is not None:
+            result["backfilled"] = rebuild(db, datetime.utcnow() - timedelta(days=ROLLUP_BACKFILL_DAYS))
+            print(f"[Rollups] Backfilled {result['backfilled']} readings from the last {ROLLUP_BACKFILL_DAYS} days")
+        result["pruned"] = prune(db)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def compaction_loop(interval_seconds: int = ROLLUP_COMPACT_INTERVAL):
+    """Background task: backfill once if the table is empty, then prune periodically."""
+    backfill = True
+    while True:
+        try:
+            await asyncio.to_thread(compact, backfill)
+            backfill = False
+        except Exception as e:
+            print(f"[Rollups] Compaction error: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,170 @@
+"""
+Two-tier cache for /api/pro/current upstream data (OpenWeather + OpenAQ).
+- L1: in-process APICache keyed by location, fresh for PRO_SNAPSHOT_TTL and
+  served stale for as long again while one background refresh runs.
+- L2: the `api_snapshots` table (indexed on (location, created_at)). An L1
+  miss reads the newest snapshot still within the TTL, so restarts and other
+  workers share upstream calls.
+- Write-through: every upstream fetch is appended to `api_snapshots` off the
+  request path, which also gives /api/pro/history a continuous series.
+Concurrent misses for one location share a single load (APICache single-flight).
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from .. import database, models
+from . import external_apis
+from .api_cache import APICache
+
+PRO_SNAPSHOT_TTL = int(os.getenv("PRO_SNAPSHOT_TTL", "300"))
+PRO_SNAPSHOT_MAX_LOCATIONS = int(os.getenv("PRO_SNAPSHOT_MAX_LOCATIONS", "1024"))
+
+snapshot_cache = APICache(
+    ttl_seconds=PRO_SNAPSHOT_TTL,
+    stale_seconds=PRO_SNAPSHOT_TTL,
+    max_entries=PRO_SNAPSHOT_MAX_LOCATIONS,
+    name="pro_snapshots",
+)
+_stats = {"l2_hits": 0, "upstream": 0, "writes": 0, "write_errors": 0}
+_pending_writes = set()
+
+
+def location_key(lat: float, lon: float) -> str:
+    """Snapshot key: "lat,lon" at 4 decimals (~11 m), as stored in api_snapshots.location."""
+    return f"{lat:.4f},{lon:.4f}"
+
+
+def _from_row(row: models.APISnapshot) -> dict:
+    return {
+        "weather": {
+            "temp": row.temp,
+            "humidity": row.humidity,
+            "pressure": row.pressure if row.pressure is not None else 1013,
+            "wind_speed": row.wind_speed if row.wind_speed is not None else 0,
+        },
+        "air_quality": {
+            "pm25": row.pm2_5, "pm10": row.pm10, "no2": row.no2,
+            "o3": row.o3, "so2": row.so2, "co": row.co, "aqi": row.aqi,
+        },
+        "source": row.source,
+        "created_at": row.created_at,
+    }
+
+
+def _read_l2(key: str) -> Optional[dict]:
+    """Newest snapshot for `key` younger than the TTL (uses ix_api_snapshots_location_created)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=PRO_SNAPSHOT_TTL)
+    db = database.SessionLocal()
+    try:
+        row = db.query(models.APISnapshot).filter(
+            models.APISnapshot.location == key,
+            models.APISnapshot.created_at > cutoff,
+        ).order_by(models.APISnapshot.created_at.desc()).first()
+        return _from_row(row) if row else None
+    finally:
+        db.close()
+
+
+def _write_l2(key: str, snapshot: dict):
+    w, aq = snapshot["weather"], snapshot["air_quality"]
+    db = database.SessionLocal()
+    try:
+        db.add(models.APISnapshot(
+            location=key,
+            temp=w.get("temp"),
+            humidity=w.get("humidity"),
+            pressure=w.get("pressure"),
+            wind_speed=w.get("wind_speed"),
+            aqi=aq.get("aqi"),
+            pm2_5=aq.get("pm25"),
+            pm10=aq.get("pm10"),
+            co=aq.get("co"),
+            o3=aq.get("o3"),
+            no2=aq.get("no2"),
+            so2=aq.get("so2"),
+            source=snapshot["source"],
+            created_at=snapshot["created_at"],
+        ))
+        db.commit()
+        _stats["writes"] += 1
+    except Exception as e:
+        db.rollback()
+        _stats["write_errors"] += 1
+        print(f"[SnapshotCache] Write error: {e}")
+    finally:
+        db.close()
+
+
+def _schedule_write(key: str, snapshot: dict):
+    task = asyncio.create_task(asyncio.to_thread(_write_l2, key, snapshot))
+    _pending_writes.add(task)  # Keep a reference until the write finishes
+    task.add_done_callback(_pending_writes.discard)
+
+
+async def _load(key: str, lat: float, lon: float) -> Tuple[Optional[dict], str]:
+    """L1 miss/refresh: L2 first, then upstream (written through to L2). Returns (snapshot, tier)."""
+    snapshot = await asyncio.to_thread(_read_l2, key)
+    if snapshot:
+        _stats["l2_hits"] += 1
+        return snapshot, "db"
+
+    _stats["upstream"] += 1
+    weather, aq = await asyncio.gather(
+        external_apis.fetch_open_weather(lat, lon),
+        external_apis.fetch_air_quality(lat, lon),
+        return_exceptions=True,
+    )
+    weather = weather if isinstance(weather, dict) else {}
+    aq = aq if isinstance(aq, dict) else {}
+    if not weather and not aq:
+        return None, "live"  # Nothing to cache; the next request retries upstream
+
+    sources = [s for s in (weather.get("source"), aq.get("source")) if s]
+    snapshot = {
+        "weather": weather,
+        "air_quality": aq,
+        "source": " + ".join(sources) or "Live",
+        "created_at": datetime.utcnow(),
+    }
+    _schedule_write(key, snapshot)
+    return snapshot, "live"
+
+
+async def get_snapshot(lat: float, lon: float) -> Optional[dict]:
+    """
+    Current upstream weather + air quality for a location through both cache tiers.
+
+    Returns:
+        {"weather", "air_quality", "source", "created_at", "tier"} or None when
+        no upstream answered and nothing is cached. `tier` is where this
+        request's answer came from: "memory", "db" or "live".
+    """
+    key = location_key(lat, lon)
+    tier = ["memory"]
+
+    async def load():
+        snapshot, tier[0] = await _load(key, lat, lon)
+        return snapshot
+
+    snapshot = await snapshot_cache.get_or_load(key, load)
+    return {**snapshot, "tier": tier[0]} if snapshot else None
+
+
+def peek(lat: float, lon: float) -> Optional[Tuple[dict, float]]:
+    """(snapshot, age in seconds) held in memory for the location, fresh or stale."""
+    cached = snapshot_cache.peek(location_key(lat, lon))
+    if not cached or not cached[0]:
+        return None
+    snapshot = {**cached[0], "tier": "memory"}
+    return snapshot, age_seconds(snapshot)
+
+
+def age_seconds(snapshot: dict) -> float:
+    """Seconds since the snapshot was fetched upstream."""
+    return max(0.0, (datetime.utcnow() - snapshot["created_at"]).total_seconds())
+
+
+def stats() -> dict:
+    return {**_stats, "pending_writes": len(_pending_writes), "l1": snapshot_cache.stats()}
@@ -1,4 +1,4 @@
-import httpx
+from . import http_client
 
 async def get_current_weather(lat: float, lon: float):
     url = "https://api.open-meteo.com/v1/forecast"
@@ -7,11 +7,8 @@ async def get_current_weather(lat: float, lon: float):
         "longitude": lon,
         "current_weather": "true"
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("current_weather", {})
+    data = await http_client.get_json(url, params=params)
+    return data.get("current_weather", {})
 
 def calculate_rainfall_prediction(humidity: float, wind_speed: float, pressure: float = 1013.0) -> dict:
     """
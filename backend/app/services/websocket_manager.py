@@ -1,33 +1,173 @@
-from typing import List, Dict
+"""
+WebSocket fan-out for live dashboards.
+Each broadcast is serialized once and handed to every subscriber's bounded
+send queue; a per-connection writer task drains the queue, so the ingest
+request that triggered the broadcast never waits on a client.
+
+- Backpressure: when a client lags and its queue is full, the oldest queued
+  messages are dropped (newer readings supersede them).
+- Reaping: a send that fails or exceeds WS_SEND_TIMEOUT closes and removes
+  the connection.
+- Heartbeats: idle connections get a {"type": "heartbeat"} frame every
+  WS_HEARTBEAT_SECONDS so proxies keep them open and dead peers are detected.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
 from fastapi import WebSocket
 
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "32"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "25"))
+
+
+class ClientConnection:
+    """One dashboard socket with its bounded outbound queue and writer task."""
+    __slots__ = ("websocket", "device_id", "queue", "wakeup", "writer", "closed", "sent", "dropped", "connected_at")
+
+    def __init__(self, websocket: WebSocket, device_id: str, queue_size: int = WS_QUEUE_SIZE):
+        self.websocket = websocket
+        self.device_id = device_id
+        self.queue: deque = deque(maxlen=queue_size)
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.connected_at = time.time()
+
+    def offer(self, text: str):
+        """Queue a serialized frame without waiting (drops the oldest when full)."""
+        if self.closed:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(text)
+        self.wakeup.set()
+
+    async def _send(self, text: str):
+        await asyncio.wait_for(self.websocket.send_text(text), WS_SEND_TIMEOUT)
+        self.sent += 1
+
+    async def run(self, on_failure):
+        """Writer loop: drain the queue, or send a heartbeat after an idle period."""
+        try:
+            while not self.closed:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), WS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    await self._send(json.dumps({"type": "heartbeat", "ts": time.time()}))
+                    continue
+                self.wakeup.clear()
+                while self.queue and not self.closed:
+                    await self._send(self.queue.popleft())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"WS: Dropping client of {self.device_id}: {e!r}")
+            await on_failure(self)
+
+
 class ConnectionManager:
     def __init__(self):
-        # active_connections: { "device_id": [WebSocket, WebSocket...] }
+        # active_connections: { "device_id": [ClientConnection, ...] }
         # This allows multiple clients (dashboards) to watch the same device
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.active_connections: Dict[str, List[ClientConnection]] = {}
+        self.messages = 0
+        self.reaped = 0
 
-    async def connect(self, websocket: WebSocket, device_id: str):
+    async def connect(self, websocket: WebSocket, device_id: str) -> ClientConnection:
         await websocket.accept()
-        if device_id not in self.active_connections:
-            self.active_connections[device_id] = []
-        self.active_connections[device_id].append(websocket)
+        client = ClientConnection(websocket, device_id)
+        client.writer = asyncio.create_task(client.run(self._reap))
+        self.active_connections.setdefault(device_id, []).append(client)
         print(f"WS: Client connected to {device_id}")
+        return client
+
+    def _remove(self, websocket: WebSocket, device_id: str) -> Optional[ClientConnection]:
+        clients = self.active_connections.get(device_id)
+        if not clients:
+            return None
+        for client in clients:
+            if client.websocket is websocket:
+                clients.remove(client)
+                if not clients:
+                    del self.active_connections[device_id]
+                client.closed = True
+                return client
+        return None
 
     def disconnect(self, websocket: WebSocket, device_id: str):
-        if device_id in self.active_connections:
-            if websocket in self.active_connections[device_id]:
-                self.active_connections[device_id].remove(websocket)
-            if not self.active_connections[device_id]:
-                del self.active_connections[device_id]
+        client = self._remove(websocket, device_id)
+        if client and client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
         print(f"WS: Client disconnected from {device_id}")
 
-    async def broadcast(self, message: dict, device_id: str):
-        if device_id in self.active_connections:
-            for connection in self.active_connections[device_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    print(f"WS Error broadcasting to {device_id}: {e}")
+    async def _reap(self, client: ClientConnection):
+        """Remove a client whose send failed and close its socket (ends its receive loop)."""
+        if self._remove(client.websocket, client.device_id):
+            self.reaped += 1
+        try:
+            await asyncio.wait_for(client.websocket.close(code=1011), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    @staticmethod
+    def serialize(message: dict) -> str:
+        return json.dumps(message, default=str)
+
+    def broadcast(self, message: dict, device_id: str) -> int:
+        """
+        Serialize `message` once and queue it for every local client of `device_id`.
+        Never blocks on the network. Ingest paths use pubsub.publish() instead,
+        which also reaches clients connected to other workers.
+
+        Returns:
+            Number of clients the message was queued for
+        """
+        if not self.active_connections.get(device_id):
+            return 0
+        return self.broadcast_text(self.serialize(message), device_id)
+
+    def broadcast_text(self, text: str, device_id: str) -> int:
+        """broadcast() for an already serialized frame."""
+        clients = self.active_connections.get(device_id)
+        if not clients:
+            return 0
+        for client in clients:
+            client.offer(text)
+        self.messages += 1
+        return len(clients)
+
+    async def close_all(self):
+        """Cancel writers and close every socket (app shutdown)."""
+        clients = [c for group in self.active_connections.values() for c in group]
+        self.active_connections.clear()
+        for client in clients:
+            client.closed = True
+            if client.writer:
+                client.writer.cancel()
+        for client in clients:
+            try:
+                await asyncio.wait_for(client.websocket.close(code=1001), 1.0)
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        clients = [c for group in self.active_connections.values() for c in group]
+        return {
+            "devices": len(self.active_connections),
+            "clients": len(clients),
+            "messages": self.messages,
+            "reaped": self.reaped,
+            "queued": sum(len(c.queue) for c in clients),
+            "dropped": sum(c.dropped for c in clients),
+            "queue_size": WS_QUEUE_SIZE,
+        }
+
 
 manager = ConnectionManager()
@@ -0,0 +1,100 @@
+"""
+Backfill kalman_temp / kalman_hum / kalman_press for stored SensorData rows
+using the vectorized batch filter (one pass per device, in timestamp order).
+
+Usage:
+    python backfill_kalman.py                 # all devices
+    python backfill_kalman.py --device ID     # one device
+    python backfill_kalman.py --only-missing  # skip devices already filled
+"""
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import update
+
+from app import database, models
+from app.services.kalman_batch import smooth_metric
+
+COLUMNS = [
+    # (source column, target column, filter params key)
+    ("temperature", "kalman_temp", "temperature"),
+    ("humidity", "kalman_hum", "humidity"),
+    ("pressure", "kalman_press", "pressure"),
+]
+READ_CHUNK = 50000
+WRITE_CHUNK = 5000
+
+
+def load_series(db, device_id):
+    """Stream a device's rows (id + raw metrics) into numpy arrays."""
+    SD = models.SensorData
+    query = db.query(SD.id, SD.temperature, SD.humidity, SD.pressure).filter(
+        SD.device_id == device_id
+    ).order_by(SD.timestamp.asc(), SD.id.asc()).execution_options(yield_per=READ_CHUNK)
+
+    ids, cols = [], {src: [] for src, _, _ in COLUMNS}
+    for row in query:
+        ids.append(row.id)
+        for src, _, _ in COLUMNS:
+            value = getattr(row, src)
+            cols[src].append(np.nan if value is None else value)
+    return np.array(ids, dtype=np.int64), {k: np.array(v, dtype=float) for k, v in cols.items()}
+
+
+def backfill_device(db, device_id):
+    ids, series = load_series(db, device_id)
+    if ids.size == 0:
+        return 0
+
+    smoothed = {dst: smooth_metric(series[src], key)["filtered"] for src, dst, key in COLUMNS}
+
+    for start in range(0, ids.size, WRITE_CHUNK):
+        end = start + WRITE_CHUNK
+        params = []
+        for i in range(start, min(end, ids.size)):
+            params.append({
+                "id": int(ids[i]),
+                **{dst: (None if np.isnan(v[i]) else round(float(v[i]), 4)) for dst, v in smoothed.items()}
+            })
+        # ORM bulk UPDATE by primary key (executemany)
+        db.execute(update(models.SensorData), params)
+        db.commit()
+    return int(ids.size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill Kalman-smoothed columns on sensor_data")
+    parser.add_argument("--device", help="Only backfill this device id")
+    parser.add_argument("--only-missing", action="store_true", help="Skip devices whose rows already have kalman_temp")
+    args = parser.parse_args()
+
+    db = database.SessionLocal()
+    try:
+        if args.device:
+            device_ids = [args.device]
+        else:
+            q = db.query(models.SensorData.device_id).distinct()
+            device_ids = [d for (d,) in q.all()]
+
+        total = 0
+        started = time.time()
+        for device_id in device_ids:
+            if args.only_missing:
+                pending = db.query(models.SensorData.id).filter(
+                    models.SensorData.device_id == device_id,
+                    models.SensorData.kalman_temp == None
+                ).first()
+                if not pending:
+                    continue
+            count = backfill_device(db, device_id)
+            total += count
+            print(f"✅ {device_id}: {count} rows smoothed")
+
+        print(f"Done: {total} rows across {len(device_ids)} devices in {time.time() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
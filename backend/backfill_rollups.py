@@ -0,0 +1,40 @@
+"""
+Rebuild sensor_rollups (1m/1h/1d buckets) from raw sensor_data.
+
+Usage:
+    python backfill_rollups.py                 # last 30 days, all devices
+    python backfill_rollups.py --days 365      # longer history (1m buckets only within retention)
+    python backfill_rollups.py --device ID     # one device
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from app import database, models
+from app.services import rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild sensor_rollups from sensor_data")
+    parser.add_argument("--days", type=int, default=rollups.ROLLUP_BACKFILL_DAYS, help="History to rebuild (default: %(default)s)")
+    parser.add_argument("--device", help="Only rebuild this device id")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine, tables=[models.SensorRollup.__table__])
+    db = database.SessionLocal()
+    try:
+        started = time.time()
+        folded = rollups.rebuild(db, datetime.utcnow() - timedelta(days=args.days), device_id=args.device)
+        pruned = rollups.prune(db)
+        db.commit()
+        buckets = db.query(models.SensorRollup.id).count()
+        print(f"✅ Folded {folded} readings into {buckets} buckets in {time.time() - started:.1f}s (pruned: {pruned})")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Rollup backfill failed: {e}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,4 +9,7 @@ python -m pip install --upgrade pip
 echo "Installing dependencies..."
 pip install -r requirements.txt
 
+echo "Building offline gazetteer index..."
+python build_gazetteer.py || echo "Gazetteer build skipped (city geocoding falls back to the Open-Meteo API)"
+
 echo "Build script finished."
@@ -0,0 +1,73 @@
+"""
+Build the offline gazetteer index (app/services/gazetteer.py) from a GeoNames dump.
+
+Usage:
+    python build_gazetteer.py                              # download cities15000 (~25k places)
+    python build_gazetteer.py --source cities5000.zip      # local dump (.txt or .zip)
+    python build_gazetteer.py --alternate-names            # also index ASCII alternate names (larger file)
+"""
+import argparse
+import io
+import os
+import time
+import zipfile
+
+from app.services import gazetteer
+from app.services.http_client import sync_get
+
+GEONAMES_URL = "https://download.geonames.org/export/dump/{name}.zip"
+
+
+def read_dump(source: str):
+    """Lines of a GeoNames cities dump given as a path or a dump name (downloaded)."""
+    if os.path.exists(source):
+        if source.endswith(".zip"):
+            with zipfile.ZipFile(source) as z:
+                return z.read(z.namelist()[0]).decode("utf-8").splitlines()
+        with open(source, encoding="utf-8") as f:
+            return f.read().splitlines()
+    url = GEONAMES_URL.format(name=source)
+    print(f"Downloading {url} ...")
+    response = sync_get(url, timeout=120)
+    response.raise_for_status()
+    with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+        return z.read(f"{source}.txt").decode("utf-8").splitlines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the gazetteer index from GeoNames")
+    parser.add_argument("--source", default="cities15000", help="Dump file (.txt/.zip) or GeoNames dump name (default: %(default)s)")
+    parser.add_argument("--output", default=gazetteer.GAZETTEER_PATH, help="Index file (default: %(default)s)")
+    parser.add_argument("--alternate-names", action="store_true", help="Also index ASCII alternate names")
+    args = parser.parse_args()
+
+    started = time.time()
+    places, keys = [], {}
+    for line in read_dump(args.source):
+        cols = line.split("\t")
+        if len(cols) < 18:
+            continue
+        idx = len(places)
+        places.append({
+            "name": cols[1],
+            "lat": float(cols[4]),
+            "lon": float(cols[5]),
+            "country": cols[8],
+            "population": int(cols[14] or 0),
+            "timezone": cols[17],
+        })
+        names = {cols[1], cols[2]}
+        if args.alternate_names:
+            names.update(n for n in cols[3].split(",") if n.isascii() and len(n) <= 40)
+        for name in names:
+            key = gazetteer.normalize(name)
+            if key:
+                keys.setdefault(key, []).append(idx)
+
+    gazetteer.write_index(args.output, places, keys)
+    size = os.path.getsize(args.output) / 1e6
+    print(f"✅ Indexed {len(places)} places under {len(keys)} names -> {args.output} ({size:.1f} MB) in {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
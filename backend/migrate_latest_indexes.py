@@ -0,0 +1,29 @@
+from app import database, models
+from app.services import latest_store
+from sqlalchemy import text
+
+def migrate():
+    print("Starting migration: sensor_data indexes + device_latest table...")
+    try:
+        with database.engine.connect() as conn:
+            # Supported by both PostgreSQL and SQLite
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sensor_data_device_ts ON sensor_data (device_id, timestamp)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sensor_data_timestamp ON sensor_data (timestamp)"))
+            conn.commit()
+            print("✅ Successfully indexed sensor_data (device_id, timestamp) and (timestamp).")
+
+        models.Base.metadata.create_all(bind=database.engine, tables=[models.DeviceLatest.__table__])
+        db = database.SessionLocal()
+        try:
+            if not db.query(models.DeviceLatest).first():
+                seeded = latest_store.seed_from_sensor_data(db)
+                db.commit()
+                print(f"✅ Seeded device_latest with {seeded} devices.")
+        finally:
+            db.close()
+
+    except Exception as e:
+        print(f"❌ Migration Error: {e}")
+
+if __name__ == "__main__":
+    migrate()
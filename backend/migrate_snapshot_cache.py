@@ -0,0 +1,30 @@
+from app import database
+from sqlalchemy import text
+
+def migrate():
+    print("Starting migration: api_snapshots pressure/wind columns + (location, created_at) index...")
+    try:
+        with database.engine.connect() as conn:
+            if database.engine.dialect.name == "postgresql":
+                conn.execute(text("ALTER TABLE api_snapshots ADD COLUMN IF NOT EXISTS pressure FLOAT"))
+                conn.execute(text("ALTER TABLE api_snapshots ADD COLUMN IF NOT EXISTS wind_speed FLOAT"))
+            else:
+                # SQLite has no ADD COLUMN IF NOT EXISTS
+                existing = {row[1] for row in conn.execute(text("PRAGMA table_info(api_snapshots)"))}
+                for column in ("pressure", "wind_speed"):
+                    if column not in existing:
+                        conn.execute(text(f"ALTER TABLE api_snapshots ADD COLUMN {column} FLOAT"))
+            conn.commit()
+            print("✅ Successfully added pressure and wind_speed to api_snapshots.")
+
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_api_snapshots_location_created ON api_snapshots (location, created_at)"
+            ))
+            conn.commit()
+            print("✅ Successfully indexed api_snapshots (location, created_at).")
+
+    except Exception as e:
+        print(f"❌ Migration Error: {e}")
+
+if __name__ == "__main__":
+    migrate()
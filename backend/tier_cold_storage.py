@@ -0,0 +1,35 @@
+"""
+Move aged sensor_data / api_snapshots rows into the Parquet cold tier.
+
+Usage:
+    python tier_cold_storage.py              # rows older than COLD_AFTER_DAYS (default 90)
+    python tier_cold_storage.py --days 30
+    python tier_cold_storage.py --table sensor_data
+"""
+import argparse
+import time
+
+from app.services import cold_storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tier aged rows to Parquet files")
+    parser.add_argument("--days", type=int, default=cold_storage.COLD_AFTER_DAYS, help="Age threshold in days (default: %(default)s)")
+    parser.add_argument("--table", choices=sorted(cold_storage.TABLES), help="Only tier this table")
+    args = parser.parse_args()
+
+    if not cold_storage.PARQUET_AVAILABLE:
+        print("❌ pyarrow is not installed (pip install pyarrow)")
+        return
+
+    tables = [args.table] if args.table else list(cold_storage.TABLES)
+    for table in tables:
+        started = time.time()
+        stats = cold_storage.tier(table, args.days)
+        print(f"✅ {table}: {stats['rows']} rows -> {stats['partitions']} files "
+              f"({stats['keys']} keys) in {time.time() - started:.1f}s")
+    print(f"Cold storage: {cold_storage.COLD_STORAGE_DIR}")
+
+
+if __name__ == "__main__":
+    main()